@@ -1,10 +1,14 @@
 from flask import Flask
 from flasgger import Swagger
 from app.routes import register_blueprints
+from app.commands import register_commands
+from app.telemetry import instrument_app
 from flask_login import LoginManager
 from app.data import User, database
-from bson import ObjectId
-from app.config import FLASK_SECRET_KEY
+from app.indexes import ensure_indexes
+from app.jobs import start_recovery
+from app.repository import repository
+from app.config import FLASK_SECRET_KEY, ENSURE_INDEXES, DATA_BACKEND
 
 # Описание инициализации Flask приложения
 def create_app():
@@ -19,7 +23,7 @@ def create_app():
     @login.user_loader
     def load_user(user_id):
         try:
-            user_data = database.users.find_one({"_id": ObjectId(user_id)})
+            user_data = repository.get_user(user_id)
             if user_data:
                 return User(user_data["_id"], user_data["username"])
         except Exception as e:
@@ -29,5 +33,21 @@ def create_app():
     login.init_app(app)
 
     register_blueprints(app)  # Регистрация всех возможных endpoints (api, pages)
+    register_commands(app)  # Команды обслуживания (flask rebuild-stats и др.)
+    instrument_app(app)  # Метрики запросов для GET /metrics
+
+    # Индексы создаются один раз при запуске; если это не удалось (например,
+    # в users есть повторяющиеся email), приложение все равно запускается
+    if ENSURE_INDEXES and DATA_BACKEND == "mongo":
+        try:
+            ensure_indexes(database)
+        except Exception as e:
+            print(f"[ensure_indexes error] {e}")
+
+    # Фоновые задачи, прерванные перезапуском, подхватываются заново в отдельном
+    # потоке, а лишние файлы каталога загрузок удаляются (app/jobs.py). Поток
+    # запускается с первым запросом, поэтому команды flask его не запускают.
+    if DATA_BACKEND == "mongo":
+        app.before_request(start_recovery)
 
     return app
@@ -0,0 +1,144 @@
+import bz2
+from functools import partial
+import gzip
+import lzma
+import posixpath
+import zipfile
+import zlib
+from app.config import MAX_ARCHIVE_MEMBERS, MAX_DECOMPRESSED_SIZE
+from app.utils import ARCHIVE_EXTENSIONS, allowed_text_file
+
+# Распаковывающие потоки для сжатых файлов с одним файлом внутри
+DECOMPRESSORS = {"gz": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+# Ошибки, которыми распаковщики сообщают о поврежденных данных
+DECOMPRESSION_ERRORS = (
+    OSError,
+    EOFError,
+    lzma.LZMAError,
+    zlib.error,
+    zipfile.BadZipFile,
+)
+
+
+# Ошибка сжатой загрузки: поврежденные данные, превышение лимитов
+# или архив без текстовых файлов. Текст ошибки возвращается клиенту.
+class ArchiveError(ValueError):
+    pass
+
+
+# Поток распакованных байт с ограничением размера: как только распаковано больше
+# limit байт, чтение прерывается, поэтому "бомба" не распаковывается целиком.
+# message - текст ошибки превышения лимита (по умолчанию называет сам limit).
+# Ошибки распаковщика превращаются в ArchiveError.
+class LimitedStream:
+    def __init__(self, stream, limit: int, message: str = None):
+        self.stream = stream
+        self.limit = limit
+        self.message = message or f"Размер распакованных данных превышает {limit} байт"
+        self.size = 0
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            data = self.stream.read(size)
+        except DECOMPRESSION_ERRORS as e:
+            raise ArchiveError(f"Поврежденный сжатый файл: {e}")
+        self.size += len(data)
+        if self.size > self.limit:
+            raise ArchiveError(self.message)
+        return data
+
+
+# Текстовые файлы архива .zip в порядке записи: каталоги, служебные файлы
+# (__MACOSX, скрытые) и файлы с недопустимыми расширениями пропускаются
+def archive_members(archive: zipfile.ZipFile) -> list:
+    members = [
+        info
+        for info in archive.infolist()
+        if not info.is_dir()
+        and not any(
+            part.startswith(".") or part == "__MACOSX"
+            for part in info.filename.split("/")
+        )
+        and allowed_text_file(posixpath.basename(info.filename))
+    ]
+    if not members:
+        raise ArchiveError("В архиве нет файлов с допустимым расширением")
+    if len(members) > MAX_ARCHIVE_MEMBERS:
+        raise ArchiveError(f"В архиве больше {MAX_ARCHIVE_MEMBERS} файлов")
+    if any(info.flag_bits & 0x1 for info in members):
+        raise ArchiveError("Зашифрованные архивы не поддерживаются")
+    # Заявленные размеры проверяются сразу, фактические - при чтении
+    if sum(info.file_size for info in members) > MAX_DECOMPRESSED_SIZE:
+        raise ArchiveError(_archive_limit_message())
+    return members
+
+
+def _archive_limit_message() -> str:
+    return (
+        "Суммарный размер распакованных файлов архива превышает "
+        f"{MAX_DECOMPRESSED_SIZE} байт"
+    )
+
+
+def open_archive(stream) -> zipfile.ZipFile:
+    try:
+        return zipfile.ZipFile(stream)
+    except (zipfile.BadZipFile, zipfile.LargeZipFile) as e:
+        raise ArchiveError(f"Поврежденный архив: {e}")
+
+
+# Потоки распакованных байт файлов архива. Лимит размера общий на весь архив:
+# каждый следующий файл получает остаток лимита, а ошибка называет общий лимит.
+def _member_streams(archive: zipfile.ZipFile, members: list):
+    left = MAX_DECOMPRESSED_SIZE
+    message = _archive_limit_message()
+    for info in members:
+        try:
+            member = archive.open(info)
+        except (zipfile.BadZipFile, NotImplementedError) as e:
+            raise ArchiveError(f"Поврежденный архив: {e}")
+        with member:
+            stream = LimitedStream(member, left, message)
+            yield stream
+            left -= stream.size
+
+
+# Открывает загруженный файл по расширению имени, без распаковки в память:
+# для обычного файла - сам поток, для сжатого - распаковывающий поток,
+# для архива .zip - по потоку на каждый текстовый файл.
+# Возвращает (итератор потоков байт, оценка размера текста в байтах).
+# Для сжатых файлов размер текста заранее неизвестен, оценкой служит размер
+# сжатого файла (оценка снизу), для архива - сумма заявленных размеров файлов.
+def open_upload(stream, filename: str) -> tuple:
+    size = stream.seek(0, 2)
+    stream.seek(0)
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension in ARCHIVE_EXTENSIONS:
+        archive = open_archive(stream)
+        members = archive_members(archive)
+        size = sum(info.file_size for info in members)
+        return _member_streams(archive, members), size
+    if extension in DECOMPRESSORS:
+        decompressor = DECOMPRESSORS[extension](stream, "rb")
+        return iter([LimitedStream(decompressor, MAX_DECOMPRESSED_SIZE)]), size
+    return iter([stream]), size
+
+
+def _open_member(archive: zipfile.ZipFile, info: zipfile.ZipInfo) -> tuple:
+    return _member_streams(archive, [info]), info.file_size
+
+
+# Загруженный файл как список будущих документов пакетной загрузки:
+# [(имя документа, функция открытия -> результат как у open_upload)].
+# Архив .zip дает по документу на каждый текстовый файл (имя - путь в архиве),
+# остальные файлы - один документ. Сами файлы открываются функцией открытия,
+# чтобы распаковка шла там, где документ обрабатывается.
+def split_upload(stream, filename: str) -> list:
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension in ARCHIVE_EXTENSIONS:
+        archive = open_archive(stream)
+        return [
+            (info.filename, partial(_open_member, archive, info))
+            for info in archive_members(archive)
+        ]
+    return [(filename, partial(open_upload, stream, filename))]
@@ -0,0 +1,249 @@
+import hashlib
+import os
+import tempfile
+import time
+import zlib
+from bson import ObjectId
+from gridfs import GridFSBucket, NoFile
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.config import BLOB_BACKEND, BLOB_DIR, UPLOAD_CHUNK_SIZE
+
+# Пауза между попытками взять ссылку на блоб, который сейчас удаляется, и время,
+# после которого пометку удаления, оставленную упавшим процессом, можно снять
+RETAIN_RETRY_DELAY = 0.05
+DELETE_MARK_TIMEOUT = 60
+
+
+# Хранение сжатых блобов в GridFS. Блоб пишется под временным именем,
+# после записи переименовывается в свой SHA-256; если такой блоб уже есть,
+# только что записанная копия удаляется.
+class GridFSStorage:
+    def __init__(self, db):
+        self.bucket = GridFSBucket(db, bucket_name="blobs")
+
+    def create(self):
+        return self.bucket.open_upload_stream_with_id(ObjectId(), "pending")
+
+    def commit(self, upload, key: str):
+        upload.close()
+        if self.exists(key):
+            self.bucket.delete(upload._id)
+        else:
+            self.bucket.rename(upload._id, key)
+
+    def discard(self, upload):
+        upload.abort()
+
+    def exists(self, key: str) -> bool:
+        for _ in self.bucket.find({"filename": key}, limit=1):
+            return True
+        return False
+
+    def read(self, key: str):
+        try:
+            stream = self.bucket.open_download_stream_by_name(key)
+        except NoFile:
+            raise KeyError(key)
+        with stream:
+            while True:
+                chunk = stream.readchunk()
+                if not chunk:
+                    return
+                yield chunk
+
+    def delete(self, key: str):
+        for grid_out in self.bucket.find({"filename": key}):
+            self.bucket.delete(grid_out._id)
+
+
+# Хранение сжатых блобов в файлах каталога root: root/ab/abcdef...
+# Файл пишется во временный и атомарно переносится на место.
+class FileStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def create(self):
+        os.makedirs(self.root, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.root, suffix=".tmp", delete=False)
+
+    def commit(self, upload, key: str):
+        upload.close()
+        if self.exists(key):
+            os.remove(upload.name)
+        else:
+            os.makedirs(os.path.dirname(self._path(key)), exist_ok=True)
+            os.replace(upload.name, self._path(key))
+
+    def discard(self, upload):
+        upload.close()
+        os.remove(upload.name)
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self._path(key))
+
+    def read(self, key: str):
+        try:
+            file = open(self._path(key), "rb")
+        except FileNotFoundError:
+            raise KeyError(key)
+        with file:
+            while chunk := file.read(UPLOAD_CHUNK_SIZE):
+                yield chunk
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+
+# Запись одного блоба по кускам: байты хэшируются и сжимаются по мере поступления,
+# ключ (SHA-256 исходных байтов) становится известен только в finish().
+class BlobWriter:
+    def __init__(self, store):
+        self.store = store
+        self._upload = store.storage.create()
+        self._hash = hashlib.sha256()
+        self._compressor = zlib.compressobj()
+        self.size = 0
+        self.stored_size = 0
+
+    def _put(self, data: bytes):
+        if data:
+            self._upload.write(data)
+            self.stored_size += len(data)
+
+    def write(self, data: bytes):
+        self._hash.update(data)
+        self.size += len(data)
+        self._put(self._compressor.compress(data))
+
+    # Завершает запись и учитывает еще одну ссылку на блоб. Ссылка берется до commit:
+    # пока она есть, release не удалит блоб, поэтому копию можно отбросить, если
+    # такой блоб уже сохранен.
+    # Возвращает поля для документа: content_hash, content_size, content_stored_size
+    def finish(self) -> dict:
+        self._put(self._compressor.flush())
+        key = self._hash.hexdigest()
+        try:
+            self.store.retain(key, self.size, self.stored_size)
+        except BaseException:
+            self.abort()
+            raise
+        try:
+            self.store.storage.commit(self._upload, key)
+        except BaseException:
+            self.store.release([key])
+            raise
+        return {
+            "content_hash": key,
+            "content_size": self.size,
+            "content_stored_size": self.stored_size,
+        }
+
+    def abort(self):
+        self.store.storage.discard(self._upload)
+
+
+# Хранилище содержимого документов, адресуемое SHA-256 содержимого.
+# Одинаковые тексты (в том числе у разных пользователей) хранятся один раз,
+# сжатыми zlib. Число документов, ссылающихся на блоб, хранится в blob_refs:
+# {_id - SHA-256, refs, size, stored_size, compression}; блоб удаляется,
+# когда на него не остается ссылок. На время удаления запись помечается полем
+# deleting (время начала), и новые ссылки на блоб ждут, пока удаление закончится.
+class BlobStore:
+    def __init__(self, storage, refs_table):
+        self.storage = storage
+        self.refs = refs_table
+
+    def writer(self) -> BlobWriter:
+        return BlobWriter(self)
+
+    # Записывает блоб из итератора кусков байтов
+    def put(self, chunks) -> dict:
+        writer = self.writer()
+        try:
+            for chunk in chunks:
+                writer.write(chunk)
+        except BaseException:
+            writer.abort()
+            raise
+        return writer.finish()
+
+    # Добавляет ссылку на блоб. Запись с пометкой deleting условию не подходит,
+    # и upsert с тем же _id падает с DuplicateKeyError: тогда ссылка берется
+    # заново после удаления, когда блоба уже нет и писатель сохранит свою копию.
+    def retain(self, key: str, size: int, stored_size: int):
+        while True:
+            try:
+                self.refs.update_one(
+                    {"_id": key, "deleting": {"$exists": False}},
+                    {
+                        "$inc": {"refs": 1},
+                        "$setOnInsert": {
+                            "size": size,
+                            "stored_size": stored_size,
+                            "compression": "zlib",
+                        },
+                    },
+                    upsert=True,
+                )
+                return
+            except DuplicateKeyError:
+                # Пометку процесса, упавшего посреди удаления, снимаем
+                self.refs.delete_one(
+                    {"_id": key, "deleting": {"$lt": time.time() - DELETE_MARK_TIMEOUT}}
+                )
+                time.sleep(RETAIN_RETRY_DELAY)
+
+    # Убирает по одной ссылке на каждый ключ и удаляет блобы без ссылок.
+    # Блоб удаляется, только если после уменьшения ссылок не осталось: запись
+    # помечается deleting (пока ссылок нет), затем удаляется сам блоб и запись.
+    def release(self, keys: list):
+        for key in keys:
+            row = self.refs.find_one_and_update(
+                {"_id": key},
+                {"$inc": {"refs": -1}},
+                return_document=ReturnDocument.AFTER,
+            )
+            if row is None or row["refs"] > 0:
+                continue
+            mark = time.time()
+            marked = self.refs.update_one(
+                {"_id": key, "refs": {"$lte": 0}, "deleting": {"$exists": False}},
+                {"$set": {"deleting": mark}},
+            )
+            if marked.modified_count:
+                self.storage.delete(key)
+                self.refs.delete_one({"_id": key, "deleting": mark})
+
+    # Распакованное содержимое блоба кусками байтов не больше UPLOAD_CHUNK_SIZE.
+    # KeyError, если блоба нет.
+    def open(self, key: str):
+        decompressor = zlib.decompressobj()
+        for chunk in self.storage.read(key):
+            while chunk:
+                data = decompressor.decompress(chunk, UPLOAD_CHUNK_SIZE)
+                if data:
+                    yield data
+                chunk = decompressor.unconsumed_tail
+        data = decompressor.flush()
+        if data:
+            yield data
+
+    def read_text(self, key: str) -> str:
+        return b"".join(self.open(key)).decode("utf-8")
+
+
+def create_blob_store(db) -> BlobStore:
+    if BLOB_BACKEND == "fs":
+        storage = FileStorage(BLOB_DIR)
+    elif BLOB_BACKEND == "gridfs":
+        storage = GridFSStorage(db)
+    else:
+        raise ValueError("APP_BLOB_BACKEND должен быть gridfs или fs")
+    return BlobStore(storage, db["blob_refs"])
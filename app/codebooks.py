@@ -0,0 +1,94 @@
+import time
+from collections import Counter
+from bson import ObjectId
+from app.cache import LRUCache
+from app.config import (
+    CODEBOOK_CACHE_SIZE,
+    CODEBOOK_MAX_WORDS,
+    CODEBOOK_SAMPLE_DOCUMENTS,
+)
+from app.huffman import (
+    ESCAPE,
+    TokenEncoder,
+    canonical_codes,
+    code_lengths,
+    table_codes,
+    word_tokens,
+)
+from app.repository import DOC_CONTENT_PROJECTION
+
+# Общий словный код Хаффмана коллекции. Символы кода - слова, разделители и ESCAPE,
+# как в mode=word, но таблица одна на всю коллекцию и хранится в базе:
+# {_id, collection_id, version, symbols, counts, docs_count, created_at}.
+# Каждое обучение сохраняет новую версию; старые версии остаются, чтобы ранее
+# закодированные данные можно было декодировать по codebook_id.
+
+# Построенные кодировщики версий: (запись кода, TokenEncoder). Версия кода
+# не меняется после сохранения, поэтому записи кэша не устаревают.
+_encoders = LRUCache(CODEBOOK_CACHE_SIZE)
+
+
+# Обучает новую версию кода коллекции. Частоты слов - CODEBOOK_MAX_WORDS самых
+# частых слов из статистики коллекции, частоты разделителей и ESCAPE считаются
+# по первым CODEBOOK_SAMPLE_DOCUMENTS документам и пересчитываются на всю коллекцию.
+# Возвращает сохраненную запись или None, если в коллекции нет документов.
+def train_codebook(repository, collection_id, user_id):
+    stats = repository.get_collection_stats(collection_id)
+    if not stats["docs_count"]:
+        return None
+    rows, _ = repository.get_term_stats(stats, "tf", 0, CODEBOOK_MAX_WORDS)
+    words = repository.term_words(collection_id, [row["term_id"] for row in rows])
+    frequencies = {
+        words[row["term_id"]]: row["count"] for row in rows if row["term_id"] in words
+    }
+
+    extra = Counter()
+    sampled = 0
+    for doc in repository.list_collection_documents(
+        collection_id, None, CODEBOOK_SAMPLE_DOCUMENTS
+    ):
+        doc = repository.get_document(doc["_id"], user_id, DOC_CONTENT_PROJECTION)
+        if doc is None:
+            continue
+        extra.update(word_tokens(repository.read_content(doc), frequencies)[2])
+        sampled += 1
+    scale = stats["docs_count"] / max(sampled, 1)
+    for symbol, count in extra.items():
+        frequencies[symbol] = max(1, round(count * scale))
+    # Слова не из кода могут встретиться в любом документе коллекции
+    frequencies.setdefault(ESCAPE, 1)
+
+    symbols, counts, _ = canonical_codes(code_lengths(frequencies))
+    return repository.save_codebook(
+        {
+            "collection_id": ObjectId(collection_id),
+            "symbols": symbols,
+            "counts": counts,
+            "docs_count": stats["docs_count"],
+            "created_at": time.time(),
+        }
+    )
+
+
+# Запись версии кода и кодировщик для нее; None, если версии нет
+def load_codebook(repository, codebook_id):
+    codebook_id = ObjectId(codebook_id)
+    cached = _encoders.get(codebook_id)
+    if cached is None:
+        codebook = repository.get_codebook(codebook_id)
+        if codebook is None:
+            return None
+        encoder = TokenEncoder(
+            codebook["symbols"], table_codes(codebook["symbols"], codebook["counts"])
+        )
+        cached = (codebook, encoder)
+        _encoders.set(codebook_id, cached)
+    return cached
+
+
+# Кодирует текст общим кодом. Слова и разделители, которых нет в коде,
+# передаются в literals. Возвращает (bytes, число значащих бит, literals)
+def encode_with_codebook(encoder: TokenEncoder, text: str) -> tuple:
+    tokens, literals, _ = word_tokens(text, encoder.index, encoder.index)
+    data, bits = encoder.encode(tokens)
+    return data, bits, literals
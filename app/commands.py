@@ -0,0 +1,164 @@
+import io
+import random
+import time
+import click
+from bson import ObjectId
+from app.data import database
+from app.decoding import decode_chunks, detect_encoding, iter_decoded, read_chunks
+from app.handling import StageTimer
+from app.huffman import (
+    canonical_codes,
+    code_lengths,
+    encode_bits,
+    encode_text,
+    symbol_frequencies,
+)
+from app.indexes import ensure_indexes, check_indexes
+
+
+# Текст из случайных слов (кириллица и немного латиницы) размером около size байт
+# в UTF-8, для замеров скорости
+def _sample_text(size: int) -> str:
+    words = [
+        "".join(random.choices(alphabet, k=random.randint(2, 12)))
+        for alphabet in ["абвгдежзиклмнопрстуфхцчшщыэюя"] * 9 + ["abcdefghijklmnop"]
+        for _ in range(50)
+    ]
+    parts, length = [], 0
+    while length < size:
+        line = " ".join(random.choices(words, k=12)) + ".\n"
+        parts.append(line)
+        length += len(line.encode("utf-8"))
+    return "".join(parts)
+
+
+# Команды командной строки: flask --app run <команда>
+def register_commands(app):
+    # Пересобирает статистику коллекций по их документам.
+    # Без аргументов пересобираются все коллекции.
+    @app.cli.command("rebuild-stats")
+    @click.argument("collection_ids", nargs=-1)
+    def rebuild_stats(collection_ids):
+        if collection_ids:
+            collection_ids = [ObjectId(cid) for cid in collection_ids]
+        else:
+            collection_ids = database.collections.distinct("_id")
+        for collection_id in collection_ids:
+            docs_count, terms_count = database.rebuild_collection_stats(collection_id)
+            click.echo(f"{collection_id}: документов {docs_count}, слов {terms_count}")
+
+    # Переносит содержимое старых документов из поля content в хранилище содержимого
+    @app.cli.command("migrate-content")
+    def migrate_content():
+        click.echo(f"Перенесено документов: {database.migrate_content()}")
+
+    # Создает индексы, объявленные в indexes.py
+    @app.cli.command("ensure-indexes")
+    def ensure_indexes_command():
+        for name, indexes in ensure_indexes(database).items():
+            click.echo(f"{name}: {', '.join(indexes)}")
+
+    # Проверяет через explain(), что частые запросы используют индексы.
+    # Завершается с ошибкой, если хотя бы один запрос читает коллекцию целиком.
+    @app.cli.command("check-indexes")
+    def check_indexes_command():
+        failed = []
+        for name, stages, collscan in check_indexes(database):
+            click.echo(
+                f"{'COLLSCAN' if collscan else 'ok'}\t{name}: {', '.join(stages)}"
+            )
+            if collscan:
+                failed.append(name)
+        if failed:
+            raise click.ClickException(f"Запросы без индекса: {', '.join(failed)}")
+
+    # Сравнивает скорость кодировщиков Хаффмана на одном тексте (МБ/с по размеру
+    # текста в UTF-8). Без --file текст генерируется из случайных слов.
+    @app.cli.command("huffman-benchmark")
+    @click.option("--size", default=8, help="Размер сгенерированного текста, МБ")
+    @click.option("--file", "path", type=click.Path(exists=True, dir_okay=False))
+    def huffman_benchmark(size, path):
+        from app.routes.api.huffman import huffman_encode
+
+        if path:
+            with open(path, encoding="utf-8") as file:
+                text = file.read()
+        else:
+            text = _sample_text(size * 1024 * 1024)
+        megabytes = len(text.encode("utf-8")) / (1024 * 1024)
+        symbols, counts, codes = canonical_codes(code_lengths(symbol_frequencies(text)))
+        click.echo(f"Текст: {megabytes:.1f} МБ, символов {len(symbols)}")
+
+        encoders = [
+            ("legacy (строка битов)", lambda: huffman_encode(text)),
+            ("encode_bits", lambda: encode_bits(text, codes)),
+            ("numpy", lambda: encode_text(text, codes, parallel=False)),
+            ("numpy, пул процессов", lambda: encode_text(text, codes, parallel=True)),
+        ]
+        for name, encode in encoders:
+            started = time.perf_counter()
+            encode()
+            elapsed = time.perf_counter() - started
+            click.echo(f"{name}: {megabytes / elapsed:.1f} МБ/с")
+
+    # Сравнивает прежнее определение кодировки (chardet по всему файлу, затем
+    # декодирование) с декодированием за один проход (BOM, UTF-8, chardet по образцу)
+    # на наборах файлов в UTF-8, cp1251 и вперемешку.
+    @app.cli.command("decode-benchmark")
+    @click.option("--size", default=8, help="Размер набора файлов, МБ")
+    @click.option("--files", default=8, help="Количество файлов в наборе")
+    @click.option(
+        "--file",
+        "path",
+        type=click.Path(exists=True, dir_okay=False),
+        help="Текст в UTF-8, который делится на файлы набора вместо случайного",
+    )
+    def decode_benchmark(size, files, path):
+        if path:
+            with open(path, encoding="utf-8") as file:
+                text = file.read()
+            step = -(-len(text) // files)
+            texts = [text[start : start + step] for start in range(0, len(text), step)]
+        else:
+            texts = [_sample_text(size * 1024 * 1024 // files) for _ in range(files)]
+        corpora = {
+            "utf-8": [text.encode("utf-8") for text in texts],
+            "cp1251": [text.encode("cp1251", "replace") for text in texts],
+            "вперемешку": [
+                text.encode("utf-8" if number % 2 else "cp1251", "replace")
+                for number, text in enumerate(texts)
+            ],
+        }
+
+        def legacy(data: bytes, timer: StageTimer) -> str:
+            stream = io.BytesIO(data)
+            with timer.stage("detect"):
+                encoding = detect_encoding(stream)
+            with timer.stage("decode"):
+                return "".join(decode_chunks(read_chunks(stream), encoding))
+
+        def tiered(data: bytes, timer: StageTimer) -> str:
+            with timer.stage("decode"):
+                return "".join(iter_decoded(io.BytesIO(data), timer.stage))
+
+        for name, corpus in corpora.items():
+            megabytes = sum(map(len, corpus)) / (1024 * 1024)
+            click.echo(f"{name}: {megabytes:.1f} МБ, файлов {len(corpus)}")
+            for method, decode in [("chardet по файлу", legacy), ("по ходу", tiered)]:
+                timer = StageTimer()
+                started = time.perf_counter()
+                decoded = []
+                for data in corpus:
+                    try:
+                        decoded.append(decode(data, timer))
+                    except (UnicodeDecodeError, LookupError):
+                        decoded.append(None)
+                elapsed = time.perf_counter() - started
+                correct = sum(text == source for text, source in zip(decoded, texts))
+                click.echo(
+                    f"  {method}: {megabytes / elapsed:.1f} МБ/с, "
+                    f"detect {timer.timings.get('detect', 0.0):.3f} с, "
+                    f"decode {timer.timings.get('decode', 0.0):.3f} с, "
+                    f"верно {correct} из {len(corpus)}, "
+                    f"ошибок {decoded.count(None)}"
+                )
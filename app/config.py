@@ -1,5 +1,6 @@
 from dotenv import load_dotenv
 import os
+import tempfile
 
 dotenv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), ".env")
 load_dotenv(dotenv_path, override=True)
@@ -13,3 +14,86 @@ VERSION = os.getenv("APP_VERSION")
 FLASK_HOST = os.getenv("FLASK_HOST")
 FLASK_PORT = os.getenv("FLASK_PORT")
 FLASK_IS_DEBUG = os.getenv("FLASK_DEBUG")
+
+# Количество коллекций, для которых в памяти процесса хранятся вычисленные IDF
+IDF_CACHE_SIZE = int(os.getenv("APP_IDF_CACHE_SIZE", "128"))
+# Количество коллекций, словари которых хранятся в памяти процесса
+VOCABULARY_CACHE_SIZE = int(os.getenv("APP_VOCABULARY_CACHE_SIZE", "32"))
+
+# Размер куска (в байтах), которым читается поток загружаемого файла
+UPLOAD_CHUNK_SIZE = int(os.getenv("APP_UPLOAD_CHUNK_SIZE", str(64 * 1024)))
+
+# Определение кодировки файла, который не является UTF-8: сколько байт получает
+# chardet, с какой уверенностью его ответ принимается и какая кодировка берется,
+# если уверенность ниже
+DETECT_SAMPLE_SIZE = int(os.getenv("APP_DETECT_SAMPLE_SIZE", str(64 * 1024)))
+DETECT_MIN_CONFIDENCE = float(os.getenv("APP_DETECT_MIN_CONFIDENCE", "0.5"))
+DETECT_FALLBACK_ENCODING = os.getenv("APP_DETECT_FALLBACK_ENCODING", "cp1251")
+
+# Защита от "бомб" в сжатых загрузках: максимальный суммарный размер
+# распакованных данных (в байтах) и количество файлов в архиве .zip
+MAX_DECOMPRESSED_SIZE = int(
+    os.getenv("APP_MAX_DECOMPRESSED_SIZE", str(1024 * 1024 * 1024))
+)
+MAX_ARCHIVE_MEMBERS = int(os.getenv("APP_MAX_ARCHIVE_MEMBERS", "1000"))
+
+# Пакетная загрузка: сколько файлов пакета обрабатывается одновременно
+# и сколько файлов (с учетом файлов архивов) может быть в одном пакете
+BATCH_WORKERS = int(os.getenv("APP_BATCH_WORKERS", "4"))
+BATCH_MAX_FILES = int(os.getenv("APP_BATCH_MAX_FILES", "1000"))
+
+# Файлы больше этого размера (в байтах) считаются в пуле процессов
+PARALLEL_COUNT_THRESHOLD = int(
+    os.getenv("APP_PARALLEL_COUNT_THRESHOLD", str(8 * 1024 * 1024))
+)
+# Количество процессов для подсчета слов (0 - по числу ядер)
+PARALLEL_COUNT_WORKERS = int(os.getenv("APP_PARALLEL_COUNT_WORKERS", "0"))
+# Размер части текста (в символах), отправляемой одному процессу
+PARALLEL_COUNT_BATCH = int(os.getenv("APP_PARALLEL_COUNT_BATCH", str(1024 * 1024)))
+
+# Тексты длиннее этого числа символов кодируются Хаффманом в пуле процессов
+HUFFMAN_PARALLEL_THRESHOLD = int(
+    os.getenv("APP_HUFFMAN_PARALLEL_THRESHOLD", str(4 * 1024 * 1024))
+)
+# Размер части текста (в символах), которую кодирует один процесс
+HUFFMAN_PARALLEL_BATCH = int(os.getenv("APP_HUFFMAN_PARALLEL_BATCH", str(1024 * 1024)))
+
+# Общий словный код коллекции: сколько самых частых слов получают коды,
+# по скольким документам считаются разделители и сколько построенных кодов
+# хранится в памяти процесса
+CODEBOOK_MAX_WORDS = int(os.getenv("APP_CODEBOOK_MAX_WORDS", "65536"))
+CODEBOOK_SAMPLE_DOCUMENTS = int(os.getenv("APP_CODEBOOK_SAMPLE_DOCUMENTS", "100"))
+CODEBOOK_CACHE_SIZE = int(os.getenv("APP_CODEBOOK_CACHE_SIZE", "16"))
+
+# Каталог снимков метрик процессов приложения (GET /metrics складывает их)
+# и как часто (в секундах) процесс обновляет свой снимок
+METRICS_DIR = os.getenv(
+    "APP_METRICS_DIR",
+    os.path.join(tempfile.gettempdir(), "document_analyzer_metrics"),
+)
+METRICS_FLUSH_INTERVAL = float(os.getenv("APP_METRICS_FLUSH_INTERVAL", "5"))
+
+# Каталог, в котором хранятся загрузки, ожидающие фоновой обработки
+UPLOAD_SPOOL_DIR = os.getenv(
+    "APP_UPLOAD_SPOOL_DIR",
+    os.path.join(tempfile.gettempdir(), "document_analyzer_uploads"),
+)
+# Где хранится содержимое документов: gridfs (в MongoDB) или fs (файлы в BLOB_DIR)
+BLOB_BACKEND = os.getenv("APP_BLOB_BACKEND", "gridfs")
+BLOB_DIR = os.getenv(
+    "APP_BLOB_DIR", os.path.join(tempfile.gettempdir(), "document_analyzer_blobs")
+)
+# Количество потоков фоновой обработки загрузок
+JOBS_WORKERS = int(os.getenv("APP_JOBS_WORKERS", "2"))
+# Аренда фоновой задачи в секундах: процесс продлевает аренду своих задач, пока
+# жив; задачу с истекшей арендой (процесс перезапущен или упал) подхватывает
+# другой процесс, но не больше JOBS_MAX_ATTEMPTS раз
+JOBS_LEASE = float(os.getenv("APP_JOBS_LEASE", "60"))
+JOBS_MAX_ATTEMPTS = int(os.getenv("APP_JOBS_MAX_ATTEMPTS", "3"))
+
+# Хранилище, из которого маршруты читают данные: mongo или memory
+# (репозиторий в памяти процесса для замеров без MongoDB, см. repository.py)
+DATA_BACKEND = os.getenv("APP_DATA_BACKEND", "mongo")
+
+# Создавать недостающие индексы MongoDB при запуске приложения (1 - да, 0 - нет)
+ENSURE_INDEXES = os.getenv("APP_ENSURE_INDEXES", "1") == "1"
@@ -1,9 +1,38 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne
 from flask_login import UserMixin
 import math
-from app.config import MONGODB_URI, MONGODB_DB_NAME
+from app.config import (
+    MONGODB_URI,
+    MONGODB_DB_NAME,
+    IDF_CACHE_SIZE,
+    VOCABULARY_CACHE_SIZE,
+)
+from app.cache import LRUCache
+from app.termvec import (
+    FORMAT_IDS,
+    TERMS_PROJECTION,
+    legacy_counts,
+    pack_terms,
+    unpack_ids,
+    vector_format,
+)
+from app.vocabulary import Vocabulary
+from app.blobs import create_blob_store
+from app.telemetry import MongoCommandTimer
 from bson import ObjectId
 
+
+# Сколько документов переписывается одним bulk_write в detach_vocabularies
+DETACH_BATCH_SIZE = 1000
+# Сколько ID слов передается в одном $in при чтении term_stats
+TERMS_QUERY_BATCH_SIZE = 10000
+
+
+# IDF слова: ln((N + 1) / (df + 1)) + 1, где N - число документов коллекции
+def compute_idf(total_docs: int, df: int) -> float:
+    return math.log((total_docs + 1) / (df + 1)) + 1
+
+
 class User(UserMixin):
     def __init__(self, id: int, username: str, collections: list[str] = None):
         self.id = id
@@ -19,39 +48,405 @@ class User(UserMixin):
 class DataBase:
 
     def __init__(self):
-        self.client = MongoClient(MONGODB_URI)
+        # Время каждой команды попадает в метрики (telemetry.py)
+        self.client = MongoClient(MONGODB_URI, event_listeners=[MongoCommandTimer()])
         self.db = self.client[MONGODB_DB_NAME]
         self.documents = self.db["documents"]
         self.users = self.db["users"]
         self.collections = self.db["collections"]
         self.metrics = self.db["metrics"]
+        self.jobs = self.db["jobs"]
+        # Статистика слов в пределах коллекции:
+        # {collection_id, term_id, df - число документов со словом, count - сколько раз
+        # слово встречается во всех документах коллекции}
+        self.term_stats = self.db["term_stats"]
+        # Сводная статистика коллекций, см. _update_summary
+        self.collection_stats = self.db["collection_stats"]
+        # Словари коллекций: слово <-> целочисленный ID
+        self.vocabulary = Vocabulary(
+            self.db["vocabulary"], self.collections, VOCABULARY_CACHE_SIZE
+        )
+        # Версии общего кода Хаффмана коллекций, см. codebooks.py
+        self.codebooks = self.db["codebooks"]
+        # Содержимое документов, адресуемое SHA-256 (content_hash документа)
+        self.blobs = create_blob_store(self.db)
+        # IDF коллекций, ключ - (collection_id, version)
+        self.idf_cache = LRUCache(IDF_CACHE_SIZE)
 
-    # Функция для обновления статистик слов в БД.
-    # При каждом добавлении или удалении нового документа, вызывается эта функция, которая обновляет статистику в пределах измененной коллекции.
-    def recalculate_idf(self, collection_id: str):
-        collection_id_obj = ObjectId(collection_id)
-        documents = list(self.documents.find({"collection_id": collection_id_obj}))
-        total_docs = len(documents)
+    # Учитывает (sign=1) или вычитает (sign=-1) слова документа в статистике коллекции:
+    # документная частота меняется на 1, суммарное количество - на количество в документе.
+    # Стоимость пропорциональна словарю документа, а не размеру коллекции.
+    # Возвращает, сколько слов появилось (sign=1) или исчезло (sign=-1) в коллекции.
+    def _apply_term_delta(
+        self, collection_id: ObjectId, term_counts: dict, sign: int
+    ) -> int:
+        return self._apply_term_deltas(
+            collection_id,
+            {term_id: (sign, sign * count) for term_id, count in term_counts.items()},
+            sign,
+        )
 
-        word_document_counts = {}
-        for doc in documents:
-            unique_words = set(word["word"] for word in doc.get("words", []))
-            for word in unique_words:
-                word_document_counts[word] = word_document_counts.get(word, 0) + 1
+    # То же для нескольких документов сразу: deltas - {ID слова: (изменение
+    # документной частоты, изменение количества)}, по одному запросу на слово.
+    def _apply_term_deltas(
+        self, collection_id: ObjectId, deltas: dict, sign: int
+    ) -> int:
+        requests = [
+            UpdateOne(
+                {"collection_id": collection_id, "term_id": term_id},
+                {"$inc": {"df": df, "count": count}},
+                upsert=sign > 0,
+            )
+            for term_id, (df, count) in deltas.items()
+        ]
+        if not requests:
+            return 0
+        result = self.term_stats.bulk_write(requests, ordered=False)
+        if sign > 0:
+            return result.upserted_count
+        return self.term_stats.delete_many(
+            {"collection_id": collection_id, "df": {"$lte": 0}}
+        ).deleted_count
+
+    # Текст документа: из хранилища содержимого или, у документов, загруженных
+    # до его появления, из поля content
+    def document_content(self, doc: dict) -> str:
+        if "content_hash" in doc:
+            return self.blobs.read_text(doc["content_hash"])
+        return doc.get("content", "")
+
+    # Переносит содержимое старых документов из поля content в хранилище.
+    # Возвращает число перенесенных документов.
+    def migrate_content(self) -> int:
+        moved = 0
+        for doc in self.documents.find({"content": {"$exists": True}}, {"content": 1}):
+            content = self.blobs.put([doc["content"].encode("utf-8")])
+            self.documents.update_one(
+                {"_id": doc["_id"]}, {"$set": content, "$unset": {"content": ""}}
+            )
+            moved += 1
+        return moved
+
+    # Удаляет документы, подходящие под query, вместе со ссылками на их содержимое
+    def delete_documents(self, query: dict):
+        keys = [
+            doc["content_hash"]
+            for doc in self.documents.find(
+                {**query, "content_hash": {"$exists": True}}, {"content_hash": 1}
+            )
+        ]
+        self.documents.delete_many(query)
+        self.blobs.release(keys)
+
+    # Количества слов документа: {слово: количество}
+    def document_counts(self, doc: dict) -> dict:
+        terms = doc.get("terms")
+        if terms is not None and vector_format(terms) == FORMAT_IDS:
+            counts = unpack_ids(terms)
+            words = self.vocabulary.words_for(doc["vocabulary_id"], counts)
+            return {words[term_id]: count for term_id, count in counts.items()}
+        return legacy_counts(doc)
+
+    # Количества слов документа в ID словаря коллекции collection_id: {ID: количество}.
+    # Если вектор документа записан в ID этой же коллекции, он просто распаковывается,
+    # иначе слова переводятся в ID нужного словаря.
+    def document_term_counts(self, doc: dict, collection_id) -> dict:
+        terms = doc.get("terms")
+        if (
+            terms is not None
+            and vector_format(terms) == FORMAT_IDS
+            and doc.get("vocabulary_id") == ObjectId(collection_id)
+        ):
+            return unpack_ids(terms)
+        counts = self.document_counts(doc)
+        ids = self.vocabulary.ids_for(collection_id, counts)
+        return {ids[word]: count for word, count in counts.items()}
 
-        idf_map = {
-            word: math.log((total_docs + 1) / (df + 1)) + 1
-            for word, df in word_document_counts.items()
+    # Сводная запись статистики коллекции в collection_stats:
+    # {_id - ID коллекции, docs_count, words_total - общее число слов,
+    # terms_count - число разных слов, version}.
+    # Версия меняется при каждом изменении состава коллекции и увеличивается после
+    # обновления частот, чтобы в кэш под новой версией не попали частоты,
+    # еще не учитывающие изменение.
+    def _update_summary(self, collection_id: ObjectId, delta: dict):
+        self.collection_stats.update_one(
+            {"_id": collection_id},
+            {"$inc": {**delta, "version": 1}},
+            upsert=True,
+        )
+
+    # Сводная статистика коллекции; для коллекции без документов - нулевая
+    def get_collection_stats(self, collection_id) -> dict:
+        collection_id = ObjectId(collection_id)
+        stats = self.collection_stats.find_one({"_id": collection_id})
+        return stats or {
+            "_id": collection_id,
+            "docs_count": 0,
+            "words_total": 0,
+            "terms_count": 0,
+            "version": 0,
         }
 
+    # Добавляет документ в коллекцию и учитывает его слова в статистике коллекции.
+    # term_counts - количества слов документа в ID словаря коллекции.
+    # Условие "doc_ids": {"$ne": ...} делает операцию атомарной: повторное добавление
+    # того же документа не увеличит частоты второй раз.
+    def link_document(self, collection_id, document_id, term_counts: dict) -> bool:
+        collection_id = ObjectId(collection_id)
+        document_id = ObjectId(document_id)
+        result = self.collections.update_one(
+            {"_id": collection_id, "doc_ids": {"$ne": document_id}},
+            {"$push": {"doc_ids": document_id}},
+        )
+        if not result.modified_count:
+            return False
+        new_terms = self._apply_term_delta(collection_id, term_counts, 1)
+        self._update_summary(
+            collection_id,
+            {
+                "docs_count": 1,
+                "words_total": sum(term_counts.values()),
+                "terms_count": new_terms,
+            },
+        )
+        return True
+
+    # Добавляет в коллекцию сразу несколько только что записанных документов:
+    # один $addToSet с $each для doc_ids, один bulk_write по всем словам пакета
+    # (документная частота слова растет на число документов пакета, где оно есть)
+    # и одно обновление сводной статистики, поэтому версия статистики и кэш IDF
+    # меняются один раз на пакет. term_counts_list - количества слов каждого
+    # документа в ID словаря коллекции, в порядке document_ids.
+    def link_documents(self, collection_id, document_ids: list, term_counts_list: list):
+        collection_id = ObjectId(collection_id)
+        if not document_ids:
+            return
+        self.collections.update_one(
+            {"_id": collection_id},
+            {"$addToSet": {"doc_ids": {"$each": [ObjectId(i) for i in document_ids]}}},
+        )
+        deltas = {}
+        for term_counts in term_counts_list:
+            for term_id, count in term_counts.items():
+                df, total = deltas.get(term_id, (0, 0))
+                deltas[term_id] = (df + 1, total + count)
+        new_terms = self._apply_term_deltas(collection_id, deltas, 1)
+        self._update_summary(
+            collection_id,
+            {
+                "docs_count": len(document_ids),
+                "words_total": sum(total for _, total in deltas.values()),
+                "terms_count": new_terms,
+            },
+        )
+
+    # Убирает документ из коллекции и вычитает его слова из статистики коллекции.
+    def unlink_document(self, collection_id, document_id, term_counts: dict) -> bool:
+        collection_id = ObjectId(collection_id)
+        document_id = ObjectId(document_id)
+        result = self.collections.update_one(
+            {"_id": collection_id, "doc_ids": document_id},
+            {"$pull": {"doc_ids": document_id}},
+        )
+        if not result.modified_count:
+            return False
+        removed_terms = self._apply_term_delta(collection_id, term_counts, -1)
+        self._update_summary(
+            collection_id,
+            {
+                "docs_count": -1,
+                "words_total": -sum(term_counts.values()),
+                "terms_count": -removed_terms,
+            },
+        )
+        return True
+
+    # Удаляет статистику и словари удаленных коллекций. Документы при удалении
+    # коллекции остаются: они перестают ссылаться на коллекцию, а их векторы
+    # в ID удаляемых словарей сначала переписываются словами (detach_vocabularies).
+    def drop_collection_stats(self, collection_ids: list):
+        collection_ids = [ObjectId(cid) for cid in collection_ids]
+        self.term_stats.delete_many({"collection_id": {"$in": collection_ids}})
+        self.collection_stats.delete_many({"_id": {"$in": collection_ids}})
+        self.codebooks.delete_many({"collection_id": {"$in": collection_ids}})
+        self.documents.update_many(
+            {"collection_id": {"$in": collection_ids}},
+            {"$unset": {"collection_id": ""}},
+        )
+        self.detach_vocabularies(collection_ids)
+        self.vocabulary.drop(collection_ids)
+
+    # Переписывает векторы документов, записанные в ID словарей collection_ids,
+    # в формат версии 1 (слова) и убирает у них vocabulary_id: после удаления
+    # словаря такие документы остаются читаемыми и могут быть добавлены в другую
+    # коллекцию. Возвращает число переписанных документов.
+    def detach_vocabularies(self, collection_ids: list) -> int:
+        collection_ids = [ObjectId(cid) for cid in collection_ids]
+        detached = 0
+        requests = []
+        for doc in self.documents.find(
+            {"vocabulary_id": {"$in": collection_ids}}, TERMS_PROJECTION
+        ):
+            requests.append(
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {
+                        "$set": {"terms": pack_terms(self.document_counts(doc))},
+                        "$unset": {"vocabulary_id": ""},
+                    },
+                )
+            )
+            if len(requests) >= DETACH_BATCH_SIZE:
+                detached += self.documents.bulk_write(requests).modified_count
+                requests = []
+        if requests:
+            detached += self.documents.bulk_write(requests).modified_count
+        return detached
+
+    # Возвращает IDF всех слов коллекции по их ID, вычисленный по числу документов
+    # и таблице документных частот. stats - сводная статистика коллекции
+    # (get_collection_stats). Результат кэшируется до следующего изменения состава;
+    # карты прошлых версий коллекции при этом из кэша удаляются.
+    def get_idf_map(self, stats: dict) -> dict:
+        key = (stats["_id"], stats["version"])
+        idf_map = self.idf_cache.get(key)
+        if idf_map is None:
+            idf_map = {
+                row["term_id"]: compute_idf(stats["docs_count"], row["df"])
+                for row in self.term_stats.find(
+                    {"collection_id": stats["_id"]},
+                    {"_id": 0, "term_id": 1, "df": 1},
+                )
+            }
+            self.idf_cache.remove_if(
+                lambda cached: cached[0] == key[0] and cached[1] < key[1]
+            )
+            self.idf_cache.set(key, idf_map)
+        return idf_map
+
+    # IDF только слов term_ids: {ID слова: IDF}. Строки term_stats читаются
+    # по индексу (collection_id, term_id), поэтому время зависит от числа слов,
+    # а не от словаря коллекции. Для ответа на загрузку, сразу после которой
+    # версия статистики новая и полная карта (get_idf_map) в кэше еще не лежит.
+    def get_terms_idf(self, stats: dict, term_ids) -> dict:
+        term_ids = list(term_ids)
+        idf_map = {}
+        for start in range(0, len(term_ids), TERMS_QUERY_BATCH_SIZE):
+            batch = term_ids[start : start + TERMS_QUERY_BATCH_SIZE]
+            for row in self.term_stats.find(
+                {"collection_id": stats["_id"], "term_id": {"$in": batch}},
+                {"_id": 0, "term_id": 1, "df": 1},
+            ):
+                idf_map[row["term_id"]] = compute_idf(stats["docs_count"], row["df"])
+        return idf_map
+
+    # Страница статистики слов коллекции. sort - "tf", "idf" или "tf_idf".
+    # Порядок по tf совпадает с порядком по count, по idf - с порядком по df,
+    # поэтому такие страницы читаются одним запросом по индексу term_stats.
+    # tf-idf зависит от обоих полей и считается конвейером агрегации на стороне MongoDB.
+    # Возвращает строки {term_id, df, count, tf, idf, tf_idf} и общее число слов.
+    def get_term_statistics(
+        self, stats: dict, sort: str, offset: int, limit: int
+    ) -> tuple:
+        total_docs = stats["docs_count"]
+        words_total = stats["words_total"]
+        if not total_docs or not words_total:
+            return [], 0
+        query = {"collection_id": stats["_id"]}
+        if sort == "tf_idf":
+            # idf = ln((N + 1) / (df + 1)) + 1, как в compute_idf
+            ratio = {"$divide": [total_docs + 1, {"$add": ["$df", 1]}]}
+            pipeline = [
+                {"$match": query},
+                {
+                    "$project": {
+                        "_id": 0,
+                        "term_id": 1,
+                        "df": 1,
+                        "count": 1,
+                        "tf": {"$divide": ["$count", words_total]},
+                        "idf": {"$add": [{"$ln": ratio}, 1]},
+                    }
+                },
+                {"$addFields": {"tf_idf": {"$multiply": ["$tf", "$idf"]}}},
+                {"$sort": {"tf_idf": -1, "term_id": 1}},
+                {"$skip": offset},
+                {"$limit": limit},
+            ]
+            return list(self.term_stats.aggregate(pipeline)), stats["terms_count"]
+
+        order = [("count", -1)] if sort == "tf" else [("df", 1)]
+        cursor = (
+            self.term_stats.find(query, {"_id": 0, "term_id": 1, "df": 1, "count": 1})
+            .sort(order + [("term_id", 1)])
+            .skip(offset)
+            .limit(limit)
+        )
+        rows = []
+        for row in cursor:
+            row["tf"] = row["count"] / words_total
+            row["idf"] = compute_idf(total_docs, row["df"])
+            row["tf_idf"] = row["tf"] * row["idf"]
+            rows.append(row)
+        return rows, stats["terms_count"]
+
+    # Полный пересчет статистики коллекции (term_stats и collection_stats)
+    # по документам коллекции. При загрузке документов не вызывается (статистика
+    # обновляется инкрементально), нужен для восстановления статистики, если она
+    # разошлась с документами. Запускается командой flask rebuild-stats.
+    def rebuild_collection_stats(self, collection_id: str):
+        collection_id_obj = ObjectId(collection_id)
+        documents = self.documents.find(
+            {"collection_id": collection_id_obj}, TERMS_PROJECTION
+        )
+
+        term_document_counts = {}
+        term_total_counts = {}
+        docs_count = 0
+        words_total = 0
         for doc in documents:
-            updated_words = []
-            for word in doc.get("words", []):
-                word["idf"] = idf_map.get(word["word"], 0)
-                updated_words.append(word)
-            self.documents.update_one(
-                {"_id": doc["_id"]}, {"$set": {"words": updated_words}}
+            counts = self.document_term_counts(doc, collection_id_obj)
+            docs_count += 1
+            words_total += sum(counts.values())
+            for term_id, count in counts.items():
+                term_document_counts[term_id] = term_document_counts.get(term_id, 0) + 1
+                term_total_counts[term_id] = term_total_counts.get(term_id, 0) + count
+
+        self.term_stats.delete_many({"collection_id": collection_id_obj})
+        if term_document_counts:
+            self.term_stats.insert_many(
+                [
+                    {
+                        "collection_id": collection_id_obj,
+                        "term_id": term_id,
+                        "df": df,
+                        "count": term_total_counts[term_id],
+                    }
+                    for term_id, df in term_document_counts.items()
+                ]
             )
+        # IDF больше не хранится в документах, убираем значения, записанные ранее
+        self.documents.update_many(
+            {"collection_id": collection_id_obj, "words.idf": {"$exists": True}},
+            {"$unset": {"words.$[].idf": ""}},
+        )
+        self.collection_stats.update_one(
+            {"_id": collection_id_obj},
+            {
+                "$set": {
+                    "docs_count": docs_count,
+                    "words_total": words_total,
+                    "terms_count": len(term_document_counts),
+                },
+                "$inc": {"version": 1},
+            },
+            upsert=True,
+        )
+        # Сводная статистика раньше хранилась в документе коллекции
+        self.collections.update_one(
+            {"_id": collection_id_obj}, {"$unset": {"words_total": "", "version": ""}}
+        )
+        return docs_count, len(term_document_counts)
 
 
 database = DataBase()
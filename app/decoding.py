@@ -0,0 +1,128 @@
+import codecs
+from contextlib import nullcontext
+import chardet
+from app.config import (
+    UPLOAD_CHUNK_SIZE,
+    DETECT_SAMPLE_SIZE,
+    DETECT_MIN_CONFIDENCE,
+    DETECT_FALLBACK_ENCODING,
+)
+
+# BOM и кодировки, которые его понимают и отбрасывают. BOM UTF-32 LE начинается
+# с BOM UTF-16 LE, поэтому проверяется раньше.
+BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+
+# Прежний способ: определение кодировки детектором chardet по всему потоку.
+# Детектор останавливается, как только уверен в результате, но на текстах в UTF-8
+# обычно читает файл целиком. Используется командой decode-benchmark для сравнения.
+def detect_encoding(stream) -> str:
+    detector = chardet.UniversalDetector()
+    for chunk in iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b""):
+        detector.feed(chunk)
+        if detector.done:
+            break
+    detector.close()
+    stream.seek(0)
+    return detector.result["encoding"] or "utf-8"
+
+
+def bom_encoding(data: bytes):
+    for bom, encoding in BOMS:
+        if data.startswith(bom):
+            return encoding
+    return None
+
+
+# Кодировка по образцу байтов: chardet, если он уверен не меньше
+# DETECT_MIN_CONFIDENCE, иначе DETECT_FALLBACK_ENCODING
+def detect_sample(sample: bytes) -> str:
+    result = chardet.detect(sample)
+    if result["encoding"] and result["confidence"] >= DETECT_MIN_CONFIDENCE:
+        return result["encoding"]
+    return DETECT_FALLBACK_ENCODING
+
+
+# Декодирование потока байт по кускам через инкрементальный декодер:
+# многобайтовые символы на границе кусков корректно собираются из двух чтений.
+def decode_chunks(chunks, encoding: str, errors: str = "strict"):
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+def read_chunks(stream):
+    return iter(lambda: stream.read(UPLOAD_CHUNK_SIZE), b"")
+
+
+# Декодирование потока с определением кодировки за один проход, без возврата
+# в начало потока:
+# 1. BOM в начале файла однозначно задает кодировку;
+# 2. иначе поток декодируется как строгий UTF-8;
+# 3. на первом некорректном для UTF-8 байте, если до него был только ASCII
+#    (одинаковый во всех однобайтовых кодировках), кодировка определяется
+#    chardet по образцу не больше DETECT_SAMPLE_SIZE байт с этого места,
+#    и остаток декодируется ею. Если до ошибки уже были символы не из ASCII,
+#    файл считается испорченным UTF-8 и некорректные байты заменяются.
+# stage - контекст замера (StageTimer.stage): время chardet идет в стадию detect.
+def iter_decoded(stream, stage=None):
+    chunks = read_chunks(stream)
+    first = next(chunks, b"")
+    encoding = bom_encoding(first)
+    if encoding:
+        yield from decode_chunks(_prepend(first, chunks), encoding)
+        return
+
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    ascii_only = True
+    try:
+        for chunk in _prepend(first, chunks):
+            text = decoder.decode(chunk)
+            ascii_only = ascii_only and text.isascii()
+            if text:
+                yield text
+        tail = decoder.decode(b"", final=True)
+        if tail:
+            yield tail
+        return
+    except UnicodeDecodeError as error:
+        # error.object - недописанный с прошлого куска символ и текущий кусок:
+        # корректная часть до ошибки отдается, остаток декодируется заново
+        text = error.object[: error.start].decode("utf-8")
+        ascii_only = ascii_only and text.isascii()
+        if text:
+            yield text
+        rest = error.object[error.start :]
+
+    if not ascii_only:
+        yield from decode_chunks(_prepend(rest, chunks), "utf-8", "replace")
+        return
+    sample = [rest]
+    size = len(rest)
+    while size < DETECT_SAMPLE_SIZE:
+        chunk = next(chunks, b"")
+        if not chunk:
+            break
+        sample.append(chunk)
+        size += len(chunk)
+    sample = b"".join(sample)
+    with stage("detect") if stage else nullcontext():
+        encoding = detect_sample(sample[:DETECT_SAMPLE_SIZE])
+    yield from decode_chunks(_prepend(sample, chunks), encoding, "replace")
+
+
+def _prepend(first: bytes, chunks):
+    if first:
+        yield first
+    yield from chunks
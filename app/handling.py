@@ -1,51 +1,313 @@
-import re
-from app.data import database
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
 from bson import ObjectId
+from app.archives import ArchiveError, open_upload
+from app.data import database
+from app.decoding import iter_decoded
+from app.tokenizer import count_segments, count_segments_parallel, iter_segments
+from app.termvec import pack_ids
+from app.config import BATCH_WORKERS, PARALLEL_COUNT_THRESHOLD
+from app.telemetry import observe_stages
+
+# Потоки подготовки документов пакетной загрузки
+batch_executor = ThreadPoolExecutor(
+    max_workers=BATCH_WORKERS, thread_name_prefix="batch"
+)
+
+
+# Замер времени стадий обработки. Время считается "исключительно": пока работает
+# вложенная стадия (например, декодирование внутри подсчета), внешняя стоит на паузе.
+class StageTimer:
+    def __init__(self):
+        self.timings = {}
+        self._stack = []
+        self._started = None
+
+    def _switch(self):
+        now = time.perf_counter()
+        if self._stack:
+            name = self._stack[-1]
+            self.timings[name] = self.timings.get(name, 0.0) + now - self._started
+        self._started = now
+
+    @contextmanager
+    def stage(self, name: str):
+        self._switch()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._stack.pop()
+
+    # Обертка над итератором: время получения каждого элемента идет в стадию name
+    def iterate(self, name: str, iterable):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def rounded(self) -> dict:
+        return {name: round(value, 4) for name, value in self.timings.items()}
+
 
-# Функция обработки и сохраения документа в БД при его загрузке.
-def file_handling(
-    content: str, filename: str, collection_id: str, user_id: str
-) -> list:
-    words_list = re.split(
-        r"\W+", content.lower()
-    )  # Уменьшаем все содержимое документа до нижнего регистра
-    words_num = len(words_list)
-    count = {}
-
-    for word in words_list:
-        if word:
-            count[word] = count.get(word, 0) + 1  # Подсчет количества каждого слова
-
-    sorted_values = sorted(count.items(), key=lambda tpl: tpl[1], reverse=True)[
-        :50
-    ]  # Сортируем слова по убыванию их количества (топ 50)
-    tf_dict = {word: freq / words_num for word, freq in sorted_values}
-    words = [{"word": word, "tf": tf} for word, tf in tf_dict.items()]
+# Стадии detect -> decode -> tokenize -> count -> pack: подготовка документа к сохранению.
+# Файл читается потоком: байты декодируются кусками (кодировка определяется по ходу,
+# chardet запускается только для файлов не в UTF-8), слова считаются по мере чтения,
+# текст в UTF-8 по тем же кускам сжимается в хранилище содержимого (стадия store),
+# поэтому целиком в памяти файл не оказывается. Сжатые файлы (.gz, .bz2, .xz)
+# распаковываются по ходу чтения (время распаковки входит в decode); файлы
+# архива .zip образуют один документ, их тексты разделяются переводом строки,
+# кодировка каждого определяется отдельно. При поврежденном сжатом файле
+# или превышении лимитов распаковки бросает ArchiveError.
+# Возвращает документ для записи, счетчик его слов и ID слов в словаре коллекции.
+def prepare_document(
+    stream, filename: str, collection_id: str, timer: StageTimer
+) -> tuple:
+    members, size = open_upload(stream, filename)
+    return prepare_streams(members, size, filename, collection_id, timer)
+
+
+# Подготовка документа из уже открытых потоков байт (результат open_upload):
+# size - оценка размера текста для выбора способа подсчета слов.
+def prepare_streams(
+    members, size: int, filename: str, collection_id: str, timer: StageTimer
+) -> tuple:
+    blob = database.blobs.writer()
+
+    def texts():
+        for number, member in enumerate(members):
+            if number:
+                yield "\n"
+            yield from iter_decoded(member, timer.stage)
+
+    def chunks():
+        for text in timer.iterate("decode", texts()):
+            with timer.stage("store"):
+                blob.write(text.encode("utf-8"))
+            yield text
+
+    segments = timer.iterate("tokenize", iter_segments(chunks()))
+    # Подсчет количества каждого слова: большие файлы считаются в пуле процессов,
+    # маленькие - в текущем процессе, без накладных расходов на передачу данных
+    with timer.stage("count"):
+        try:
+            if size >= PARALLEL_COUNT_THRESHOLD:
+                count = count_segments_parallel(segments)
+            else:
+                count = count_segments(segments)
+        except BaseException:
+            blob.abort()
+            raise
+    with timer.stage("store"):
+        content = blob.finish()
+
+    # Слова переводятся в ID словаря коллекции, полный вектор частот хранится
+    # в одном сжатом бинарном поле. С finish() документ держит ссылку на содержимое:
+    # если документ не будет записан, ссылка снимается.
+    with timer.stage("pack"):
+        try:
+            term_ids = database.vocabulary.ids_for(collection_id, count)
+            terms = pack_ids({term_ids[word]: freq for word, freq in count.items()})
+        except BaseException:
+            database.blobs.release([content["content_hash"]])
+            raise
 
     document = {
         "filename": filename,
-        "content": content,
-        "words_num": words_num,
-        "words": words,
-        "collection_id": ObjectId(collection_id),
-        "user_id": ObjectId(user_id),
+        **content,
+        "words_num": sum(count.values()),
+        "terms": terms,
+        "vocabulary_id": ObjectId(collection_id),
     }
-    inserted_doc = database.documents.insert_one(document)
-    database.collections.update_one(
-        {"_id": ObjectId(collection_id)},
-        {"$addToSet": {"doc_ids": inserted_doc.inserted_id}},
-    )
-    database.recalculate_idf(collection_id)
+    return document, count, term_ids
+
+
+# Стадии persist -> statistics: документ записывается одним insert_one,
+# затем все его слова учитываются в статистике коллекции. document_id - ID
+# документа, если он задан заранее (фоновая задача записывает документ под своим ID).
+# Возвращает ID документа и статистику топ-50 его слов, упорядоченную по убыванию IDF.
+def store_document(
+    document: dict,
+    count,
+    term_ids: dict,
+    collection_id: str,
+    user_id,
+    timer: StageTimer,
+    document_id=None,
+) -> tuple:
+    with timer.stage("persist"):
+        if document_id is not None:
+            document["_id"] = document_id
+        document["collection_id"] = ObjectId(collection_id)
+        document["user_id"] = ObjectId(user_id)
+        document["uploaded_at"] = time.time()
+        try:
+            document_id = database.documents.insert_one(document).inserted_id
+        except BaseException:
+            database.blobs.release([document["content_hash"]])
+            raise
+
+    with timer.stage("statistics"):
+        term_counts = {term_ids[word]: freq for word, freq in count.items()}
+        database.link_document(collection_id, document_id, term_counts)
 
-    updated_doc = database.documents.find_one({"_id": inserted_doc.inserted_id})
-    result = [
+        # Сортируем слова по убыванию их количества (топ 50); IDF читается
+        # только для этих слов
+        top_words = count.most_common(50)
+        idf_map = database.get_terms_idf(
+            database.get_collection_stats(collection_id),
+            [term_ids[word] for word, _ in top_words],
+        )
+        statistics = top_statistics(top_words, term_ids, document["words_num"], idf_map)
+    return document_id, statistics
+
+
+# Статистика слов документа для ответа: top_words - [(слово, количество)],
+# упорядочивается по убыванию IDF
+def top_statistics(top_words: list, term_ids: dict, words_num: int, idf_map: dict):
+    return [
         {
-            "word": word["word"],
-            "tf": round(word["tf"], 4),
-            "idf": round(word.get("idf", 0), 4),
+            "word": word,
+            "tf": round(freq / words_num, 4),
+            "idf": round(idf_map.get(term_ids[word], 0), 4),
         }
-        for word in sorted(
-            updated_doc["words"], key=lambda w: w.get("idf", 0), reverse=True
+        for word, freq in sorted(
+            top_words, key=lambda w: idf_map.get(term_ids[w[0]], 0), reverse=True
         )
     ]
-    return result
+
+
+# Единый конвейер обработки загрузки, общий для страницы и API:
+# detect -> decode -> tokenize -> count -> store -> pack -> persist -> statistics.
+# Возвращает ID документа, статистику слов и время каждой стадии в секундах;
+# время стадий также попадает в метрики.
+def ingest_document(
+    stream, filename: str, collection_id: str, user_id, document_id=None
+) -> dict:
+    timer = StageTimer()
+    document, count, term_ids = prepare_document(stream, filename, collection_id, timer)
+    document_id, statistics = store_document(
+        document, count, term_ids, collection_id, user_id, timer, document_id
+    )
+    observe_stages(timer.timings)
+    return {
+        "document_id": document_id,
+        "statistics": statistics,
+        "timings": timer.rounded(),
+    }
+
+
+# Пакетная загрузка. uploads - [(имя документа, функция открытия)], как
+# возвращает archives.split_upload. Документы готовятся (prepare_streams)
+# одновременно в BATCH_WORKERS потоках: распаковка, сжатие и запись содержимого
+# отпускают GIL, большие файлы считаются в пуле процессов. Затем все документы
+# записываются одним insert_many, добавляются в коллекцию одним $addToSet с $each,
+# и статистика коллекции обновляется один раз (link_documents).
+# Файл с ошибкой распаковки не прерывает пакет: в его результате поле error.
+# Если запись пакета прервалась, уже записанные документы удаляются.
+# Возвращает результаты в порядке uploads: {filename, document_id, timings,
+# statistics} или {filename, error}.
+def ingest_batch(uploads: list, collection_id: str, user_id) -> list:
+    def prepare(upload):
+        filename, open_streams = upload
+        timer = StageTimer()
+        try:
+            members, size = open_streams()
+            prepared = prepare_streams(members, size, filename, collection_id, timer)
+        except ArchiveError as e:
+            return filename, None, str(e)
+        observe_stages(timer.timings)
+        return filename, (*prepared, timer), None
+
+    futures = [batch_executor.submit(prepare, upload) for upload in uploads]
+    wait(futures)
+    failures = [future.exception() for future in futures if future.exception()]
+    outcomes = [future.result() for future in futures if not future.exception()]
+    prepared = [item for _, item, _ in outcomes if item]
+    if failures:
+        # Пакет не записывается: ссылки на уже сохраненное содержимое снимаются
+        database.blobs.release([document["content_hash"] for document, *_ in prepared])
+        raise failures[0]
+
+    timer = StageTimer()
+    with timer.stage("persist"):
+        documents = [document for document, *_ in prepared]
+        for document in documents:
+            document["_id"] = ObjectId()
+            document["collection_id"] = ObjectId(collection_id)
+            document["user_id"] = ObjectId(user_id)
+            document["uploaded_at"] = time.time()
+        try:
+            document_ids = (
+                database.documents.insert_many(documents).inserted_ids
+                if documents
+                else []
+            )
+        except BaseException:
+            _rollback_documents(documents)
+            raise
+
+    with timer.stage("statistics"):
+        database.link_documents(
+            collection_id,
+            document_ids,
+            [
+                {term_ids[word]: freq for word, freq in count.items()}
+                for _, count, term_ids, _ in prepared
+            ],
+        )
+        top_words = [count.most_common(50) for _, count, _, _ in prepared]
+        idf_map = database.get_terms_idf(
+            database.get_collection_stats(collection_id),
+            {
+                term_ids[word]
+                for words, (_, _, term_ids, _) in zip(top_words, prepared)
+                for word, _ in words
+            },
+        )
+    observe_stages(timer.timings)
+
+    results = []
+    document_ids = iter(document_ids)
+    top_words = iter(top_words)
+    for filename, item, error in outcomes:
+        if item is None:
+            results.append({"filename": filename, "error": error})
+            continue
+        document, count, term_ids, file_timer = item
+        results.append(
+            {
+                "filename": filename,
+                "document_id": next(document_ids),
+                "timings": file_timer.rounded(),
+                "statistics": top_statistics(
+                    next(top_words), term_ids, document["words_num"], idf_map
+                ),
+            }
+        )
+    return results
+
+
+# Откат пакета, который не удалось записать целиком (например, insert_many
+# прервался на середине): записанные документы удаляются вместе со ссылками
+# на содержимое, у незаписанных ссылки на содержимое снимаются
+def _rollback_documents(documents: list):
+    ids = [document["_id"] for document in documents]
+    stored = {
+        document["_id"]
+        for document in database.documents.find({"_id": {"$in": ids}}, {"_id": 1})
+    }
+    database.delete_documents({"_id": {"$in": list(stored)}})
+    database.blobs.release(
+        [
+            document["content_hash"]
+            for document in documents
+            if document["_id"] not in stored
+        ]
+    )
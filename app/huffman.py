@@ -0,0 +1,305 @@
+import heapq
+import re
+from collections import Counter, deque
+import numpy as np
+from app.config import HUFFMAN_PARALLEL_THRESHOLD, HUFFMAN_PARALLEL_BATCH
+from app.tokenizer import get_pool, POOL_WORKERS
+
+# Деление текста на разделители (нечетные позиции split - слова)
+WORD_TOKENS = re.compile(r"(\w+)")
+# Символ словного кода, означающий слово не из словаря документа; пустая строка
+# не совпадает ни с одним словом или разделителем
+ESCAPE = ""
+
+# Сколько байт занимают развернутые в биты коды одного блока текста при кодировании
+ENCODE_BLOCK_BYTES = 16 * 1024 * 1024
+
+
+# Частоты символов текста: {символ: количество}. Символы считаются по кодовым
+# точкам через np.bincount, без словаря на каждый символ.
+def symbol_frequencies(text: str) -> dict:
+    points = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+    counts = np.bincount(points)
+    present = np.flatnonzero(counts)
+    return {chr(point): int(counts[point]) for point in present}
+
+
+# Длины кодов Хаффмана по частотам символов: {символ: длина в битах}.
+# Дерево строится без объектов узлов и рекурсии: для каждого узла хранится
+# только его родитель, глубины считаются одним проходом от корня к листьям.
+def code_lengths(freq: dict) -> dict:
+    symbols = list(freq)
+    if len(symbols) == 1:
+        return {symbols[0]: 1}
+    heap = [(count, node) for node, count in enumerate(freq.values())]
+    heapq.heapify(heap)
+    parent = [0] * (2 * len(symbols) - 1)
+    next_node = len(symbols)
+    while len(heap) > 1:
+        count_a, a = heapq.heappop(heap)
+        count_b, b = heapq.heappop(heap)
+        parent[a] = parent[b] = next_node
+        heapq.heappush(heap, (count_a + count_b, next_node))
+        next_node += 1
+    # Корень - последний созданный узел, у родителя номер всегда больше, чем у детей
+    depth = [0] * len(parent)
+    for node in range(len(parent) - 2, -1, -1):
+        depth[node] = depth[parent[node]] + 1
+    return {symbol: depth[node] for node, symbol in enumerate(symbols)}
+
+
+# Канонические коды по длинам: символы упорядочиваются по (длина, символ),
+# коды одной длины идут подряд. Код полностью задается упорядоченным списком
+# символов и количеством кодов каждой длины (counts[i] - кодов длины i + 1).
+# Возвращает (symbols, counts, {символ: (код, длина)}).
+def canonical_codes(lengths: dict) -> tuple:
+    symbols = sorted(lengths, key=lambda symbol: (lengths[symbol], symbol))
+    max_length = max(lengths.values(), default=0)
+    counts = [0] * max_length
+    codes = {}
+    code = 0
+    previous_length = 0
+    for symbol in symbols:
+        length = lengths[symbol]
+        code <<= length - previous_length
+        codes[symbol] = (code, length)
+        counts[length - 1] += 1
+        code += 1
+        previous_length = length
+    return symbols, counts, codes
+
+
+# Проверяет таблицу длин, полученную от клиента: количество символов совпадает
+# и коды не выходят за пределы двоичного дерева (неравенство Крафта)
+def validate_table(symbols: list, counts: list) -> bool:
+    if sum(counts) != len(symbols) or any(count < 0 for count in counts):
+        return False
+    available = 1
+    for count in counts:
+        available = available * 2 - count
+        if available < 0:
+            return False
+    return True
+
+
+# Упаковывает коды символов в байты, старшие биты первыми; последний байт
+# дополняется нулями. Возвращает (bytes, число значащих бит).
+def encode_bits(symbols, codes: dict) -> tuple:
+    out = bytearray()
+    accumulator = 0
+    pending = 0
+    total = 0
+    for symbol in symbols:
+        code, length = codes[symbol]
+        accumulator = (accumulator << length) | code
+        pending += length
+        total += length
+        while pending >= 8:
+            pending -= 8
+            out.append((accumulator >> pending) & 0xFF)
+        accumulator &= (1 << pending) - 1
+    if pending:
+        out.append((accumulator << (8 - pending)) & 0xFF)
+    return bytes(out), total
+
+
+# Декодирует bit_length бит data каноническим кодом (symbols, counts).
+# Возвращает список символов; ValueError, если биты не образуют целых кодов.
+def decode_bits(data: bytes, bit_length: int, symbols: list, counts: list) -> list:
+    if bit_length > len(data) * 8:
+        raise ValueError("Данных меньше, чем указано бит")
+    result = []
+    code = first = index = length = 0
+    for position in range(bit_length):
+        bit = (data[position >> 3] >> (7 - (position & 7))) & 1
+        code = (code << 1) | bit
+        if length == len(counts):
+            raise ValueError("Неизвестный код")
+        count = counts[length]
+        length += 1
+        if code - first < count:
+            result.append(symbols[index + code - first])
+            code = first = index = length = 0
+        else:
+            index += count
+            first = (first + count) << 1
+    if length:
+        raise ValueError("Данные обрываются посреди кода")
+    return result
+
+
+# Таблица кодирования символов для NumPy: код каждого символа развернут в строку
+# матрицы по байту на бит (старшие биты первыми), строка дополнена значением
+# PADDING до длины самого длинного кода. Номер строки по номеру символа (key:
+# кодовая точка для текста, индекс для слов) берется из плотной таблицы rows.
+# Кодирование блока - выборка строк, отбрасывание дополнения и одна упаковка packbits.
+class EncodingTable:
+    PADDING = 2
+
+    def __init__(self, codes: dict, key=ord):
+        points = np.array([key(symbol) for symbol in codes], dtype=np.uint32)
+        self.rows = np.zeros(int(points.max()) + 1, dtype=np.int32)
+        self.rows[points] = np.arange(len(points), dtype=np.int32)
+        self.max_length = max(length for _, length in codes.values())
+        self.bits = np.full((len(points), self.max_length), self.PADDING, np.uint8)
+        for row, (code, length) in enumerate(codes.values()):
+            for position in range(length):
+                self.bits[row, position] = (code >> (length - 1 - position)) & 1
+        self.block = max(1, ENCODE_BLOCK_BYTES // self.max_length)
+
+    def _encode_block(self, points) -> tuple:
+        expanded = np.take(self.bits, self.rows[points], axis=0)
+        bits = expanded[expanded != self.PADDING]
+        return np.packbits(bits), int(bits.size)
+
+    def encode(self, text: str) -> tuple:
+        writer = BitWriter()
+        for start in range(0, len(text), self.block):
+            points = np.frombuffer(
+                text[start : start + self.block].encode("utf-32-le"), dtype=np.uint32
+            )
+            writer.append(*self._encode_block(points))
+        return writer.getvalue()
+
+    # Кодирование массива номеров символов
+    def encode_points(self, points) -> tuple:
+        writer = BitWriter()
+        for start in range(0, len(points), self.block):
+            writer.append(*self._encode_block(points[start : start + self.block]))
+        return writer.getvalue()
+
+
+# Склейка упакованных кусков битового потока, длина которых не кратна байту:
+# каждый следующий кусок сдвигается на число бит, оставшихся от предыдущего.
+class BitWriter:
+    def __init__(self):
+        self._parts = []
+        self._tail = 0
+        self._tail_bits = 0
+        self.bit_length = 0
+
+    def append(self, packed, bit_length: int):
+        if not bit_length:
+            return
+        packed = np.frombuffer(packed, dtype=np.uint8)
+        shift = self._tail_bits
+        if shift:
+            merged = np.empty(len(packed) + 1, dtype=np.uint8)
+            merged[:-1] = packed >> shift
+            merged[-1] = 0
+            merged[0] |= self._tail
+            merged[1:] |= packed << (8 - shift)
+        else:
+            merged = packed
+        valid = shift + bit_length
+        full, self._tail_bits = divmod(valid, 8)
+        self._parts.append(merged[:full].tobytes())
+        self._tail = int(merged[full]) if self._tail_bits else 0
+        self.bit_length += bit_length
+
+    # Возвращает (bytes, число значащих бит)
+    def getvalue(self) -> tuple:
+        tail = bytes([self._tail]) if self._tail_bits else b""
+        return b"".join(self._parts) + tail, self.bit_length
+
+
+def _encode_batch(codes: dict, text: str) -> tuple:
+    return EncodingTable(codes).encode(text)
+
+
+# Кодирование текста таблицей codes. Большие тексты делятся на части, которые
+# кодируются в общем пуле процессов, результаты склеиваются по порядку.
+# parallel=None - выбор по размеру текста. Возвращает (bytes, число значащих бит).
+def encode_text(text: str, codes: dict, parallel: bool = None) -> tuple:
+    if not text:
+        return b"", 0
+    if parallel is None:
+        parallel = len(text) >= HUFFMAN_PARALLEL_THRESHOLD
+    if not parallel:
+        return EncodingTable(codes).encode(text)
+    pool = get_pool()
+    writer = BitWriter()
+    pending = deque()
+    for start in range(0, len(text), HUFFMAN_PARALLEL_BATCH):
+        batch = text[start : start + HUFFMAN_PARALLEL_BATCH]
+        pending.append(pool.submit(_encode_batch, codes, batch))
+        if len(pending) >= POOL_WORKERS * 2:
+            writer.append(*pending.popleft().result())
+    while pending:
+        writer.append(*pending.popleft().result())
+    return writer.getvalue()
+
+
+# Словный код: текст делится на слова и разделители. Частоты слов берутся из
+# сохраненных при загрузке количеств (слова в нижнем регистре), пересчитываются
+# только разделители. Слово, которого нет в words (например, с заглавной буквы),
+# кодируется символом ESCAPE, а само слово по порядку попадает в literals.
+# separators - разделители, у которых есть код (общий код коллекции); None -
+# любые разделители текста. Возвращает (символы текста, literals, частоты
+# разделителей и ESCAPE в тексте)
+def word_tokens(text: str, words, separators=None) -> tuple:
+    tokens = []
+    literals = []
+    extra = Counter()
+    for position, token in enumerate(WORD_TOKENS.split(text)):
+        if not token:
+            continue
+        if position % 2:
+            known = token in words
+        else:
+            known = separators is None or token in separators
+        if not known:
+            literals.append(token)
+            token = ESCAPE
+        if not position % 2 or token == ESCAPE:
+            extra[token] += 1
+        tokens.append(token)
+    return tokens, literals, extra
+
+
+# Коды по сохраненной таблице канонического кода (symbols, counts)
+def table_codes(symbols: list, counts: list) -> dict:
+    lengths = {}
+    position = 0
+    for length, count in enumerate(counts, 1):
+        for symbol in symbols[position : position + count]:
+            lengths[symbol] = length
+        position += count
+    return canonical_codes(lengths)[2]
+
+
+# Кодировщик последовательностей произвольных символов (слов): символы
+# нумеруются по списку symbols, номера кодируются таблицей EncodingTable.
+# Построенный кодировщик можно переиспользовать для многих текстов.
+class TokenEncoder:
+    def __init__(self, symbols: list, codes: dict):
+        self.index = {symbol: number for number, symbol in enumerate(symbols)}
+        self.table = None
+        if codes:
+            self.table = EncodingTable(
+                {self.index[symbol]: code for symbol, code in codes.items()}, key=int
+            )
+
+    def encode(self, tokens: list) -> tuple:
+        if not tokens:
+            return b"", 0
+        points = np.fromiter(
+            (self.index[token] for token in tokens), np.uint32, len(tokens)
+        )
+        return self.table.encode_points(points)
+
+
+# Обратная сборка текста словного кода: символы ESCAPE заменяются literals
+# по порядку. ValueError, если их количество не совпадает.
+def join_word_tokens(tokens: list, literals: list) -> str:
+    literals = iter(literals)
+    parts = []
+    for token in tokens:
+        if token == ESCAPE:
+            token = next(literals, None)
+            if token is None:
+                raise ValueError("Слов вне словаря больше, чем literals")
+        parts.append(token)
+    if next(literals, None) is not None:
+        raise ValueError("Лишние literals")
+    return "".join(parts)
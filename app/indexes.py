@@ -0,0 +1,167 @@
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from app.jobs import stale_jobs_query
+
+# Индексы всех коллекций базы. create_indexes с теми же ключами и параметрами
+# ничего не меняет, поэтому ensure_indexes можно вызывать при каждом запуске.
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("username", ASCENDING)], unique=True),
+    ],
+    "collections": [
+        # Список коллекций пользователя по курсору и поиск коллекции по имени
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)]),
+        IndexModel([("user_id", ASCENDING), ("name", ASCENDING)]),
+    ],
+    "documents": [
+        # Документы коллекции (страницы, $lookup, пересборка статистики)
+        IndexModel([("collection_id", ASCENDING), ("_id", ASCENDING)]),
+        # Документы пользователя по курсору
+        IndexModel([("user_id", ASCENDING), ("_id", ASCENDING)]),
+    ],
+    "term_stats": [
+        # Уникальный по слову коллекции для инкрементальных $inc
+        IndexModel([("collection_id", ASCENDING), ("term_id", ASCENDING)], unique=True),
+        # Страницы статистики по idf (df по возрастанию) и по tf (count по убыванию)
+        IndexModel(
+            [("collection_id", ASCENDING), ("df", ASCENDING), ("term_id", ASCENDING)]
+        ),
+        IndexModel(
+            [
+                ("collection_id", ASCENDING),
+                ("count", DESCENDING),
+                ("term_id", ASCENDING),
+            ]
+        ),
+    ],
+    "codebooks": [
+        # Версии общего кода коллекции; уникальность защищает от двух версий
+        # с одним номером при одновременном обучении
+        IndexModel(
+            [("collection_id", ASCENDING), ("version", DESCENDING)], unique=True
+        ),
+    ],
+    "metrics": [
+        # Почасовые корзины метрик (metric.py): выборка за сутки и удаление
+        # корзин старше недели
+        IndexModel([("hour", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "jobs": [
+        # Поиск задач с истекшей арендой (jobs.stale_jobs_query) и продление
+        # аренды задач процесса
+        IndexModel([("status", ASCENDING), ("lease_until", ASCENDING)]),
+        IndexModel([("owner", ASCENDING), ("status", ASCENDING)]),
+        # Завершенные задачи удаляются через неделю
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+    "vocabulary": [
+        # Уникальный индекс защищает от двух разных ID у одного слова, если слово
+        # одновременно добавляют несколько процессов
+        IndexModel([("collection_id", ASCENDING), ("word", ASCENDING)], unique=True),
+        IndexModel([("collection_id", ASCENDING), ("term_id", ASCENDING)]),
+    ],
+}
+
+
+# Создает недостающие индексы. Возвращает {коллекция: [имена индексов]}
+def ensure_indexes(database) -> dict:
+    return {
+        name: database.db[name].create_indexes(models)
+        for name, models in INDEXES.items()
+    }
+
+
+# Частые запросы приложения: (название, коллекция, фильтр, сортировка).
+# Значения в фильтрах произвольные, план запроса от них не зависит.
+def _hot_queries():
+    some_id = ObjectId()
+    return [
+        ("users by email", "users", {"email": ""}, None),
+        ("users by username", "users", {"username": ""}, None),
+        ("collections of user", "collections", {"user_id": some_id}, [("_id", 1)]),
+        (
+            "collection by name",
+            "collections",
+            {"user_id": some_id, "name": ""},
+            None,
+        ),
+        (
+            "documents of collection",
+            "documents",
+            {"collection_id": some_id},
+            [("_id", 1)],
+        ),
+        ("documents of user", "documents", {"user_id": some_id}, [("_id", 1)]),
+        (
+            "term stats by tf",
+            "term_stats",
+            {"collection_id": some_id},
+            [("count", -1), ("term_id", 1)],
+        ),
+        (
+            "term stats by idf",
+            "term_stats",
+            {"collection_id": some_id},
+            [("df", 1), ("term_id", 1)],
+        ),
+        (
+            "term stats of terms",
+            "term_stats",
+            {"collection_id": some_id, "term_id": {"$in": [0, 1]}},
+            None,
+        ),
+        (
+            "latest codebook",
+            "codebooks",
+            {"collection_id": some_id},
+            [("version", -1)],
+        ),
+        (
+            "metrics of last day",
+            "metrics",
+            {"hour": {"$gte": some_id.generation_time}},
+            None,
+        ),
+        ("stale jobs", "jobs", stale_jobs_query(0), None),
+        ("jobs of process", "jobs", {"owner": "", "status": {"$in": ["queued"]}}, None),
+        (
+            "vocabulary by words",
+            "vocabulary",
+            {"collection_id": some_id, "word": {"$in": ["a", "b"]}},
+            None,
+        ),
+        (
+            "vocabulary by ids",
+            "vocabulary",
+            {"collection_id": some_id, "term_id": {"$in": [0, 1]}},
+            None,
+        ),
+    ]
+
+
+def _plan_stages(plan) -> set:
+    stages = set()
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.add(plan["stage"])
+        for value in plan.values():
+            stages |= _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            stages |= _plan_stages(value)
+    return stages
+
+
+# Проверяет планы частых запросов через explain().
+# Возвращает [(название, стадии выбранного плана, есть ли COLLSCAN)]
+def check_indexes(database) -> list:
+    result = []
+    for name, collection, query, sort in _hot_queries():
+        cursor = database.db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        plan = cursor.explain()["queryPlanner"]["winningPlan"]
+        stages = _plan_stages(plan)
+        result.append((name, sorted(stages), "COLLSCAN" in stages))
+    return result
@@ -0,0 +1,273 @@
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.config import UPLOAD_SPOOL_DIR, JOBS_WORKERS, JOBS_LEASE, JOBS_MAX_ATTEMPTS
+from app.data import database
+from app.handling import ingest_document, top_statistics
+from app.metric import metrics
+from app.utils import process_token
+
+logger = logging.getLogger(__name__)
+
+# Пул фоновой обработки загрузок. Состояние задач хранится в коллекции jobs,
+# поэтому статус может отдать любой процесс приложения.
+executor = ThreadPoolExecutor(max_workers=JOBS_WORKERS, thread_name_prefix="ingest")
+
+# Состояния незавершенной задачи. Такая задача принадлежит процессу из поля owner,
+# пока не истекла ее аренда lease_until; процесс продлевает аренду своих задач
+# раз в треть JOBS_LEASE (_keep_jobs).
+ACTIVE_STATUSES = ["queued", "running"]
+
+
+# Запрос задач, которые может подхватить процесс: незавершенные задачи с истекшей
+# арендой и без аренды (созданные до ее появления). Использует индекс
+# (status, lease_until), проверяется командой check-indexes.
+def stale_jobs_query(now: float) -> dict:
+    return {
+        "status": {"$in": ACTIVE_STATUSES},
+        "$or": [{"lease_until": {"$lt": now}}, {"lease_until": {"$exists": False}}],
+    }
+
+
+_keeper_lock = threading.Lock()
+_keeper_started = False
+
+
+# Время завершения задачи хранится датой: по нему TTL-индекс удаляет
+# завершенные задачи (indexes.py)
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _spool_path(job_id) -> str:
+    return os.path.join(UPLOAD_SPOOL_DIR, str(job_id))
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# Создает задачу, сохраняет загруженный файл на диск и ставит задачу в очередь.
+# Задача записывается раньше файла: файл без незавершенной задачи считается
+# лишним и удаляется при восстановлении (recover_jobs). Возвращает ID задачи.
+def enqueue_upload(file, filename: str, collection_id: str, user_id) -> str:
+    job_id = ObjectId()
+    database.jobs.insert_one(
+        {
+            "_id": job_id,
+            "status": "queued",
+            "user_id": ObjectId(user_id),
+            "collection_id": ObjectId(collection_id),
+            "filename": filename,
+            "created_at": time.time(),
+            "owner": process_token(),
+            "lease_until": time.time() + JOBS_LEASE,
+            "attempts": 1,
+        }
+    )
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    path = _spool_path(job_id)
+    try:
+        file.save(path)
+    except Exception:
+        database.jobs.delete_one({"_id": job_id})
+        _remove(path)
+        raise
+    executor.submit(_run_upload_job, job_id, path, filename, collection_id, user_id)
+    return str(job_id)
+
+
+# Обработка сохраненной загрузки в фоновом потоке. Документ записывается под ID
+# задачи: если прошлая попытка успела его записать, он только добавляется
+# в коллекцию (повторно это ничего не меняет), второй документ не создается.
+def _run_upload_job(job_id, path, filename, collection_id, user_id):
+    start_time = time.time()
+    owned = {"_id": job_id, "owner": process_token()}
+    started = database.jobs.update_one(
+        owned, {"$set": {"status": "running", "started_at": start_time}}
+    )
+    if not started.matched_count:
+        return  # Аренда истекла, и задачу уже подхватил другой процесс
+    try:
+        result = _ingest_job(job_id, path, filename, collection_id, user_id)
+        duration = time.time() - start_time
+        metrics.register_file_processed(duration)
+        database.jobs.update_one(
+            owned,
+            {
+                "$set": {
+                    "status": "done",
+                    "finished_at": _now(),
+                    "result": {
+                        "document_id": str(result["document_id"]),
+                        "processing_time": round(duration, 3),
+                        "timings": result["timings"],
+                        "statistics": result["statistics"],
+                    },
+                }
+            },
+        )
+    except Exception as e:
+        database.jobs.update_one(
+            owned,
+            {"$set": {"status": "failed", "finished_at": _now(), "error": str(e)}},
+        )
+    finally:
+        _remove(path)
+
+
+def _ingest_job(job_id, path, filename, collection_id, user_id) -> dict:
+    document = database.documents.find_one({"_id": job_id})
+    if document is None:
+        try:
+            with open(path, "rb") as stream:
+                return ingest_document(stream, filename, collection_id, user_id, job_id)
+        except DuplicateKeyError:
+            # Документ одновременно записала прошлая попытка
+            document = database.documents.find_one({"_id": job_id})
+    return _finish_stored(document, collection_id)
+
+
+# Завершает задачу, документ которой записан прошлой попыткой
+def _finish_stored(document: dict, collection_id: str) -> dict:
+    count = Counter(database.document_counts(document))
+    term_ids = database.vocabulary.ids_for(collection_id, count)
+    database.link_document(
+        collection_id,
+        document["_id"],
+        database.document_term_counts(document, collection_id),
+    )
+    top_words = count.most_common(50)
+    idf_map = database.get_terms_idf(
+        database.get_collection_stats(collection_id),
+        [term_ids[word] for word, _ in top_words],
+    )
+    return {
+        "document_id": document["_id"],
+        "timings": {},
+        "statistics": top_statistics(
+            top_words, term_ids, document["words_num"], idf_map
+        ),
+    }
+
+
+def _fail(job_id, error: str):
+    database.jobs.update_one(
+        {"_id": job_id},
+        {"$set": {"status": "failed", "finished_at": _now(), "error": error}},
+    )
+
+
+# Подхватывает незавершенные задачи с истекшей арендой (процесс, который их
+# выполнял, перезапущен или упал) и задачи без аренды (stale_jobs_query):
+# задача с сохраненным файлом снова ставится в очередь этого процесса, если число
+# попыток не превышает JOBS_MAX_ATTEMPTS, иначе помечается failed. Затем удаляет
+# файлы каталога загрузок, у которых нет незавершенной задачи.
+# Возвращает {requeued, failed, removed_files}.
+def recover_jobs() -> dict:
+    requeued = failed = 0
+    while True:
+        now = time.time()
+        job = database.jobs.find_one_and_update(
+            stale_jobs_query(now),
+            {
+                "$set": {
+                    "status": "queued",
+                    "owner": process_token(),
+                    "lease_until": now + JOBS_LEASE,
+                },
+                "$inc": {"attempts": 1},
+            },
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            break
+        path = _spool_path(job["_id"])
+        if not os.path.exists(path):
+            _fail(job["_id"], "Файл загрузки потерян при перезапуске")
+            failed += 1
+        elif job["attempts"] > JOBS_MAX_ATTEMPTS:
+            _fail(job["_id"], f"Обработка прервана {JOBS_MAX_ATTEMPTS} раз")
+            _remove(path)
+            failed += 1
+        else:
+            executor.submit(
+                _run_upload_job,
+                job["_id"],
+                path,
+                job["filename"],
+                str(job["collection_id"]),
+                job["user_id"],
+            )
+            requeued += 1
+    return {
+        "requeued": requeued,
+        "failed": failed,
+        "removed_files": _remove_orphaned_files(),
+    }
+
+
+# Удаляет файлы каталога загрузок без незавершенной задачи. Файл появляется
+# после записи своей задачи, поэтому файл из списка каталога без задачи
+# в ACTIVE_STATUSES уже никто не обработает.
+def _remove_orphaned_files() -> int:
+    try:
+        names = [
+            name
+            for name in os.listdir(UPLOAD_SPOOL_DIR)
+            if os.path.isfile(os.path.join(UPLOAD_SPOOL_DIR, name))
+        ]
+    except FileNotFoundError:
+        return 0
+    job_ids = [ObjectId(name) for name in names if ObjectId.is_valid(name)]
+    active = {
+        str(job["_id"])
+        for job in database.jobs.find(
+            {"_id": {"$in": job_ids}, "status": {"$in": ACTIVE_STATUSES}}, {"_id": 1}
+        )
+    }
+    removed = 0
+    for name in names:
+        if name not in active:
+            _remove(os.path.join(UPLOAD_SPOOL_DIR, name))
+            removed += 1
+    return removed
+
+
+# Фоновый поток процесса: продлевает аренду задач процесса и подхватывает
+# задачи с истекшей арендой
+def _keep_jobs():
+    while True:
+        try:
+            database.jobs.update_many(
+                {"owner": process_token(), "status": {"$in": ACTIVE_STATUSES}},
+                {"$set": {"lease_until": time.time() + JOBS_LEASE}},
+            )
+            recover_jobs()
+        except Exception:
+            logger.exception("Не удалось восстановить фоновые задачи")
+        time.sleep(JOBS_LEASE / 3)
+
+
+# Запускает восстановление задач (один раз на процесс). Вызывается перед
+# обработкой запроса (create_app), поэтому поток работает только в процессах
+# сервера, а не в командах flask.
+def start_recovery():
+    global _keeper_started
+    if _keeper_started:
+        return
+    with _keeper_lock:
+        if _keeper_started:
+            return
+        _keeper_started = True
+    threading.Thread(target=_keep_jobs, name="jobs-keeper", daemon=True).start()
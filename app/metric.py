@@ -1,31 +1,142 @@
-from datetime import datetime, timedelta
-import statistics
+from datetime import datetime, timedelta, timezone
+from collections import Counter
+import bisect
+import math
+import threading
+from pymongo import UpdateOne
+from app.config import DATA_BACKEND
+from app.data import database
 
+# Границы корзин гистограммы времени обработки файла, в секундах.
+# Корзина i считает файлы со временем в (BUCKETS[i - 1], BUCKETS[i]],
+# последняя корзина (номер len(BUCKETS)) - все, что дольше BUCKETS[-1].
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+# Сколько последних времен обработки хранится в сводке
+LAST_TIMES = 5
+SUMMARY_ID = "uploads"
+HOUR_PREFIX = "uploads:"
 
-# Экземляр сборрщика метрик
+
+def _hour_start(moment: datetime) -> datetime:
+    return moment.replace(minute=0, second=0, microsecond=0)
+
+
+# Сборщик метрик обработки файлов. Вместо массивов всех времен хранятся агрегаты,
+# которые обновляются атомарными $inc/$min/$max, поэтому размер данных постоянный
+# и одновременные загрузки не теряют обновлений:
+# - сводка {_id: "uploads", files_processed, sum, sum_sq, min, max, latest,
+#   last_times - последние LAST_TIMES времен, buckets - {номер корзины: количество}};
+# - почасовые корзины {_id: "uploads:<час>", hour, files_processed}, старые
+#   удаляет TTL-индекс (indexes.py).
+# Метрики старого формата переносятся при первом обращении к сборщику, а не при
+# импорте модуля, чтобы приложение запускалось без доступа к MongoDB.
 class MetricsCollector:
     def __init__(self, database):
         self.metrics_table = database.metrics
-        if self.metrics_table.count_documents({}) == 0:
-            self.metrics_table.insert_one(
-                {"files_processed": 0, "processing_times": [], "timestamps": []}
+        self._migrated = False
+        self._migrate_lock = threading.Lock()
+
+    def _ensure_migrated(self):
+        if self._migrated:
+            return
+        with self._migrate_lock:
+            if not self._migrated:
+                self._migrate_legacy()
+                self._migrated = True
+
+    def _updates(self, processing_time: float, moment: datetime):
+        hour = _hour_start(moment.astimezone(timezone.utc).replace(tzinfo=None))
+        bucket = bisect.bisect_left(BUCKETS, processing_time)
+        return [
+            UpdateOne(
+                {"_id": SUMMARY_ID},
+                {
+                    "$inc": {
+                        "files_processed": 1,
+                        "sum": processing_time,
+                        "sum_sq": processing_time * processing_time,
+                        f"buckets.{bucket}": 1,
+                    },
+                    "$min": {"min": processing_time},
+                    "$max": {"max": processing_time, "latest": moment.isoformat()},
+                    "$push": {
+                        "last_times": {
+                            "$each": [round(processing_time, 3)],
+                            "$slice": -LAST_TIMES,
+                        }
+                    },
+                },
+                upsert=True,
+            ),
+            UpdateOne(
+                {"_id": HOUR_PREFIX + hour.isoformat(timespec="hours")},
+                {"$inc": {"files_processed": 1}, "$setOnInsert": {"hour": hour}},
+                upsert=True,
+            ),
+        ]
+
+    # Переносит метрики из документа старого формата (массивы processing_times
+    # и timestamps) в агрегаты. Документ сначала удаляется, поэтому при запуске
+    # нескольких процессов его переносит только один.
+    def _migrate_legacy(self):
+        legacy = self.metrics_table.find_one_and_delete(
+            {"processing_times": {"$exists": True}}
+        )
+        if not legacy:
+            return
+        timestamps = legacy.get("timestamps", [])
+        updates = []
+        for index, processing_time in enumerate(legacy.get("processing_times", [])):
+            moment = (
+                datetime.fromisoformat(timestamps[index])
+                if index < len(timestamps)
+                else datetime.now()
             )
+            updates.extend(self._updates(processing_time, moment))
+        if updates:
+            self.metrics_table.bulk_write(updates, ordered=True)
 
     def register_file_processed(self, processing_time: float):
-        doc = self.metrics_table.find_one()
+        self._ensure_migrated()
+        self.metrics_table.bulk_write(
+            self._updates(processing_time, datetime.now()), ordered=False
+        )
+
+    # Медиана по гистограмме: линейная интерполяция внутри корзины, в которую
+    # попадает середина, с границами, суженными до min и max
+    @staticmethod
+    def _median(doc: dict) -> float:
+        buckets = doc.get("buckets", {})
+        half = doc["files_processed"] / 2
+        seen = 0
+        for index in range(len(BUCKETS) + 1):
+            count = buckets.get(str(index), 0)
+            if count and seen + count >= half:
+                lower = max(BUCKETS[index - 1] if index else 0.0, doc["min"])
+                upper = min(
+                    BUCKETS[index] if index < len(BUCKETS) else doc["max"], doc["max"]
+                )
+                return lower + (upper - lower) * (half - seen) / count
+            seen += count
+        return doc["max"]
 
-        doc["files_processed"] += 1
-        doc["processing_times"].append(processing_time)
-        doc["timestamps"].append(datetime.now().isoformat())
+    def _summary(self):
+        self._ensure_migrated()
+        return self.metrics_table.find_one({"_id": SUMMARY_ID})
 
-        self.metrics_table.replace_one({}, doc)
+    # Количество файлов в почасовых корзинах, начиная с часа since
+    def _files_since(self, since: datetime) -> int:
+        return sum(
+            row["files_processed"]
+            for row in self.metrics_table.find(
+                {"hour": {"$gte": since}}, {"files_processed": 1}
+            )
+        )
 
     def get_metrics(self):
-        doc = self.metrics_table.find_one()
-        times = doc.get("processing_times", [])
-        timestamps_raw = doc.get("timestamps", [])
+        doc = self._summary()
 
-        if not times:
+        if not doc or not doc.get("files_processed"):
             return {
                 "files_processed": 0,
                 "min_time_processed": None,
@@ -38,28 +149,74 @@ class MetricsCollector:
                 "files_processed_last_24h": 0,
             }
 
-        avg_time = sum(times) / len(times)
-        min_time = min(times)
-        max_time = max(times)
-        std_dev = statistics.stdev(times) if len(times) > 1 else 0.0
-        median = statistics.median(times)
-        last_5_times = [round(t, 3) for t in times[-5:]]
-        latest_timestamp = timestamps_raw[-1] if timestamps_raw else None
+        count = doc["files_processed"]
+        avg_time = doc["sum"] / count
+        # Выборочное стандартное отклонение (как statistics.stdev) по сумме квадратов
+        variance = (
+            (doc["sum_sq"] - doc["sum"] * avg_time) / (count - 1) if count > 1 else 0.0
+        )
+        std_dev = math.sqrt(max(variance, 0.0))
 
-        # Подсчёт количества файлов за последние 24 часа
-        now = datetime.now()
-        last_24h = now - timedelta(hours=24)
-        timestamps = [datetime.fromisoformat(t) for t in timestamps_raw]
-        files_last_24h = sum(1 for t in timestamps if t > last_24h)
+        # Файлы за последние 24 часа - по почасовым корзинам: текущий час
+        # и 23 предыдущих
+        since = _hour_start(
+            datetime.now(timezone.utc).replace(tzinfo=None)
+        ) - timedelta(hours=23)
+        files_last_24h = self._files_since(since)
 
         return {
-            "files_processed": doc["files_processed"],
-            "min_time_processed": round(min_time, 3),
+            "files_processed": count,
+            "min_time_processed": round(doc["min"], 3),
             "avg_time_processed": round(avg_time, 3),
-            "max_time_processed": round(max_time, 3),
-            "latest_file_processed_timestamp": latest_timestamp,
+            "max_time_processed": round(doc["max"], 3),
+            "latest_file_processed_timestamp": doc.get("latest"),
             "std_dev_processing_time": round(std_dev, 3),
-            "median_processing_time": round(median, 3),
-            "last_5_processing_times": last_5_times,
+            "median_processing_time": round(self._median(doc), 3),
+            "last_5_processing_times": doc.get("last_times", []),
             "files_processed_last_24h": files_last_24h,
         }
+
+
+# Сборщик метрик в памяти процесса для APP_DATA_BACKEND=memory: те же агрегаты,
+# что и в MongoDB, хранятся в словаре сводки и счетчике почасовых корзин
+class MemoryMetricsCollector(MetricsCollector):
+    def __init__(self):
+        self.summary = {}
+        self.hours = Counter()
+        self._lock = threading.Lock()
+
+    def register_file_processed(self, processing_time: float):
+        moment = datetime.now()
+        hour = _hour_start(moment.astimezone(timezone.utc).replace(tzinfo=None))
+        bucket = str(bisect.bisect_left(BUCKETS, processing_time))
+        with self._lock:
+            doc = self.summary
+            doc["files_processed"] = doc.get("files_processed", 0) + 1
+            doc["sum"] = doc.get("sum", 0.0) + processing_time
+            doc["sum_sq"] = doc.get("sum_sq", 0.0) + processing_time * processing_time
+            buckets = doc.setdefault("buckets", {})
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+            doc["min"] = min(doc.get("min", processing_time), processing_time)
+            doc["max"] = max(doc.get("max", processing_time), processing_time)
+            doc["latest"] = max(doc.get("latest", ""), moment.isoformat())
+            doc["last_times"] = (
+                doc.get("last_times", []) + [round(processing_time, 3)]
+            )[-LAST_TIMES:]
+            self.hours[hour] += 1
+
+    def _summary(self):
+        with self._lock:
+            return dict(self.summary)
+
+    def _files_since(self, since: datetime) -> int:
+        with self._lock:
+            return sum(count for hour, count in self.hours.items() if hour >= since)
+
+
+METRICS_BACKENDS = {
+    "mongo": lambda: MetricsCollector(database),
+    "memory": MemoryMetricsCollector,
+}
+
+# Экземпляр сборщика метрик, который импортируют маршруты и фоновые задачи
+metrics = METRICS_BACKENDS[DATA_BACKEND]()
@@ -0,0 +1,716 @@
+import hashlib
+import threading
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from app.config import DATA_BACKEND
+from app.data import database, compute_idf
+from app.termvec import TERMS_PROJECTION, pack_ids, unpack_ids
+from app.tokenizer import count_words
+
+# Поля, которые читают маршруты. Каждая операция репозитория возвращает только их,
+# поэтому стоимость запросов видна в одном месте.
+USER_PROJECTION = {"username": 1}
+LOGIN_PROJECTION = {"username": 1, "h_password": 1, "collection_ids": 1}
+REGISTRATION_PROJECTION = {"username": 1, "email": 1}
+COLLECTION_PROJECTION = {"user_id": 1, "name": 1}
+DOC_META_PROJECTION = {
+    "filename": 1,
+    "collection_id": 1,
+    "user_id": 1,
+    "words_num": 1,
+    "uploaded_at": 1,
+}
+DOC_CONTENT_PROJECTION = {
+    "filename": 1,
+    "content": 1,
+    "content_hash": 1,
+    "content_size": 1,
+}
+DOC_TERMS_PROJECTION = {"filename": 1, "collection_id": 1, **TERMS_PROJECTION}
+# Поля для переноса документа между коллекциями: владелец, коллекция и вектор слов
+DOC_MEMBERSHIP_PROJECTION = {"user_id": 1, "collection_id": 1, **TERMS_PROJECTION}
+# Описание версии общего кода коллекции без самой таблицы кода
+CODEBOOK_INFO_PROJECTION = {
+    "collection_id": 1,
+    "version": 1,
+    "docs_count": 1,
+    "created_at": 1,
+}
+
+
+# Содержимое, хранящееся прямо в документе: один кусок, ETag - SHA-256 как у блобов
+def _inline_content(content: str) -> tuple:
+    data = content.encode("utf-8")
+    return iter([data]), len(data), hashlib.sha256(data).hexdigest()
+
+
+# Репозиторий поверх MongoDB: чтение данных для маршрутов явными запросами
+# с проекциями и пакетными выборками. Статистика и словари берутся из DataBase.
+class MongoRepository:
+    def __init__(self, database):
+        self.database = database
+
+    def get_user(self, user_id):
+        return self.database.users.find_one({"_id": ObjectId(user_id)}, USER_PROJECTION)
+
+    def find_user_by_email(self, email: str):
+        return self.database.users.find_one({"email": email}, LOGIN_PROJECTION)
+
+    def get_collection(self, collection_id):
+        return self.database.collections.find_one(
+            {"_id": ObjectId(collection_id)}, COLLECTION_PROJECTION
+        )
+
+    # Пользователь с таким именем или email (проверка при регистрации)
+    def find_user_by_name_or_email(self, username: str, email: str):
+        return self.database.users.find_one(
+            {"$or": [{"username": username}, {"email": email}]},
+            REGISTRATION_PROJECTION,
+        )
+
+    def add_user(self, username: str, email: str = None, h_password: str = None):
+        return self.database.users.insert_one(
+            {
+                "username": username,
+                "email": email,
+                "h_password": h_password,
+                "collection_ids": [],
+            }
+        ).inserted_id
+
+    # Возвращает False, если пользователя нет
+    def set_password(self, user_id, h_password: str) -> bool:
+        return bool(
+            self.database.users.update_one(
+                {"_id": ObjectId(user_id)}, {"$set": {"h_password": h_password}}
+            ).matched_count
+        )
+
+    # Удаляет пользователя вместе с его документами и коллекциями.
+    # Документы удаляются раньше статистики коллекций, чтобы их векторы
+    # не переписывались перед удалением. Возвращает False, если пользователя нет.
+    def delete_user(self, user_id) -> bool:
+        user_id = ObjectId(user_id)
+        if not self.database.users.delete_one({"_id": user_id}).deleted_count:
+            return False
+        collection_ids = [
+            col["_id"]
+            for col in self.database.collections.find({"user_id": user_id}, {"_id": 1})
+        ]
+        self.database.delete_documents({"user_id": user_id})
+        self.database.drop_collection_stats(collection_ids)
+        self.database.collections.delete_many({"user_id": user_id})
+        return True
+
+    def find_collection_by_name(self, user_id, name: str):
+        return self.database.collections.find_one(
+            {"user_id": ObjectId(user_id), "name": name}, COLLECTION_PROJECTION
+        )
+
+    # Все коллекции пользователя (для страницы коллекций)
+    def list_user_collections(self, user_id) -> list:
+        return list(
+            self.database.collections.find(
+                {"user_id": ObjectId(user_id)}, COLLECTION_PROJECTION
+            )
+        )
+
+    def add_collection(self, user_id, name: str):
+        collection_id = self.database.collections.insert_one(
+            {"user_id": ObjectId(user_id), "name": name, "doc_ids": []}
+        ).inserted_id
+        self.database.users.update_one(
+            {"_id": ObjectId(user_id)}, {"$push": {"collection_ids": collection_id}}
+        )
+        return collection_id
+
+    # Удаляет коллекцию пользователя и ее статистику; документы остаются.
+    # Возвращает False, если такой коллекции у пользователя нет.
+    def delete_collection(self, collection_id, user_id) -> bool:
+        collection_id = ObjectId(collection_id)
+        result = self.database.collections.delete_one(
+            {"_id": collection_id, "user_id": ObjectId(user_id)}
+        )
+        if not result.deleted_count:
+            return False
+        self.database.drop_collection_stats([collection_id])
+        self.database.users.update_one(
+            {"_id": ObjectId(user_id)}, {"$pull": {"collection_ids": collection_id}}
+        )
+        return True
+
+    # Страница коллекций пользователя вместе с первыми документами каждой из них,
+    # одной агрегацией: документы подтягиваются $lookup по полю collection_id,
+    # из них берутся только _id и filename. Коллекции и документы упорядочены по _id,
+    # after - ID последней коллекции предыдущей страницы.
+    def list_collections(
+        self, user_id, after, limit: int, documents_limit: int
+    ) -> list:
+        query = {"user_id": ObjectId(user_id)}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        pipeline = [
+            {"$match": query},
+            {"$sort": {"_id": 1}},
+            {"$limit": limit},
+            {"$project": {"name": 1}},
+            {
+                "$lookup": {
+                    "from": "documents",
+                    "let": {"collection_id": "$_id"},
+                    "pipeline": [
+                        {
+                            "$match": {
+                                "$expr": {"$eq": ["$collection_id", "$$collection_id"]}
+                            }
+                        },
+                        {"$sort": {"_id": 1}},
+                        {"$limit": documents_limit},
+                        {"$project": {"filename": 1}},
+                    ],
+                    "as": "documents",
+                }
+            },
+        ]
+        return list(self.database.collections.aggregate(pipeline))
+
+    # Страница документов коллекции (только _id и filename) после документа after
+    def list_collection_documents(self, collection_id, after, limit: int) -> list:
+        query = {"collection_id": ObjectId(collection_id)}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        return list(
+            self.database.documents.find(query, {"filename": 1})
+            .sort("_id", 1)
+            .limit(limit)
+        )
+
+    # Документы пользователя (только _id и filename) после документа after.
+    # Возвращает курсор: документы читаются из базы по мере обхода.
+    def list_documents(self, user_id, after, limit: int):
+        query = {"user_id": ObjectId(user_id)}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        return (
+            self.database.documents.find(query, {"filename": 1})
+            .sort("_id", 1)
+            .limit(limit)
+        )
+
+    # Документ пользователя с полями projection (одна из *_PROJECTION выше)
+    def get_document(self, document_id, user_id, projection: dict):
+        return self.database.documents.find_one(
+            {"_id": ObjectId(document_id), "user_id": ObjectId(user_id)}, projection
+        )
+
+    # Документ с полями projection без проверки владельца: маршрут сам
+    # различает "не найден" (404) и "чужой" (403)
+    def find_document(self, document_id, projection: dict):
+        return self.database.documents.find_one(
+            {"_id": ObjectId(document_id)}, projection
+        )
+
+    # Переносит документ (прочитанный с DOC_MEMBERSHIP_PROJECTION) в коллекцию:
+    # если он состоял в другой коллекции, убирает его оттуда вместе со статистикой,
+    # перезаписывает вектор частот в ID словаря новой коллекции и учитывает его
+    # слова в ее частотах
+    def add_to_collection(self, document: dict, collection_id):
+        previous_collection_id = document.get("collection_id")
+        if previous_collection_id and previous_collection_id != ObjectId(collection_id):
+            self.database.unlink_document(
+                previous_collection_id,
+                document["_id"],
+                self.database.document_term_counts(document, previous_collection_id),
+            )
+        counts = self.database.document_term_counts(document, collection_id)
+        self.database.documents.update_one(
+            {"_id": document["_id"]},
+            {
+                "$set": {
+                    "collection_id": ObjectId(collection_id),
+                    "terms": pack_ids(counts),
+                    "vocabulary_id": ObjectId(collection_id),
+                }
+            },
+        )
+        self.database.link_document(collection_id, document["_id"], counts)
+
+    # Убирает документ из коллекции collection_id, в которой он состоит,
+    # и вычитает его слова из ее частот
+    def remove_from_collection(self, document: dict, collection_id):
+        self.database.documents.update_one(
+            {"_id": document["_id"], "collection_id": ObjectId(collection_id)},
+            {"$unset": {"collection_id": ""}},
+        )
+        self.database.unlink_document(
+            collection_id,
+            document["_id"],
+            self.database.document_term_counts(document, collection_id),
+        )
+
+    # Метаданные нескольких документов одним запросом, в порядке document_ids
+    def get_doc_meta_many(self, document_ids: list) -> list:
+        document_ids = [ObjectId(document_id) for document_id in document_ids]
+        found = {
+            doc["_id"]: doc
+            for doc in self.database.documents.find(
+                {"_id": {"$in": document_ids}}, DOC_META_PROJECTION
+            )
+        }
+        return [
+            found[document_id] for document_id in document_ids if document_id in found
+        ]
+
+    def get_collection_stats(self, collection_id) -> dict:
+        return self.database.get_collection_stats(collection_id)
+
+    def get_term_stats(self, stats: dict, sort: str, offset: int, limit: int) -> tuple:
+        return self.database.get_term_statistics(stats, sort, offset, limit)
+
+    def get_idf_map(self, stats: dict) -> dict:
+        return self.database.get_idf_map(stats)
+
+    def document_counts(self, doc: dict) -> dict:
+        return self.database.document_counts(doc)
+
+    # Текст документа, прочитанного с DOC_CONTENT_PROJECTION
+    def read_content(self, doc: dict) -> str:
+        return self.database.document_content(doc)
+
+    # Содержимое документа в UTF-8 для потоковой отдачи: (куски байтов, размер, ETag)
+    def open_content(self, doc: dict) -> tuple:
+        if "content_hash" in doc:
+            return (
+                self.database.blobs.open(doc["content_hash"]),
+                doc["content_size"],
+                doc["content_hash"],
+            )
+        return _inline_content(doc.get("content", ""))
+
+    # ID слов в словаре коллекции; слов, которых нет в словаре, нет и в результате
+    def term_ids(self, collection_id, words) -> dict:
+        return self.database.vocabulary.ids_for(collection_id, words, create=False)
+
+    def term_words(self, collection_id, term_ids) -> dict:
+        return self.database.vocabulary.words_for(collection_id, term_ids)
+
+    # Последняя версия общего кода коллекции (без таблицы) или None
+    def latest_codebook(self, collection_id):
+        return self.database.codebooks.find_one(
+            {"collection_id": ObjectId(collection_id)},
+            CODEBOOK_INFO_PROJECTION,
+            sort=[("version", -1)],
+        )
+
+    def get_codebook(self, codebook_id, projection: dict = None):
+        return self.database.codebooks.find_one(
+            {"_id": ObjectId(codebook_id)}, projection
+        )
+
+    # Сохраняет новую версию общего кода коллекции с номером на 1 больше последнего.
+    # Если версию с тем же номером одновременно сохранил другой процесс, уникальный
+    # индекс отклоняет вставку и номер берется заново.
+    def save_codebook(self, codebook: dict) -> dict:
+        while True:
+            latest = self.latest_codebook(codebook["collection_id"])
+            record = {
+                **codebook,
+                "_id": ObjectId(),
+                "version": latest["version"] + 1 if latest else 1,
+            }
+            try:
+                self.database.codebooks.insert_one(record)
+                return record
+            except DuplicateKeyError:
+                continue
+
+
+# Репозиторий в памяти процесса с теми же операциями, что и MongoRepository.
+# Нужен для замеров и нагрузочных тестов маршрутов на машине без MongoDB:
+# регистрация, коллекции и перенос документов между ними работают через маршруты,
+# документы добавляются методом add_document (загрузка файлов по-прежнему
+# требует MongoDB), статистика коллекций ведется так же, как в DataBase.link_document.
+class MemoryRepository:
+    def __init__(self):
+        self.users = {}
+        self.collections = {}
+        self.documents = {}
+        # {collection_id: {term_id: {"df": ..., "count": ...}}}
+        self.term_stats = {}
+        self.collection_stats = {}
+        # {collection_id: {слово: ID}}
+        self.vocabulary = {}
+        self.codebooks = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _project(doc, projection: dict):
+        if doc is None:
+            return None
+        return {
+            key: value
+            for key, value in doc.items()
+            if key == "_id" or key in projection
+        }
+
+    def add_user(self, username: str, email: str = None, h_password: str = None):
+        user_id = ObjectId()
+        self.users[user_id] = {
+            "_id": user_id,
+            "username": username,
+            "email": email,
+            "h_password": h_password,
+            "collection_ids": [],
+        }
+        return user_id
+
+    def add_collection(self, user_id, name: str):
+        collection_id = ObjectId()
+        self.collections[collection_id] = {
+            "_id": collection_id,
+            "user_id": ObjectId(user_id),
+            "name": name,
+            "doc_ids": [],
+        }
+        self.users[ObjectId(user_id)]["collection_ids"].append(collection_id)
+        return collection_id
+
+    # Добавляет документ в коллекцию: слова считаются так же, как при загрузке,
+    # вектор частот упаковывается в формате 2, статистика коллекции обновляется
+    def add_document(self, collection_id, user_id, filename: str, content: str):
+        collection_id = ObjectId(collection_id)
+        count = count_words(content)
+        with self._lock:
+            term_counts = self._term_counts(collection_id, count)
+            document_id = ObjectId()
+            self.documents[document_id] = {
+                "_id": document_id,
+                "filename": filename,
+                "content": content,
+                "words_num": sum(count.values()),
+                "terms": pack_ids(term_counts),
+                "vocabulary_id": collection_id,
+                "collection_id": collection_id,
+                "user_id": ObjectId(user_id),
+            }
+            self._apply_terms(collection_id, document_id, term_counts, 1)
+        return document_id
+
+    # ID слов в словаре коллекции; новые слова получают следующие ID
+    def _term_counts(self, collection_id: ObjectId, count: dict) -> dict:
+        vocabulary = self.vocabulary.setdefault(collection_id, {})
+        for word in count:
+            vocabulary.setdefault(word, len(vocabulary))
+        return {vocabulary[word]: freq for word, freq in count.items()}
+
+    # Добавляет (sign=1) или убирает (sign=-1) документ в коллекции и учитывает
+    # его слова в статистике коллекции, как DataBase.link_document/unlink_document
+    def _apply_terms(self, collection_id, document_id, term_counts: dict, sign: int):
+        doc_ids = self.collections[collection_id]["doc_ids"]
+        if sign > 0:
+            doc_ids.append(document_id)
+        else:
+            doc_ids.remove(document_id)
+        rows = self.term_stats.setdefault(collection_id, {})
+        for term_id, freq in term_counts.items():
+            row = rows.setdefault(term_id, {"df": 0, "count": 0})
+            row["df"] += sign
+            row["count"] += sign * freq
+            if row["df"] <= 0:
+                del rows[term_id]
+        stats = self.get_collection_stats(collection_id)
+        stats["docs_count"] += sign
+        stats["words_total"] += sign * sum(term_counts.values())
+        stats["terms_count"] = len(rows)
+        stats["version"] += 1
+        self.collection_stats[collection_id] = stats
+
+    def find_user_by_name_or_email(self, username: str, email: str):
+        for user in self.users.values():
+            if user["username"] == username or user["email"] == email:
+                return self._project(user, REGISTRATION_PROJECTION)
+        return None
+
+    def set_password(self, user_id, h_password: str) -> bool:
+        user = self.users.get(ObjectId(user_id))
+        if user is None:
+            return False
+        user["h_password"] = h_password
+        return True
+
+    def delete_user(self, user_id) -> bool:
+        user_id = ObjectId(user_id)
+        with self._lock:
+            if self.users.pop(user_id, None) is None:
+                return False
+            for document_id in [
+                doc["_id"]
+                for doc in self.documents.values()
+                if doc["user_id"] == user_id
+            ]:
+                del self.documents[document_id]
+            for collection_id in [
+                collection["_id"]
+                for collection in self.collections.values()
+                if collection["user_id"] == user_id
+            ]:
+                self._drop_collection(collection_id)
+                self.vocabulary.pop(collection_id, None)
+        return True
+
+    def find_collection_by_name(self, user_id, name: str):
+        for collection in self.collections.values():
+            if (
+                collection["user_id"] == ObjectId(user_id)
+                and collection["name"] == name
+            ):
+                return self._project(collection, COLLECTION_PROJECTION)
+        return None
+
+    def list_user_collections(self, user_id) -> list:
+        return [
+            self._project(collection, COLLECTION_PROJECTION)
+            for collection in self.collections.values()
+            if collection["user_id"] == ObjectId(user_id)
+        ]
+
+    def _drop_collection(self, collection_id: ObjectId):
+        del self.collections[collection_id]
+        self.term_stats.pop(collection_id, None)
+        self.collection_stats.pop(collection_id, None)
+        for codebook_id in [
+            codebook["_id"]
+            for codebook in self.codebooks.values()
+            if codebook["collection_id"] == collection_id
+        ]:
+            del self.codebooks[codebook_id]
+        for doc in self.documents.values():
+            if doc.get("collection_id") == collection_id:
+                del doc["collection_id"]
+
+    # Словарь удаленной коллекции остается: на него ссылаются векторы
+    # ее документов (vocabulary_id)
+    def delete_collection(self, collection_id, user_id) -> bool:
+        collection_id = ObjectId(collection_id)
+        with self._lock:
+            collection = self.collections.get(collection_id)
+            if collection is None or collection["user_id"] != ObjectId(user_id):
+                return False
+            self._drop_collection(collection_id)
+            user = self.users.get(ObjectId(user_id))
+            if user and collection_id in user["collection_ids"]:
+                user["collection_ids"].remove(collection_id)
+        return True
+
+    def find_document(self, document_id, projection: dict):
+        return self._project(self.documents.get(ObjectId(document_id)), projection)
+
+    def add_to_collection(self, document: dict, collection_id):
+        collection_id = ObjectId(collection_id)
+        with self._lock:
+            doc = self.documents[document["_id"]]
+            count = self.document_counts(doc)
+            previous_collection_id = doc.get("collection_id")
+            if previous_collection_id == collection_id:
+                return
+            if previous_collection_id is not None:
+                self._apply_terms(
+                    previous_collection_id,
+                    doc["_id"],
+                    self._term_counts(previous_collection_id, count),
+                    -1,
+                )
+            term_counts = self._term_counts(collection_id, count)
+            doc["terms"] = pack_ids(term_counts)
+            doc["vocabulary_id"] = collection_id
+            doc["collection_id"] = collection_id
+            self._apply_terms(collection_id, doc["_id"], term_counts, 1)
+
+    def remove_from_collection(self, document: dict, collection_id):
+        collection_id = ObjectId(collection_id)
+        with self._lock:
+            doc = self.documents[document["_id"]]
+            if doc.get("collection_id") != collection_id:
+                return
+            del doc["collection_id"]
+            self._apply_terms(
+                collection_id,
+                doc["_id"],
+                unpack_ids(doc["terms"]),
+                -1,
+            )
+
+    def get_user(self, user_id):
+        return self._project(self.users.get(ObjectId(user_id)), USER_PROJECTION)
+
+    def find_user_by_email(self, email: str):
+        for user in self.users.values():
+            if user["email"] == email:
+                return self._project(user, LOGIN_PROJECTION)
+        return None
+
+    def get_collection(self, collection_id):
+        return self._project(
+            self.collections.get(ObjectId(collection_id)), COLLECTION_PROJECTION
+        )
+
+    def _documents_after(self, key: str, value, after, limit: int) -> list:
+        return sorted(
+            (
+                {"_id": doc["_id"], "filename": doc["filename"]}
+                for doc in self.documents.values()
+                if doc.get(key) == value and (after is None or doc["_id"] > after)
+            ),
+            key=lambda doc: doc["_id"],
+        )[:limit]
+
+    def list_collections(
+        self, user_id, after, limit: int, documents_limit: int
+    ) -> list:
+        collections = sorted(
+            (
+                collection
+                for collection in self.collections.values()
+                if collection["user_id"] == ObjectId(user_id)
+                and (after is None or collection["_id"] > after)
+            ),
+            key=lambda collection: collection["_id"],
+        )[:limit]
+        return [
+            {
+                "_id": collection["_id"],
+                "name": collection["name"],
+                "documents": self._documents_after(
+                    "collection_id", collection["_id"], None, documents_limit
+                ),
+            }
+            for collection in collections
+        ]
+
+    def list_collection_documents(self, collection_id, after, limit: int) -> list:
+        return self._documents_after(
+            "collection_id", ObjectId(collection_id), after, limit
+        )
+
+    def list_documents(self, user_id, after, limit: int):
+        return self._documents_after("user_id", ObjectId(user_id), after, limit)
+
+    def get_document(self, document_id, user_id, projection: dict):
+        doc = self.documents.get(ObjectId(document_id))
+        if doc is None or doc["user_id"] != ObjectId(user_id):
+            return None
+        return self._project(doc, projection)
+
+    def get_doc_meta_many(self, document_ids: list) -> list:
+        return [
+            self._project(self.documents[ObjectId(document_id)], DOC_META_PROJECTION)
+            for document_id in document_ids
+            if ObjectId(document_id) in self.documents
+        ]
+
+    def get_collection_stats(self, collection_id) -> dict:
+        collection_id = ObjectId(collection_id)
+        return dict(
+            self.collection_stats.get(collection_id)
+            or {
+                "_id": collection_id,
+                "docs_count": 0,
+                "words_total": 0,
+                "terms_count": 0,
+                "version": 0,
+            }
+        )
+
+    def get_term_stats(self, stats: dict, sort: str, offset: int, limit: int) -> tuple:
+        if not stats["docs_count"] or not stats["words_total"]:
+            return [], 0
+        rows = []
+        for term_id, row in self.term_stats.get(stats["_id"], {}).items():
+            tf = row["count"] / stats["words_total"]
+            idf = compute_idf(stats["docs_count"], row["df"])
+            rows.append(
+                {
+                    "term_id": term_id,
+                    "df": row["df"],
+                    "count": row["count"],
+                    "tf": tf,
+                    "idf": idf,
+                    "tf_idf": tf * idf,
+                }
+            )
+        rows.sort(key=lambda row: (-row[sort], row["term_id"]))
+        return rows[offset : offset + limit], stats["terms_count"]
+
+    def get_idf_map(self, stats: dict) -> dict:
+        return {
+            term_id: compute_idf(stats["docs_count"], row["df"])
+            for term_id, row in self.term_stats.get(stats["_id"], {}).items()
+        }
+
+    def document_counts(self, doc: dict) -> dict:
+        words = self.term_words(doc["vocabulary_id"], None)
+        return {
+            words[term_id]: count for term_id, count in unpack_ids(doc["terms"]).items()
+        }
+
+    def read_content(self, doc: dict) -> str:
+        return doc["content"]
+
+    def open_content(self, doc: dict) -> tuple:
+        return _inline_content(doc["content"])
+
+    def term_ids(self, collection_id, words) -> dict:
+        vocabulary = self.vocabulary.get(ObjectId(collection_id), {})
+        return {word: vocabulary[word] for word in words if word in vocabulary}
+
+    # Без term_ids возвращает весь словарь коллекции
+    def term_words(self, collection_id, term_ids) -> dict:
+        words = {
+            term_id: word
+            for word, term_id in self.vocabulary.get(
+                ObjectId(collection_id), {}
+            ).items()
+        }
+        if term_ids is None:
+            return words
+        return {term_id: words[term_id] for term_id in term_ids if term_id in words}
+
+    def latest_codebook(self, collection_id):
+        versions = [
+            codebook
+            for codebook in self.codebooks.values()
+            if codebook["collection_id"] == ObjectId(collection_id)
+        ]
+        if not versions:
+            return None
+        latest = max(versions, key=lambda codebook: codebook["version"])
+        return self._project(latest, CODEBOOK_INFO_PROJECTION)
+
+    def get_codebook(self, codebook_id, projection: dict = None):
+        codebook = self.codebooks.get(ObjectId(codebook_id))
+        return codebook if projection is None else self._project(codebook, projection)
+
+    def save_codebook(self, codebook: dict) -> dict:
+        with self._lock:
+            latest = self.latest_codebook(codebook["collection_id"])
+            record = {
+                **codebook,
+                "_id": ObjectId(),
+                "version": latest["version"] + 1 if latest else 1,
+            }
+            self.codebooks[record["_id"]] = record
+        return record
+
+
+REPOSITORY_BACKENDS = {
+    "mongo": lambda: MongoRepository(database),
+    "memory": MemoryRepository,
+}
+
+if DATA_BACKEND not in REPOSITORY_BACKENDS:
+    raise ValueError(
+        f"APP_DATA_BACKEND должен быть одним из: {', '.join(REPOSITORY_BACKENDS)}"
+    )
+
+# Экземпляр репозитория, который импортируют маршруты
+repository = REPOSITORY_BACKENDS[DATA_BACKEND]()
@@ -4,6 +4,7 @@ def register_api_blueprints(app):
     from .collections import api_collections_bp
     from .documents import api_documents_bp
     from .huffman import api_huffman_bp
+    from .jobs import api_jobs_bp
     from .user import api_user_bp
     from .utils import api_utils_bp
 
@@ -11,5 +12,6 @@ def register_api_blueprints(app):
     app.register_blueprint(api_collections_bp)
     app.register_blueprint(api_documents_bp)
     app.register_blueprint(api_huffman_bp)
+    app.register_blueprint(api_jobs_bp)
     app.register_blueprint(api_user_bp)
     app.register_blueprint(api_utils_bp)
@@ -1,6 +1,7 @@
 from flask import request, jsonify, Blueprint
 from flasgger import swag_from
-from app.data import database, User
+from app.data import User
+from app.repository import repository
 import hashlib, re
 from flask_login import login_user
 
@@ -53,7 +54,7 @@ def api_login():
     if not email or not password:
         return jsonify({"error": "Логин и пароль обязательны"}), 400
 
-    user_data = database.users.find_one({"email": email})
+    user_data = repository.find_user_by_email(email)
     if not user_data or not (
         hashlib.sha256(password.encode()).hexdigest() == user_data["h_password"]
     ):
@@ -124,23 +125,19 @@ def api_register():
     if not is_valid_email(email):
         return jsonify({"error": "Некорректный формат email"}), 400
 
-    if database.users.find_one({"username": username}):
+    existing_user = repository.find_user_by_name_or_email(username, email)
+    if existing_user and existing_user["username"] == username:
         return jsonify({"error": "Пользователь с таким именем уже существует"}), 400
 
-    if database.users.find_one({"email": email}):
+    if existing_user:
         return jsonify({"error": "Пользователь с таким email уже существует"}), 400
 
-    new_user = {
-        "email": email,
-        "username": username,
-        "h_password": hashlib.sha256(password.encode()).hexdigest(),
-        "collection_ids": [],
-    }
-
-    result = database.users.insert_one(new_user)
+    user_id = repository.add_user(
+        username, email, hashlib.sha256(password.encode()).hexdigest()
+    )
     return jsonify(
         {
             "message": "Пользователь успешно зарегистрирован",
-            "user_id": str(result.inserted_id),
+            "user_id": str(user_id),
         }
     )
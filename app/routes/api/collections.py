@@ -1,12 +1,17 @@
-from flask import Blueprint, jsonify, abort, request
+from flask import Blueprint, jsonify, abort, request, url_for
 from flasgger import swag_from
 from bson import ObjectId
-from app.data import database
-from app.utils import allowed_file
+from app.repository import repository, DOC_MEMBERSHIP_PROJECTION
+from app.utils import allowed_file, page_args, split_page
 from flask_login import login_required, current_user
-from collections import defaultdict
-from .utils import metrics
-import time, chardet
+from app.metric import metrics
+from app.handling import ingest_batch, ingest_document
+from app.archives import ArchiveError, split_upload
+from app.vocabulary import CollectionNotFound
+from app.config import BATCH_MAX_FILES
+from app.jobs import enqueue_upload
+from app.codebooks import train_codebook
+import time
 
 api_collections_bp = Blueprint("api_collections", __name__)
 
@@ -30,7 +35,14 @@ api_collections_bp = Blueprint("api_collections", __name__)
                 "in": "formData",
                 "type": "file",
                 "required": True,
-                "description": "Текстовый файл для загрузки",
+                "description": "Текстовый файл для загрузки. Файл может быть сжат (.gz, .bz2, .xz) или быть архивом .zip: текстовые файлы архива образуют один документ",
+            },
+            {
+                "name": "async",
+                "in": "query",
+                "type": "boolean",
+                "required": False,
+                "description": "Обработать файл в фоне. Ответ 202 содержит ID задачи для /api/jobs/<job_id>",
             },
         ],
         "consumes": ["multipart/form-data"],
@@ -42,6 +54,24 @@ api_collections_bp = Blueprint("api_collections", __name__)
                         "message": "Документ успешно загружен",
                         "document_id": "60f73c8e3b9f4a001fd0c1e2",
                         "processing_time": 0.132,
+                        "timings": {
+                            "decode": 0.021,
+                            "tokenize": 0.004,
+                            "count": 0.083,
+                            "persist": 0.015,
+                            "statistics": 0.009,
+                        },
+                        "statistics": [{"word": "слово", "tf": 0.0123, "idf": 1.6931}],
+                    }
+                },
+            },
+            202: {
+                "description": "Документ принят в фоновую обработку",
+                "examples": {
+                    "application/json": {
+                        "message": "Документ принят в обработку",
+                        "job_id": "60f73c8e3b9f4a001fd0c1e3",
+                        "status": "queued",
                     }
                 },
             },
@@ -51,14 +81,17 @@ api_collections_bp = Blueprint("api_collections", __name__)
             },
             401: {"description": "Пользователь не авторизован"},
             403: {"description": "Ошибка доступа"},
+            404: {"description": "Коллекция не найдена"},
         },
     }
 )
 def upload_document(collection_id):
     try:
-        collection = database.collections.find_one({"_id": ObjectId(collection_id)})
+        collection = repository.get_collection(collection_id)
     except:
         abort(400, description="Некорректный ID коллекции")
+    if not collection:
+        abort(404, description="Коллекция не найдена")
     if "file" not in request.files:
         return jsonify({"error": "Файл не найден"}), 400
     if collection["user_id"] != ObjectId(current_user.id):
@@ -71,28 +104,27 @@ def upload_document(collection_id):
     if not allowed_file(file.filename):
         return jsonify({"error": "Недопустимый тип файла"}), 400
 
-    start_time = time.time()
-
-    raw_data = file.read()
-    encoding = chardet.detect(raw_data)["encoding"]
-    if encoding is None:
-        encoding = "utf-8"
-    content = raw_data.decode(encoding)
-
-    doc = {
-        "user_id": current_user.id,
-        "collection_id": ObjectId(collection_id),
-        "filename": file.filename,
-        "content": content,
-        "uploaded_at": time.time(),
-    }
+    if request.args.get("async", "").lower() in ("1", "true"):
+        job_id = enqueue_upload(file, file.filename, collection_id, current_user.id)
+        response = jsonify(
+            {
+                "message": "Документ принят в обработку",
+                "job_id": job_id,
+                "status": "queued",
+            }
+        )
+        response.headers["Location"] = url_for("api_jobs.get_job", job_id=job_id)
+        return response, 202
 
-    inserted = database.documents.insert_one(doc)
-    database.collections.update_one(
-        {"_id": ObjectId(collection_id)},
-        {"$addToSet": {"doc_ids": inserted.inserted_id}},
-    )
-    database.recalculate_idf(collection_id)
+    start_time = time.time()
+    try:
+        result = ingest_document(
+            file.stream, file.filename, collection_id, current_user.id
+        )
+    except ArchiveError as e:
+        return jsonify({"error": str(e)}), 400
+    except CollectionNotFound:
+        abort(404, description="Коллекция не найдена")
     duration = time.time() - start_time
     metrics.register_file_processed(duration)
 
@@ -100,13 +132,143 @@ def upload_document(collection_id):
         jsonify(
             {
                 "message": "Документ успешно загружен",
-                "document_id": str(inserted.inserted_id),
+                "document_id": str(result["document_id"]),
+                "processing_time": round(duration, 3),
+                "timings": result["timings"],
+                "statistics": result["statistics"],
+            }
+        ),
+        201,
+    )
+
+@api_collections_bp.route(
+    "/api/collections/<collection_id>/upload/batch", methods=["POST"]
+)
+@login_required
+@swag_from(
+    {
+        "tags": ["Collections"],
+        "summary": "Загрузить несколько документов в коллекцию",
+        "description": "Файлы обрабатываются одновременно, документы записываются одним запросом, статистика коллекции обновляется один раз на весь пакет. Каждый текстовый файл архива .zip становится отдельным документом. Ошибка в одном файле не прерывает загрузку остальных.",
+        "parameters": [
+            {
+                "name": "collection_id",
+                "in": "path",
+                "type": "string",
+                "required": True,
+                "description": "ID коллекции, в которую загружаются документы",
+            },
+            {
+                "name": "files",
+                "in": "formData",
+                "type": "file",
+                "required": True,
+                "description": "Файлы для загрузки (поле можно повторять): текстовые, сжатые (.gz, .bz2, .xz) или архивы .zip",
+            },
+        ],
+        "consumes": ["multipart/form-data"],
+        "responses": {
+            201: {
+                "description": "Загружен хотя бы один документ",
+                "examples": {
+                    "application/json": {
+                        "message": "Загружено документов: 1 из 2",
+                        "processing_time": 0.214,
+                        "documents": [
+                            {
+                                "filename": "corpus/a.txt",
+                                "document_id": "60f73c8e3b9f4a001fd0c1e2",
+                                "timings": {"decode": 0.021, "count": 0.083},
+                                "statistics": [
+                                    {"word": "слово", "tf": 0.0123, "idf": 1.6931}
+                                ],
+                            },
+                            {
+                                "filename": "b.pdf",
+                                "error": "Недопустимый тип файла",
+                            },
+                        ],
+                    }
+                },
+            },
+            400: {
+                "description": "Ошибка валидации или ни один файл не загружен",
+                "examples": {"application/json": {"error": "Файлы не найдены"}},
+            },
+            401: {"description": "Пользователь не авторизован"},
+            403: {"description": "Ошибка доступа"},
+            404: {"description": "Коллекция не найдена"},
+        },
+    }
+)
+def upload_documents(collection_id):
+    try:
+        collection = repository.get_collection(collection_id)
+    except:
+        abort(400, description="Некорректный ID коллекции")
+    if not collection:
+        abort(404, description="Коллекция не найдена")
+    if collection["user_id"] != ObjectId(current_user.id):
+        abort(403, description="Нет доступа к этой коллекции")
+    files = [file for file in request.files.getlist("files") if file.filename]
+    if not files:
+        return jsonify({"error": "Файлы не найдены"}), 400
+
+    # Файлы с недопустимым расширением и поврежденные архивы получают ошибку
+    # сразу, остальные разбиваются на документы пакета
+    uploads, rejected = [], {}
+    for file in files:
+        if not allowed_file(file.filename):
+            rejected[len(uploads)] = {
+                "filename": file.filename,
+                "error": "Недопустимый тип файла",
+            }
+            uploads.append(None)
+            continue
+        try:
+            uploads.extend(split_upload(file.stream, file.filename))
+        except ArchiveError as e:
+            rejected[len(uploads)] = {"filename": file.filename, "error": str(e)}
+            uploads.append(None)
+    if len(uploads) > BATCH_MAX_FILES:
+        return jsonify({"error": f"В пакете больше {BATCH_MAX_FILES} файлов"}), 400
+
+    start_time = time.time()
+    try:
+        processed = iter(
+            ingest_batch(
+                [upload for upload in uploads if upload], collection_id, current_user.id
+            )
+        )
+    except CollectionNotFound:
+        abort(404, description="Коллекция не найдена")
+    duration = time.time() - start_time
+    results = [
+        rejected[index] if upload is None else next(processed)
+        for index, upload in enumerate(uploads)
+    ]
+
+    created = 0
+    for result in results:
+        if "document_id" in result:
+            result["document_id"] = str(result["document_id"])
+            # Время обработки файла в пакете - сумма его стадий подготовки
+            metrics.register_file_processed(sum(result["timings"].values()))
+            created += 1
+    if not created:
+        return jsonify({"error": "Ни один файл не загружен", "documents": results}), 400
+    return (
+        jsonify(
+            {
+                "message": f"Загружено документов: {created} из {len(results)}",
                 "processing_time": round(duration, 3),
+                "documents": results,
             }
         ),
         201,
     )
 
+
 @api_collections_bp.route("/api/collections", methods=["POST"])
 @login_required
 @swag_from({
@@ -151,57 +313,92 @@ def create_collection():
     if not name:
         return jsonify({"error": "Имя коллекции обязательно"}), 400
 
-    new_collection = {
-        "name": name,
-        "user_id": ObjectId(current_user.id),
-        "doc_ids": []
-    }
-    
-    result = database.collections.insert_one(new_collection)
-    database.users.update_one(
-                    {"_id": ObjectId(current_user.id)},
-                    {
-                        "$push": {"collection_ids": result.inserted_id}
-                    },
-                )
+    collection_id = repository.add_collection(current_user.id, name)
 
     return jsonify({
         "message": "Коллекция создана",
-        "collection_id": str(result.inserted_id)
+        "collection_id": str(collection_id)
     }), 201
 
 
+# Размеры страниц списка коллекций и документов в коллекции
+COLLECTIONS_DEFAULT_LIMIT = 20
+COLLECTIONS_MAX_LIMIT = 100
+DOCUMENTS_DEFAULT_LIMIT = 100
+DOCUMENTS_MAX_LIMIT = 1000
+
+DOCUMENT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "id": {"type": "string"},
+        "filename": {"type": "string"},
+    },
+}
+
+
+def _documents_list(documents: list) -> list:
+    return [{"id": str(doc["_id"]), "filename": doc["filename"]} for doc in documents]
+
+
 @api_collections_bp.route("/api/collections", methods=["GET"])
 @login_required
 @swag_from(
     {
         "tags": ["Collections"],
         "summary": "Получить список коллекций пользователя",
-        "description": "Возвращает список всех коллекций пользователя и документы в них.",
+        "description": "Возвращает коллекции пользователя и первые документы в них "
+        "постранично. Коллекции и документы упорядочены по ID. Чтобы получить "
+        "следующую страницу коллекций, передайте next в параметре after; "
+        "остальные документы коллекции - documents_next в параметре after "
+        "запроса /api/collections/<collection_id>.",
+        "parameters": [
+            {
+                "name": "after",
+                "in": "query",
+                "type": "string",
+                "description": "ID последней коллекции предыдущей страницы",
+            },
+            {
+                "name": "limit",
+                "in": "query",
+                "type": "integer",
+                "default": COLLECTIONS_DEFAULT_LIMIT,
+                "description": f"Количество коллекций на странице (не больше {COLLECTIONS_MAX_LIMIT})",
+            },
+            {
+                "name": "documents_limit",
+                "in": "query",
+                "type": "integer",
+                "default": DOCUMENTS_DEFAULT_LIMIT,
+                "description": f"Количество документов каждой коллекции (не больше {DOCUMENTS_MAX_LIMIT})",
+            },
+        ],
         "responses": {
             200: {
                 "description": "Список коллекций",
                 "schema": {
-                    "type": "array",
-                    "items": {
-                        "type": "object",
-                        "properties": {
-                            "id": {"type": "string"},
-                            "name": {"type": "string"},
-                            "documents": {
-                                "type": "array",
-                                "items": {
-                                    "type": "object",
-                                    "properties": {
-                                        "id": {"type": "string"},
-                                        "filename": {"type": "string"},
+                    "type": "object",
+                    "properties": {
+                        "collections": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "id": {"type": "string"},
+                                    "name": {"type": "string"},
+                                    "documents": {
+                                        "type": "array",
+                                        "items": DOCUMENT_SCHEMA,
                                     },
+                                    "documents_next": {"type": "string"},
                                 },
                             },
                         },
+                        "next": {"type": "string"},
                     },
                 },
             },
+            400: {"description": "Некорректные параметры запроса"},
             401: {
                 "description": "Ошибка доступа. Для данной команды необходима авторизация."
             },
@@ -209,27 +406,38 @@ def create_collection():
     }
 )
 def get_collections():
-    collections = list(
-        database.collections.find({"user_id": ObjectId(current_user.id)})
+    try:
+        after, limit = page_args(
+            request.args, COLLECTIONS_DEFAULT_LIMIT, COLLECTIONS_MAX_LIMIT
+        )
+        _, documents_limit = page_args(
+            request.args,
+            DOCUMENTS_DEFAULT_LIMIT,
+            DOCUMENTS_MAX_LIMIT,
+            prefix="documents_",
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Коллекции страницы и их документы - один запрос к базе
+    collections = repository.list_collections(
+        current_user.id, after, limit + 1, documents_limit + 1
     )
+    collections, next_cursor = split_page(collections, limit)
 
     result = []
     for col in collections:
-        doc_ids = col.get("doc_ids", [])
-        documents = database.documents.find({"_id": {"$in": doc_ids}})
-        document_list = [
-            {"id": str(doc["_id"]), "filename": doc["filename"]} for doc in documents
-        ]
-
+        documents, documents_next = split_page(col["documents"], documents_limit)
         result.append(
             {
                 "id": str(col["_id"]),
                 "name": col.get("name", ""),
-                "documents": document_list,
+                "documents": _documents_list(documents),
+                "documents_next": documents_next,
             }
         )
 
-    return jsonify(result)
+    return jsonify({"collections": result, "next": next_cursor})
 
 
 @api_collections_bp.route("/api/collections/<collection_id>", methods=["GET"])
@@ -237,21 +445,38 @@ def get_collections():
 @swag_from(
     {
         "tags": ["Collections"],
-        "summary": "Получить список ID документов в коллекции",
+        "summary": "Получить список документов в коллекции",
+        "description": "Возвращает документы коллекции постранично, упорядоченные по ID. "
+        "Чтобы получить следующую страницу, передайте next в параметре after.",
         "parameters": [
-            {"name": "collection_id", "in": "path", "required": True, "type": "string"}
+            {"name": "collection_id", "in": "path", "required": True, "type": "string"},
+            {
+                "name": "after",
+                "in": "query",
+                "type": "string",
+                "description": "ID последнего документа предыдущей страницы",
+            },
+            {
+                "name": "limit",
+                "in": "query",
+                "type": "integer",
+                "default": DOCUMENTS_DEFAULT_LIMIT,
+                "description": f"Количество документов на странице (не больше {DOCUMENTS_MAX_LIMIT})",
+            },
         ],
         "responses": {
             200: {
-                "description": "Список ID документов",
+                "description": "Список документов",
                 "schema": {
                     "type": "object",
                     "properties": {
-                        "document_ids": {"type": "array", "items": {"type": "string"}}
+                        "document_ids": {"type": "array", "items": {"type": "string"}},
+                        "documents": {"type": "array", "items": DOCUMENT_SCHEMA},
+                        "next": {"type": "string"},
                     },
                 },
             },
-            400: {"description": "Некорректный ID коллекции"},
+            400: {"description": "Некорректный ID коллекции или параметры запроса"},
             403: {"description": "Нет доступа"},
             401: {
                 "description": "Ошибка доступа. Для данной команды необходима авторизация."
@@ -262,7 +487,7 @@ def get_collections():
 )
 def get_collection_documents(collection_id):
     try:
-        collection = database.collections.find_one({"_id": ObjectId(collection_id)})
+        collection = repository.get_collection(collection_id)
     except:
         abort(400, description="Некорректный ID коллекции")
 
@@ -272,10 +497,30 @@ def get_collection_documents(collection_id):
     if collection["user_id"] != ObjectId(current_user.id):
         abort(403, description="Нет доступа к этой коллекции")
 
-    doc_ids = collection.get("doc_ids", [])
-    doc_id_strings = [str(doc_id) for doc_id in doc_ids]
+    try:
+        after, limit = page_args(
+            request.args, DOCUMENTS_DEFAULT_LIMIT, DOCUMENTS_MAX_LIMIT
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    documents, next_cursor = split_page(
+        repository.list_collection_documents(collection["_id"], after, limit + 1), limit
+    )
+
+    return jsonify(
+        {
+            "document_ids": [str(doc["_id"]) for doc in documents],
+            "documents": _documents_list(documents),
+            "next": next_cursor,
+        }
+    )
+
 
-    return jsonify({"document_ids": doc_id_strings})
+# Допустимые значения параметра sort и соответствующие поля статистики
+STATISTICS_SORT_FIELDS = {"idf": "idf", "tf": "tf", "tf-idf": "tf_idf"}
+STATISTICS_DEFAULT_LIMIT = 100
+STATISTICS_MAX_LIMIT = 1000
 
 
 @api_collections_bp.route(
@@ -286,9 +531,34 @@ def get_collection_documents(collection_id):
     {
         "tags": ["Collections"],
         "summary": "Получить статистику по коллекции",
-        "description": "Вычисляет и возвращает усреднённые TF и IDF значения по всем документам в коллекции.",
+        "description": "Возвращает TF, IDF и TF-IDF слов коллекции постранично. "
+        "TF - доля слова среди всех слов коллекции. "
+        "Статистика хранится в базе и обновляется при изменении коллекции, "
+        "страница по tf и idf читается по индексу.",
         "parameters": [
-            {"name": "collection_id", "in": "path", "required": True, "type": "string"}
+            {"name": "collection_id", "in": "path", "required": True, "type": "string"},
+            {
+                "name": "sort",
+                "in": "query",
+                "type": "string",
+                "enum": ["idf", "tf", "tf-idf"],
+                "default": "idf",
+                "description": "Поле, по убыванию которого сортируются слова",
+            },
+            {
+                "name": "limit",
+                "in": "query",
+                "type": "integer",
+                "default": STATISTICS_DEFAULT_LIMIT,
+                "description": f"Количество слов на странице (не больше {STATISTICS_MAX_LIMIT})",
+            },
+            {
+                "name": "offset",
+                "in": "query",
+                "type": "integer",
+                "default": 0,
+                "description": "Сколько слов пропустить",
+            },
         ],
         "responses": {
             200: {
@@ -304,13 +574,18 @@ def get_collection_documents(collection_id):
                                     "word": {"type": "string"},
                                     "tf": {"type": "number"},
                                     "idf": {"type": "number"},
+                                    "tf_idf": {"type": "number"},
                                 },
                             },
-                        }
+                        },
+                        "total": {"type": "integer"},
+                        "sort": {"type": "string"},
+                        "limit": {"type": "integer"},
+                        "offset": {"type": "integer"},
                     },
                 },
             },
-            400: {"description": "Некорректный ID коллекции"},
+            400: {"description": "Некорректный ID коллекции или параметры запроса"},
             403: {"description": "Нет доступа"},
             401: {
                 "description": "Ошибка доступа. Для данной команды необходима авторизация."
@@ -321,7 +596,7 @@ def get_collection_documents(collection_id):
 )
 def get_collection_statistics(collection_id):
     try:
-        collection = database.collections.find_one({"_id": ObjectId(collection_id)})
+        collection = repository.get_collection(collection_id)
     except:
         abort(400, description="Некорректный ID коллекции")
 
@@ -331,46 +606,120 @@ def get_collection_statistics(collection_id):
     if collection["user_id"] != ObjectId(current_user.id):
         abort(403, description="Нет доступа к этой коллекции")
 
-    doc_ids = collection.get("doc_ids", [])
-    if not doc_ids:
-        return jsonify({"statistics": []})
+    sort = request.args.get("sort", "idf")
+    if sort not in STATISTICS_SORT_FIELDS:
+        return jsonify({"error": "Параметр sort может быть idf, tf или tf-idf"}), 400
+    try:
+        limit = int(request.args.get("limit", STATISTICS_DEFAULT_LIMIT))
+        offset = int(request.args.get("offset", 0))
+    except ValueError:
+        return jsonify({"error": "limit и offset должны быть целыми числами"}), 400
+    if not 0 < limit <= STATISTICS_MAX_LIMIT or offset < 0:
+        return (
+            jsonify(
+                {
+                    "error": f"limit должен быть от 1 до {STATISTICS_MAX_LIMIT}, "
+                    "offset - неотрицательным"
+                }
+            ),
+            400,
+        )
 
-    # Суммарный список слов
-    total_word_count = 0
-    tf_accumulator = defaultdict(int)
-    idf_map = {}
+    rows, total = repository.get_term_stats(
+        repository.get_collection_stats(collection["_id"]),
+        STATISTICS_SORT_FIELDS[sort],
+        offset,
+        limit,
+    )
 
-    documents = list(database.documents.find({"_id": {"$in": doc_ids}}))
+    # Переводим ID слов страницы обратно в слова
+    words = repository.term_words(collection["_id"], [row["term_id"] for row in rows])
+    result = [
+        {
+            "word": words[row["term_id"]],
+            "tf": round(row["tf"], 4),
+            "idf": round(row["idf"], 4),
+            "tf_idf": round(row["tf_idf"], 4),
+        }
+        for row in rows
+    ]
 
-    for doc in documents:
-        words = doc.get("words", [])
-        total_word_count += doc.get("words_num", 0)
+    return jsonify(
+        {
+            "statistics": result,
+            "total": total,
+            "sort": sort,
+            "limit": limit,
+            "offset": offset,
+        }
+    )
 
-        for word_entry in words:
-            word = word_entry["word"]
-            freq = (
-                word_entry["tf"] * doc["words_num"]
-            )  # Преобразуем tf обратно в абсолютную частоту
-            tf_accumulator[word] += freq
 
-            # Берем IDF из документа (предполагаем, что одинаково у всех)
-            if word not in idf_map:
-                idf_map[word] = word_entry.get("idf", 0)
+@api_collections_bp.route(
+    "/api/collections/<collection_id>/codebook", methods=["POST"]
+)
+@login_required
+@swag_from(
+    {
+        "tags": ["Collections"],
+        "summary": "Обучить общий код Хаффмана коллекции",
+        "description": "Строит словный код Хаффмана по суммарным частотам слов "
+        "коллекции (разделители считаются по первым документам) и сохраняет его "
+        "новой версией. Документы коллекции кодируются им через "
+        "GET /api/documents/<document_id>/huffman?codebook=latest, "
+        "таблица версии - GET /api/codebooks/<codebook_id>.",
+        "parameters": [
+            {"name": "collection_id", "in": "path", "required": True, "type": "string"}
+        ],
+        "responses": {
+            201: {
+                "description": "Сохраненная версия кода",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "codebook_id": {"type": "string"},
+                        "version": {"type": "integer"},
+                        "symbols_count": {"type": "integer"},
+                        "docs_count": {"type": "integer"},
+                    },
+                },
+            },
+            400: {"description": "Некорректный ID коллекции или коллекция пуста"},
+            403: {"description": "Нет доступа"},
+            401: {
+                "description": "Ошибка доступа. Для данной команды необходима авторизация."
+            },
+            404: {"description": "Коллекция не найдена"},
+        },
+    }
+)
+def train_collection_codebook(collection_id):
+    try:
+        collection = repository.get_collection(collection_id)
+    except:
+        abort(400, description="Некорректный ID коллекции")
 
-    if total_word_count == 0:
-        return jsonify({"statistics": []})
+    if not collection:
+        abort(404, description="Коллекция не найдена")
 
-    # Формируем итог
-    result = []
-    for word, freq in tf_accumulator.items():
-        tf = freq / total_word_count
-        idf = idf_map.get(word, 0)
-        result.append({"word": word, "tf": round(tf, 4), "idf": round(idf, 4)})
+    if collection["user_id"] != ObjectId(current_user.id):
+        abort(403, description="Нет доступа к этой коллекции")
 
-    # Сортировка по IDF убыванию
-    result.sort(key=lambda x: x["idf"], reverse=True)
+    codebook = train_codebook(repository, collection["_id"], current_user.id)
+    if codebook is None:
+        return jsonify({"error": "В коллекции нет документов"}), 400
 
-    return jsonify({"statistics": result})
+    return (
+        jsonify(
+            {
+                "codebook_id": str(codebook["_id"]),
+                "version": codebook["version"],
+                "symbols_count": len(codebook["symbols"]),
+                "docs_count": codebook["docs_count"],
+            }
+        ),
+        201,
+    )
 
 
 @api_collections_bp.route(
@@ -398,8 +747,8 @@ def get_collection_statistics(collection_id):
 )
 def add_document_to_collection(collection_id, document_id):
     try:
-        collection = database.collections.find_one({"_id": ObjectId(collection_id)})
-        document = database.documents.find_one({"_id": ObjectId(document_id)})
+        collection = repository.get_collection(collection_id)
+        document = repository.find_document(document_id, DOC_MEMBERSHIP_PROJECTION)
     except:
         abort(400, description="Некорректный ID")
 
@@ -411,17 +760,8 @@ def add_document_to_collection(collection_id, document_id):
     ] != ObjectId(current_user.id):
         abort(403, description="Нет доступа")
 
-    # Обновляем документ
-    database.documents.update_one(
-        {"_id": ObjectId(document_id)},
-        {"$set": {"collection_id": ObjectId(collection_id)}},
-    )
-
-    # Добавляем ID документа в коллекцию
-    database.collections.update_one(
-        {"_id": ObjectId(collection_id)},
-        {"$addToSet": {"doc_ids": ObjectId(document_id)}},
-    )
+    # Документ уходит из прежней коллекции и учитывается в частотах новой
+    repository.add_to_collection(document, collection_id)
 
     return jsonify({"message": "Документ добавлен в коллекцию"})
 
@@ -445,14 +785,16 @@ def add_document_to_collection(collection_id, document_id):
             401: {
                 "description": "Ошибка доступа. Для данной команды необходима авторизация."
             },
-            404: {"description": "Коллекция или документ не найдены"},
+            404: {
+                "description": "Коллекция или документ не найдены, либо документ не состоит в коллекции"
+            },
         },
     }
 )
 def remove_document_from_collection(collection_id, document_id):
     try:
-        collection = database.collections.find_one({"_id": ObjectId(collection_id)})
-        document = database.documents.find_one({"_id": ObjectId(document_id)})
+        collection = repository.get_collection(collection_id)
+        document = repository.find_document(document_id, DOC_MEMBERSHIP_PROJECTION)
     except:
         abort(400, description="Некорректный ID")
 
@@ -464,14 +806,10 @@ def remove_document_from_collection(collection_id, document_id):
     ] != ObjectId(current_user.id):
         abort(403, description="Нет доступа")
 
-    # Удаляем ссылку на коллекцию из документа
-    database.documents.update_one(
-        {"_id": ObjectId(document_id)}, {"$unset": {"collection_id": ""}}
-    )
+    if document.get("collection_id") != ObjectId(collection_id):
+        abort(404, description="Документ не состоит в этой коллекции")
 
-    # Удаляем ID документа из коллекции
-    database.collections.update_one(
-        {"_id": ObjectId(collection_id)}, {"$pull": {"doc_ids": ObjectId(document_id)}}
-    )
+    # Удаляем ID документа из коллекции и вычитаем его слова из частот
+    repository.remove_from_collection(document, collection_id)
 
     return jsonify({"message": "Документ удалён из коллекции"})
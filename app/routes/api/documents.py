@@ -1,19 +1,47 @@
-from flask import Blueprint, jsonify, abort
+import json
+from flask import Blueprint, Response, jsonify, abort, request, stream_with_context
 from flasgger import swag_from
-from bson import ObjectId
-from app.data import database
+from app.repository import (
+    repository,
+    DOC_CONTENT_PROJECTION,
+    DOC_TERMS_PROJECTION,
+)
+from app.utils import page_args
+from collections import Counter
 from flask_login import login_required, current_user
 
 api_documents_bp = Blueprint("api_documents", __name__)
 
 
+# Размер страницы списка документов пользователя
+DOCUMENTS_DEFAULT_LIMIT = 1000
+DOCUMENTS_MAX_LIMIT = 10000
+
+
 @api_documents_bp.route("/api/documents/", methods=["GET"])
 @login_required
 @swag_from(
     {
         "tags": ["Documents"],
         "summary": "Получить список документов пользователя",
-        "description": "Возвращает список всех загруженных пользователем документов.",
+        "description": "Возвращает документы пользователя постранично, упорядоченные по ID. "
+        "Чтобы получить следующую страницу, передайте ID последнего документа "
+        "в параметре after; страница короче limit - последняя.",
+        "parameters": [
+            {
+                "name": "after",
+                "in": "query",
+                "type": "string",
+                "description": "ID последнего документа предыдущей страницы",
+            },
+            {
+                "name": "limit",
+                "in": "query",
+                "type": "integer",
+                "default": DOCUMENTS_DEFAULT_LIMIT,
+                "description": f"Количество документов на странице (не больше {DOCUMENTS_MAX_LIMIT})",
+            },
+        ],
         "responses": {
             200: {
                 "description": "Список документов",
@@ -28,7 +56,7 @@ api_documents_bp = Blueprint("api_documents", __name__)
                     },
                 },
             },
-            404: {"description": "Документ не найден или доступ запрещён"},
+            400: {"description": "Некорректные параметры запроса"},
             401: {
                 "description": "Ошибка доступа. Для данной команды необходима авторизация."
             },
@@ -36,9 +64,24 @@ api_documents_bp = Blueprint("api_documents", __name__)
     }
 )
 def get_user_documents():
-    documents = database.documents.find({"user_id": ObjectId(current_user.id)})
-    result = [{"id": str(doc["_id"]), "title": doc["filename"]} for doc in documents]
-    return jsonify(result)
+    try:
+        after, limit = page_args(
+            request.args, DOCUMENTS_DEFAULT_LIMIT, DOCUMENTS_MAX_LIMIT
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    documents = repository.list_documents(current_user.id, after, limit)
+
+    # Массив отдается по мере чтения курсора, документы не собираются в памяти
+    def generate():
+        yield "["
+        for i, doc in enumerate(documents):
+            item = json.dumps({"id": str(doc["_id"]), "title": doc["filename"]})
+            yield item if i == 0 else "," + item
+        yield "]"
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
 
 
 @api_documents_bp.route("/api/documents/<document_id>", methods=["GET"])
@@ -79,19 +122,121 @@ def get_user_documents():
 )
 def get_document_content(document_id):
     try:
-        doc = database.documents.find_one(
-            {"_id": ObjectId(document_id), "user_id": ObjectId(current_user.id)}
+        doc = repository.get_document(
+            document_id, current_user.id, DOC_CONTENT_PROJECTION
         )
         if not doc:
             abort(404, description="Документ не найден или доступ запрещён")
 
         return jsonify(
-            {"id": str(doc["_id"]), "title": doc["filename"], "content": doc["content"]}
+            {
+                "id": str(doc["_id"]),
+                "title": doc["filename"],
+                "content": repository.read_content(doc),
+            }
         )
     except Exception:
         abort(400, description="Некорректный ID документа")
 
 
+# Отдает куски chunks, попадающие в диапазон байтов [start, stop)
+def _byte_range(chunks, start: int, stop: int):
+    position = 0
+    for chunk in chunks:
+        end = position + len(chunk)
+        if end > start:
+            yield chunk[max(start - position, 0) : stop - position]
+        position = end
+        if position >= stop:
+            return
+
+
+@api_documents_bp.route("/api/documents/<document_id>/content", methods=["GET"])
+@login_required
+@swag_from(
+    {
+        "tags": ["Documents"],
+        "summary": "Получить исходный текст документа",
+        "description": "Отдает текст документа потоком (text/plain, UTF-8). "
+        "Поддерживаются запросы части текста (заголовок Range, один диапазон байтов) "
+        "и проверка актуальности по ETag (If-None-Match, If-Range).",
+        "parameters": [
+            {
+                "name": "document_id",
+                "in": "path",
+                "required": True,
+                "type": "string",
+                "description": "ID документа",
+            },
+            {
+                "name": "Range",
+                "in": "header",
+                "type": "string",
+                "required": False,
+                "description": "Диапазон байтов, например bytes=0-1023",
+            },
+        ],
+        "produces": ["text/plain"],
+        "responses": {
+            200: {"description": "Текст документа"},
+            206: {"description": "Запрошенная часть текста"},
+            304: {"description": "Текст не изменился (совпал If-None-Match)"},
+            400: {"description": "Некорректный ID документа"},
+            404: {"description": "Документ не найден или доступ запрещён"},
+            416: {"description": "Диапазон за пределами текста"},
+            401: {
+                "description": "Ошибка доступа. Для данной команды необходима авторизация."
+            },
+        },
+    }
+)
+def get_document_raw_content(document_id):
+    try:
+        doc = repository.get_document(
+            document_id, current_user.id, DOC_CONTENT_PROJECTION
+        )
+    except Exception:
+        abort(400, description="Некорректный ID документа")
+    if not doc:
+        abort(404, description="Документ не найден или доступ запрещён")
+
+    chunks, size, etag = repository.open_content(doc)
+    headers = {"Accept-Ranges": "bytes", "Cache-Control": "private, no-cache"}
+
+    if request.if_none_match.contains(etag):
+        response = Response(status=304, headers=headers)
+        response.set_etag(etag)
+        return response
+
+    # Диапазон учитывается, только если If-Range отсутствует или совпадает с ETag;
+    # несколько диапазонов в одном запросе не поддерживаются - отдается весь текст
+    byte_range = request.range
+    if_range = request.if_range
+    if byte_range and (if_range.date or if_range.etag not in (None, etag)):
+        byte_range = None
+    if byte_range and len(byte_range.ranges) == 1:
+        bounds = byte_range.range_for_length(size)
+        if bounds is None:
+            headers["Content-Range"] = f"bytes */{size}"
+            return Response(status=416, headers=headers)
+        start, stop = bounds
+        chunks = _byte_range(chunks, start, stop)
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{size}"
+        status, length = 206, stop - start
+    else:
+        status, length = 200, size
+
+    headers["Content-Length"] = str(length)
+    response = Response(
+        chunks,
+        status=status,
+        headers=headers,
+        mimetype="text/plain",
+    )
+    response.set_etag(etag)
+    return response
+
+
 @api_documents_bp.route("/api/documents/<document_id>/statistics", methods=["GET"])
 @login_required
 @swag_from(
@@ -141,13 +286,34 @@ def get_document_content(document_id):
 )
 def get_document_statistics(document_id):
     try:
-        doc = database.documents.find_one(
-            {"_id": ObjectId(document_id), "user_id": ObjectId(current_user.id)}
+        doc = repository.get_document(
+            document_id, current_user.id, DOC_TERMS_PROJECTION
         )
         if not doc:
             abort(404, description="Документ не найден или доступ запрещён")
-        words = doc.get("words", [])
-        sorted_words = sorted(words, key=lambda x: x.get("idf", 0), reverse=True)
+        # Топ-50 слов документа по количеству из полного вектора частот
+        top_words = Counter(repository.document_counts(doc)).most_common(50)
+        words_num = doc.get("words_num", 0)
+        # IDF вычисляется по документным частотам коллекции, в которой состоит документ
+        idf_map, term_ids = {}, {}
+        if doc.get("collection_id"):
+            stats = repository.get_collection_stats(doc["collection_id"])
+            idf_map = repository.get_idf_map(stats)
+            term_ids = repository.term_ids(
+                doc["collection_id"], [word for word, _ in top_words]
+            )
+        sorted_words = sorted(
+            (
+                {
+                    "word": word,
+                    "tf": freq / words_num,
+                    "idf": idf_map.get(term_ids.get(word), 0),
+                }
+                for word, freq in top_words
+            ),
+            key=lambda x: x["idf"],
+            reverse=True,
+        )
         return jsonify(
             {
                 "id": str(doc["_id"]),
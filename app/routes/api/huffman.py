@@ -1,9 +1,29 @@
-from flask import Blueprint, jsonify, abort
+import base64
+import json
+from flask import Blueprint, jsonify, abort, request
 from flasgger import swag_from
 from collections import Counter
-from bson import ObjectId
 import heapq
-from app.data import database
+from bson import ObjectId
+from bson.errors import InvalidId
+from app.repository import (
+    repository,
+    CODEBOOK_INFO_PROJECTION,
+    DOC_CONTENT_PROJECTION,
+)
+from app.termvec import TERMS_PROJECTION
+from app.codebooks import encode_with_codebook, load_codebook
+from app.huffman import (
+    TokenEncoder,
+    canonical_codes,
+    code_lengths,
+    decode_bits,
+    encode_text,
+    join_word_tokens,
+    symbol_frequencies,
+    validate_table,
+    word_tokens,
+)
 from flask_login import login_required, current_user
 
 api_huffman_bp = Blueprint("huffman", __name__)
@@ -35,14 +55,20 @@ def build_huffman_tree(freq_map):
     return heap[0] if heap else None
 
 
+# Обход дерева со своим стеком: на вырожденных алфавитах глубина дерева
+# может превышать предел рекурсии Python
 def generate_codes(node, prefix="", code_map=None):
     if code_map is None:
         code_map = {}
-    if node is not None:
+    stack = [(node, prefix)]
+    while stack:
+        node, prefix = stack.pop()
+        if node is None:
+            continue
         if node.char is not None:
             code_map[node.char] = prefix
-        generate_codes(node.left, prefix + "0", code_map)
-        generate_codes(node.right, prefix + "1", code_map)
+        stack.append((node.right, prefix + "1"))
+        stack.append((node.left, prefix + "0"))
     return code_map
 
 
@@ -58,13 +84,124 @@ def huffman_encode(text):
     return encoded, code_map
 
 
+# Двоичный формат: канонические коды символов, биты упакованы в байты (base64).
+# Таблица кодов передается упорядоченной строкой символов и количеством кодов
+# каждой длины, этого достаточно, чтобы восстановить коды при декодировании.
+def huffman_encode_binary(text):
+    lengths = code_lengths(symbol_frequencies(text))
+    symbols, counts, codes = canonical_codes(lengths)
+    data, bits = encode_text(text, codes)
+    encoded = base64.b64encode(data).decode("ascii")
+    return {
+        "format": "binary",
+        "symbols": "".join(symbols),
+        "counts": counts,
+        "bits": bits,
+        "data": encoded,
+        **_sizes(
+            len(text.encode("utf-8")),
+            len(encoded),
+            _table_size("".join(symbols), counts),
+        ),
+    }
+
+
+# Размер сжатого результата включает таблицу кода (table_size), без которой
+# данные не декодируются
+def _sizes(original_size, compressed_size, table_size=0):
+    compressed_size += table_size
+    return {
+        "original_size": original_size,
+        "table_size": table_size,
+        "compressed_size": compressed_size,
+        "compression_ratio": (
+            round(original_size / compressed_size, 3) if compressed_size else None
+        ),
+    }
+
+
+# Размер таблицы кода в ответе: символы и количества кодов каждой длины
+# в компактном JSON, в UTF-8
+def _table_size(symbols, counts) -> int:
+    table = json.dumps([symbols, counts], ensure_ascii=False, separators=(",", ":"))
+    return len(table.encode("utf-8"))
+
+
+# Словный режим: код строится по количествам слов, сохраненным при загрузке
+# документа, символы кода - слова, разделители и ESCAPE (пустая строка) для слов
+# не из словаря документа; такие слова передаются по порядку в literals.
+# Размер сжатого результата - данные в base64, literals в UTF-8 и таблица кода
+# (весь словарь документа).
+def huffman_encode_words(text, word_counts):
+    tokens, literals, extra = word_tokens(text, word_counts)
+    symbols, counts, codes = canonical_codes(code_lengths({**word_counts, **extra}))
+    data, bits = TokenEncoder(symbols, codes).encode(tokens)
+    encoded = base64.b64encode(data).decode("ascii")
+    literals_size = sum(len(literal.encode("utf-8")) for literal in literals)
+    return {
+        "format": "binary",
+        "mode": "word",
+        "symbols": symbols,
+        "counts": counts,
+        "bits": bits,
+        "data": encoded,
+        "literals": literals,
+        **_sizes(
+            len(text.encode("utf-8")),
+            len(encoded) + literals_size,
+            _table_size(symbols, counts),
+        ),
+    }
+
+
+# Кодирование общим кодом коллекции: в ответе только биты, literals и версия кода,
+# таблица кода запрашивается отдельно (GET /api/codebooks/<codebook_id>) и одна
+# на всю коллекцию, поэтому в compressed_size не входит
+def huffman_encode_shared(text, codebook_id):
+    codebook, encoder = load_codebook(repository, codebook_id)
+    data, bits, literals = encode_with_codebook(encoder, text)
+    encoded = base64.b64encode(data).decode("ascii")
+    literals_size = sum(len(literal.encode("utf-8")) for literal in literals)
+    return {
+        "format": "binary",
+        "mode": "word",
+        "codebook_id": str(codebook["_id"]),
+        "codebook_version": codebook["version"],
+        "bits": bits,
+        "data": encoded,
+        "literals": literals,
+        **_sizes(len(text.encode("utf-8")), len(encoded) + literals_size),
+    }
+
+
+# Версия общего кода (без таблицы), если она принадлежит коллекции текущего пользователя
+def _owned_codebook(codebook_id):
+    codebook = repository.get_codebook(codebook_id, CODEBOOK_INFO_PROJECTION)
+    if not codebook:
+        return None
+    collection = repository.get_collection(codebook["collection_id"])
+    if not collection or collection["user_id"] != ObjectId(current_user.id):
+        return None
+    return codebook
+
+
 @api_huffman_bp.route("/api/documents/<document_id>/huffman", methods=["GET"])
 @login_required
 @swag_from(
     {
         "tags": ["Huffman"],
         "summary": "Получить Хаффман-кодирование документа",
-        "description": "Кодирует содержимое документа с помощью алгоритма Хаффмана.",
+        "description": "Кодирует содержимое документа с помощью алгоритма Хаффмана. "
+        "format=text - строка из символов 0 и 1 и таблица кодов; "
+        "format=binary - канонические коды, биты упакованы в байты и закодированы base64, "
+        "таблица - символы, упорядоченные по длине кода, и количество кодов каждой длины. "
+        "mode=word - код по словам документа (частоты берутся из сохраненной статистики), "
+        'разделителям и символу "" для слов не из словаря, которые передаются в literals; '
+        "результат всегда в format=binary. "
+        "codebook=latest или ID версии - кодирование общим кодом коллекции "
+        "(POST /api/collections/<collection_id>/codebook), в ответе вместо таблицы "
+        "codebook_id. "
+        "Результат format=binary восстанавливается через POST /api/huffman/decode.",
         "parameters": [
             {
                 "name": "document_id",
@@ -72,7 +209,30 @@ def huffman_encode(text):
                 "required": True,
                 "type": "string",
                 "description": "ID документа",
-            }
+            },
+            {
+                "name": "format",
+                "in": "query",
+                "type": "string",
+                "enum": ["text", "binary"],
+                "default": "text",
+                "description": "Формат результата",
+            },
+            {
+                "name": "mode",
+                "in": "query",
+                "type": "string",
+                "enum": ["char", "word"],
+                "default": "char",
+                "description": "Символы кода: отдельные символы текста или слова",
+            },
+            {
+                "name": "codebook",
+                "in": "query",
+                "type": "string",
+                "description": "latest - последняя версия общего кода коллекции "
+                "документа, иначе ID версии кода",
+            },
         ],
         "responses": {
             200: {
@@ -85,6 +245,26 @@ def huffman_encode(text):
                             "type": "object",
                             "additionalProperties": {"type": "string"},
                         },
+                        "format": {"type": "string"},
+                        "mode": {"type": "string"},
+                        "symbols": {
+                            "description": "Строка символов (mode=char) "
+                            "или массив строк (mode=word)"
+                        },
+                        "counts": {"type": "array", "items": {"type": "integer"}},
+                        "bits": {"type": "integer"},
+                        "data": {"type": "string"},
+                        "literals": {"type": "array", "items": {"type": "string"}},
+                        "codebook_id": {"type": "string"},
+                        "codebook_version": {"type": "integer"},
+                        "original_size": {"type": "integer"},
+                        "table_size": {
+                            "type": "integer",
+                            "description": "Размер таблицы кода в байтах "
+                            "(входит в compressed_size)",
+                        },
+                        "compressed_size": {"type": "integer"},
+                        "compression_ratio": {"type": "number"},
                     },
                 },
             },
@@ -97,17 +277,183 @@ def huffman_encode(text):
     }
 )
 def document_huffman(document_id):
-    try:
-        doc = database.documents.find_one(
-            {"_id": ObjectId(document_id), "user_id": ObjectId(current_user.id)}
+    codebook_id = request.args.get("codebook")
+    mode = request.args.get("mode", "word" if codebook_id else "char")
+    if mode not in ("char", "word"):
+        return jsonify({"error": "Параметр mode может быть char или word"}), 400
+    if codebook_id and mode != "word":
+        return jsonify({"error": "Общий код коллекции - только mode=word"}), 400
+    output_format = request.args.get("format", "binary" if mode == "word" else "text")
+    if output_format not in ("text", "binary"):
+        return jsonify({"error": "Параметр format может быть text или binary"}), 400
+    if mode == "word" and output_format != "binary":
+        return (
+            jsonify({"error": "mode=word поддерживается только для format=binary"}),
+            400,
         )
+    try:
+        projection = DOC_CONTENT_PROJECTION
+        if codebook_id:
+            projection = {**DOC_CONTENT_PROJECTION, "collection_id": 1}
+        elif mode == "word":
+            projection = {**DOC_CONTENT_PROJECTION, **TERMS_PROJECTION}
+        doc = repository.get_document(document_id, current_user.id, projection)
 
         if not doc:
             abort(404, description="Документ не найден или доступ запрещён")
 
-        content = doc.get("content", "")
+        if codebook_id == "latest":
+            codebook = repository.latest_codebook(doc["collection_id"])
+        elif codebook_id:
+            codebook = _owned_codebook(codebook_id)
+        if codebook_id and not codebook:
+            return jsonify({"error": "Общий код не найден"}), 404
+
+        content = repository.read_content(doc)
+        if codebook_id:
+            return jsonify(huffman_encode_shared(content, codebook["_id"]))
+        if mode == "word":
+            return jsonify(
+                huffman_encode_words(content, repository.document_counts(doc))
+            )
+        if output_format == "binary":
+            return jsonify(huffman_encode_binary(content))
+
         encoded, code_map = huffman_encode(content)
 
         return jsonify({"encoded": encoded, "code_map": code_map})
     except Exception as e:
         abort(400, description="Некорректный ID или ошибка обработки")
+
+
+@api_huffman_bp.route("/api/huffman/decode", methods=["POST"])
+@login_required
+@swag_from(
+    {
+        "tags": ["Huffman"],
+        "summary": "Декодировать результат Хаффман-кодирования",
+        "description": "Восстанавливает текст из результата "
+        "GET /api/documents/<document_id>/huffman?format=binary "
+        "(в том числе mode=word - тогда нужны mode и literals; для общего кода "
+        "коллекции вместо symbols и counts передается codebook_id).",
+        "consumes": ["application/json"],
+        "parameters": [
+            {
+                "name": "body",
+                "in": "body",
+                "required": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "mode": {"type": "string", "enum": ["char", "word"]},
+                        "symbols": {
+                            "description": "Строка символов (mode=char) "
+                            "или массив строк (mode=word)"
+                        },
+                        "counts": {"type": "array", "items": {"type": "integer"}},
+                        "bits": {"type": "integer"},
+                        "data": {"type": "string"},
+                        "literals": {"type": "array", "items": {"type": "string"}},
+                        "codebook_id": {"type": "string"},
+                    },
+                    "required": ["symbols", "counts", "bits", "data"],
+                },
+            }
+        ],
+        "responses": {
+            200: {
+                "description": "Восстановленный текст",
+                "schema": {
+                    "type": "object",
+                    "properties": {"text": {"type": "string"}},
+                },
+            },
+            400: {"description": "Некорректные данные"},
+            404: {"description": "Общий код не найден"},
+            401: {
+                "description": "Ошибка доступа. Для данной команды необходима авторизация."
+            },
+        },
+    }
+)
+def huffman_decode():
+    payload = request.get_json(silent=True) or {}
+    try:
+        word_mode = payload.get("mode", "char") == "word"
+        if payload.get("codebook_id"):
+            if not _owned_codebook(payload["codebook_id"]):
+                return jsonify({"error": "Общий код не найден"}), 404
+            codebook, _ = load_codebook(repository, payload["codebook_id"])
+            payload = {**payload, **codebook}
+            word_mode = True
+        symbols = list(payload["symbols"])
+        counts = [int(count) for count in payload["counts"]]
+        bits = int(payload["bits"])
+        data = base64.b64decode(payload["data"], validate=True)
+        if not validate_table(symbols, counts):
+            raise ValueError("Некорректная таблица кодов")
+        tokens = decode_bits(data, bits, symbols, counts)
+        if word_mode:
+            text = join_word_tokens(tokens, payload.get("literals", []))
+        else:
+            text = "".join(tokens)
+    except (KeyError, TypeError, ValueError, InvalidId):
+        return jsonify({"error": "Некорректные данные для декодирования"}), 400
+    return jsonify({"text": text})
+
+
+@api_huffman_bp.route("/api/codebooks/<codebook_id>", methods=["GET"])
+@login_required
+@swag_from(
+    {
+        "tags": ["Huffman"],
+        "summary": "Получить таблицу общего кода коллекции",
+        "description": "Таблица версии общего кода: символы, упорядоченные по длине "
+        'кода (слова, разделители и "" для слов не из кода), и количество кодов '
+        "каждой длины. Версия кода не меняется, таблицу можно кэшировать.",
+        "parameters": [
+            {"name": "codebook_id", "in": "path", "required": True, "type": "string"}
+        ],
+        "responses": {
+            200: {
+                "description": "Таблица кода",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "codebook_id": {"type": "string"},
+                        "collection_id": {"type": "string"},
+                        "version": {"type": "integer"},
+                        "symbols": {"type": "array", "items": {"type": "string"}},
+                        "counts": {"type": "array", "items": {"type": "integer"}},
+                        "docs_count": {"type": "integer"},
+                        "created_at": {"type": "number"},
+                    },
+                },
+            },
+            400: {"description": "Некорректный ID"},
+            404: {"description": "Общий код не найден"},
+            401: {
+                "description": "Ошибка доступа. Для данной команды необходима авторизация."
+            },
+        },
+    }
+)
+def get_codebook(codebook_id):
+    try:
+        if not _owned_codebook(codebook_id):
+            abort(404, description="Общий код не найден")
+    except (InvalidId, TypeError):
+        abort(400, description="Некорректный ID")
+
+    codebook, _ = load_codebook(repository, codebook_id)
+    return jsonify(
+        {
+            "codebook_id": str(codebook["_id"]),
+            "collection_id": str(codebook["collection_id"]),
+            "version": codebook["version"],
+            "symbols": codebook["symbols"],
+            "counts": codebook["counts"],
+            "docs_count": codebook["docs_count"],
+            "created_at": codebook["created_at"],
+        }
+    )
@@ -0,0 +1,89 @@
+from flask import Blueprint, jsonify, abort
+from flasgger import swag_from
+from bson import ObjectId
+from app.data import database
+from flask_login import login_required, current_user
+
+api_jobs_bp = Blueprint("api_jobs", __name__)
+
+
+@api_jobs_bp.route("/api/jobs/<job_id>", methods=["GET"])
+@login_required
+@swag_from(
+    {
+        "tags": ["Jobs"],
+        "summary": "Получить статус фоновой обработки документа",
+        "description": "Возвращает статус задачи (queued, running, done, failed). "
+        "Для завершенной задачи возвращается ID документа и статистика его слов.",
+        "parameters": [
+            {
+                "name": "job_id",
+                "in": "path",
+                "required": True,
+                "type": "string",
+                "description": "ID задачи",
+            }
+        ],
+        "responses": {
+            200: {
+                "description": "Статус задачи",
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "id": {"type": "string"},
+                        "status": {"type": "string"},
+                        "filename": {"type": "string"},
+                        "collection_id": {"type": "string"},
+                        "result": {
+                            "type": "object",
+                            "properties": {
+                                "document_id": {"type": "string"},
+                                "processing_time": {"type": "number"},
+                                "statistics": {
+                                    "type": "array",
+                                    "items": {
+                                        "type": "object",
+                                        "properties": {
+                                            "word": {"type": "string"},
+                                            "tf": {"type": "number"},
+                                            "idf": {"type": "number"},
+                                        },
+                                    },
+                                },
+                            },
+                        },
+                        "error": {"type": "string"},
+                    },
+                },
+            },
+            400: {"description": "Некорректный ID задачи"},
+            404: {"description": "Задача не найдена или доступ запрещён"},
+            401: {
+                "description": "Ошибка доступа. Для данной команды необходима авторизация."
+            },
+        },
+    }
+)
+def get_job(job_id):
+    try:
+        job_oid = ObjectId(job_id)
+    except Exception:
+        abort(400, description="Некорректный ID задачи")
+
+    job = database.jobs.find_one(
+        {"_id": job_oid, "user_id": ObjectId(current_user.id)}
+    )
+    if not job:
+        abort(404, description="Задача не найдена или доступ запрещён")
+
+    result = {
+        "id": str(job["_id"]),
+        "status": job["status"],
+        "filename": job["filename"],
+        "collection_id": str(job["collection_id"]),
+    }
+    if "result" in job:
+        result["result"] = job["result"]
+    if "error" in job:
+        result["error"] = job["error"]
+    return jsonify(result)
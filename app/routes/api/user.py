@@ -2,7 +2,7 @@ from flask import Blueprint, jsonify, request
 from flasgger import swag_from
 import hashlib
 from bson import ObjectId
-from app.data import database
+from app.repository import repository
 from flask_login import login_required, current_user, logout_user
 
 api_user_bp = Blueprint("api_user", __name__)
@@ -58,11 +58,7 @@ def update_password(user_id):
 
     hashed_password = hashlib.sha256(new_password.encode()).hexdigest()
 
-    result = database.users.update_one(
-        {"_id": user_oid}, {"$set": {"h_password": hashed_password}}
-    )
-
-    if result.matched_count == 0:
+    if not repository.set_password(user_oid, hashed_password):
         return jsonify({"error": "User not found"}), 404
 
     return jsonify({"message": "Password updated successfully"}), 200
@@ -103,14 +99,10 @@ def delete_user(user_id):
     if str(current_user.id) != str(user_id):
         return jsonify({"error": "Unauthorized"}), 403
 
-    result = database.users.delete_one({"_id": user_oid})
-    if result.deleted_count == 0:
+    # Пользователь удаляется вместе с документами и коллекциями
+    if not repository.delete_user(user_oid):
         return jsonify({"error": "User not found"}), 404
 
-    database.collections.delete_many({"user_id": user_oid})
-
-    database.documents.delete_many({"user_id": user_oid})
-
     logout_user()
 
     response = jsonify({"message": "User and all data deleted successfully"})
@@ -1,10 +1,7 @@
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify
 from flasgger import swag_from
-from app.metric import MetricsCollector
-from app.data import database
-
-metrics = MetricsCollector(database)
-
+from app.metric import metrics
+from app.telemetry import registry, CONTENT_TYPE
 
 api_utils_bp = Blueprint("api_utils_bp", __name__)
 
@@ -67,3 +64,20 @@ def metrics_endpoint():
 )
 def version():
     return jsonify({"version": "2.1.1"})
+
+
+@api_utils_bp.route("/metrics")
+@swag_from(
+    {
+        "tags": ["Utils"],
+        "summary": "Метрики в формате Prometheus",
+        "description": "Счетчики и гистограммы времени HTTP-запросов (по шаблону "
+        "маршрута), стадий обработки загрузок и команд MongoDB, сложенные по всем "
+        "процессам приложения. Снимки других процессов обновляются не реже, чем раз "
+        "в APP_METRICS_FLUSH_INTERVAL секунд.",
+        "produces": ["text/plain"],
+        "responses": {200: {"description": "Метрики в текстовом формате Prometheus"}},
+    }
+)
+def prometheus_metrics():
+    return Response(registry.render(), content_type=CONTENT_TYPE)
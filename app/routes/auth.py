@@ -1,5 +1,6 @@
 from flask import request, Blueprint, render_template, redirect, url_for, flash
-from app.data import database, User
+from app.data import User
+from app.repository import repository
 import hashlib
 from flask_login import login_user, current_user
 
@@ -15,7 +16,7 @@ def login():
             flash("Пожалуйста, заполните все поля")
             return render_template("login.html")
         # Проверка на существование пользователя
-        existing_user = database.users.find_one({"email": request.form["email"]})
+        existing_user = repository.find_user_by_email(request.form["email"])
         if existing_user:
             if (
                 hashlib.sha256(
@@ -48,9 +49,9 @@ def register():
             flash("Неверный повтор пароля")
             return render_template("register.html")
         # Проверка на существование пользователя
-        existing_user = database.users.find_one(
-            {"username": request.form["username"]}
-        ) or database.users.find_one({"email": request.form["email"]})
+        existing_user = repository.find_user_by_name_or_email(
+            request.form["username"], request.form["email"]
+        )
         if existing_user:
             if existing_user["email"] == request.form["email"]:
                 flash("Этот адрес занят")
@@ -58,16 +59,13 @@ def register():
             if existing_user["username"] == request.form["username"]:
                 flash("Этот ник занят")
                 return render_template("register.html")
-        user = {
-            "username": request.form["username"],
-            "email": request.form["email"],
-            "h_password": hashlib.sha256(
+        repository.add_user(
+            request.form["username"],
+            request.form["email"],
+            hashlib.sha256(
                 request.form["password"].encode()
             ).hexdigest(),  # Шифрование пароля
-            "collection_ids": [],
-        }
-
-        database.users.insert_one(user)
+        )
         flash("Успешная регистрация! Теперь вы можете войти в свой аккаунт.")
         return render_template("register.html")
     return render_template("register.html")
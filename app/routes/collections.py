@@ -1,12 +1,13 @@
 from flask import Blueprint, abort, request, flash, render_template, redirect
-from bson import ObjectId
-from app.data import database
-from app.utils import allowed_file
+from app.repository import repository
+from app.utils import allowed_file, page_args, split_page
 from flask_login import login_required, current_user
-import time, chardet
-from app.metric import MetricsCollector
+import time
+from app.metric import metrics
 from werkzeug.utils import secure_filename
-from app.handling import file_handling
+from app.handling import ingest_document
+from app.archives import ArchiveError
+from app.vocabulary import CollectionNotFound
 
 
 collections_bp = Blueprint("collections_bp", __name__)
@@ -20,62 +21,61 @@ def collections():
             flash("Пожалуйста, введите имя коллекции")
         else:
             name = request.form["collection_name"].strip()
-            existing_collection = database.collections.find_one(
-                {"user_id": current_user.id, "name": name}
+            existing_collection = repository.find_collection_by_name(
+                current_user.id, name
             )  # Ищем коллекции с айди текущего пользователя и с именем name...
             if existing_collection:
                 flash(
                     "Данная коллекция уже существует"
                 )  # ...выводим ошибку, если такая коллекция существует
             else:
-                collection = {"user_id": current_user.id, "name": name, "doc_ids": []}
-                insert_res = database.collections.insert_one(collection)
-                database.users.update_one(
-                    {"_id": ObjectId(current_user.id)},
-                    {
-                        "$push": {"collection_ids": insert_res.inserted_id}
-                    },  # Добавляем в поле collection_ids id только что созданной колекции.
-                )
+                # Коллекция добавляется и в поле collection_ids пользователя
+                repository.add_collection(current_user.id, name)
                 flash("Коллекция успешно создана!")
 
-    user_collections = list(
-        database.collections.find({"user_id": current_user.id})
+    user_collections = repository.list_user_collections(
+        current_user.id
     )  # Ищем все коллекции текущего пользователя, передавая их в шаблон
     return render_template("collections.html", collections=user_collections)
 
 
+# Размер страницы списка документов коллекции
+DOCUMENTS_PAGE_SIZE = 100
+
+
 @collections_bp.route("/collections/<collection_id>/documents", methods=["GET", "POST"])
 @login_required
 def documents(collection_id: str):
-    collection = database.collections.find_one({"_id": ObjectId(collection_id)})
+    collection = repository.get_collection(collection_id)
     if not collection or collection["user_id"] != current_user.id:
         abort(403)  # Запрет, если происходит попытка получить доступ к чужим документам
-    collection_documents = list(
-        database.documents.find({"collection_id": ObjectId(collection_id)})
-    )  # Сбор всех документов, с полем collection_id = collection_id
+    try:
+        after, limit = page_args(request.args, DOCUMENTS_PAGE_SIZE, DOCUMENTS_PAGE_SIZE)
+    except ValueError:
+        abort(400)
+    # Страница документов с полем collection_id = collection_id, только ID и имена
+    collection_documents, next_cursor = split_page(
+        repository.list_collection_documents(collection_id, after, limit + 1), limit
+    )
     return render_template(
-        "documents.html", collection=collection, documents=collection_documents
+        "documents.html",
+        collection=collection,
+        documents=collection_documents,
+        next_cursor=next_cursor,
     )
 
 
 @collections_bp.route("/collections/<collection_id>/delete", methods=["GET", "POST"])
 @login_required
 def delete_collection(collection_id):
-    collection = database.collections.find_one({"_id": ObjectId(collection_id)})
+    collection = repository.get_collection(collection_id)
     if not collection or collection["user_id"] != current_user.id:
         abort(403)
-    result = database.collections.delete_one(
-        {"_id": ObjectId(collection_id), "user_id": current_user.id}
-    )
-    if result.deleted_count:
+    if repository.delete_collection(collection_id, current_user.id):
         flash("Коллекция удалена")
     else:
         flash("Коллекция не найдена")
-    user_collections = list(database.collections.find({"user_id": current_user.id}))
-    database.users.update_one(
-        {"_id": ObjectId(current_user.id)},
-        {"$pull": {"collection_ids": ObjectId(collection_id)}},
-    )
+    user_collections = repository.list_user_collections(current_user.id)
 
     return render_template("collections.html", collections=user_collections)
 
@@ -83,8 +83,7 @@ def delete_collection(collection_id):
 @collections_bp.route("/collections/<collection_id>/upload", methods=["GET", "POST"])
 @login_required
 def upload(collection_id):
-    metrics = MetricsCollector(database)
-    collection = database.collections.find_one({"_id": ObjectId(collection_id)})
+    collection = repository.get_collection(collection_id)
     if not collection or collection["user_id"] != current_user.id:
         abort(403)
 
@@ -98,15 +97,16 @@ def upload(collection_id):
             return redirect(request.url)
         if file and allowed_file(file.filename):
             filename = secure_filename(file.filename)
-            raw_data = file.read()
-            encoding = chardet.detect(raw_data)["encoding"]
-            if encoding is None:
-                encoding = "utf-8"
-            content = raw_data.decode(encoding)
             start = time.time()
-            words_data = file_handling(
-                content, filename, collection_id, current_user.id
-            )
+            try:
+                words_data = ingest_document(
+                    file.stream, filename, collection_id, current_user.id
+                )["statistics"]
+            except ArchiveError as e:
+                flash(str(e))
+                return redirect(request.url)
+            except CollectionNotFound:
+                abort(404)
             duration = round(time.time() - start, 3)
             metrics.register_file_processed(duration)
             return render_template(
@@ -0,0 +1,323 @@
+import atexit
+import bisect
+import json
+import os
+import tempfile
+import threading
+import time
+from flask import g, request
+from pymongo import monitoring
+from app.config import METRICS_DIR, METRICS_FLUSH_INTERVAL
+from app.utils import process_token
+
+# Границы корзин гистограмм времени по умолчанию, в секундах
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+# Счетчик: значение на каждый набор значений меток (кортеж в порядке labels)
+class Counter:
+    kind = "counter"
+
+    def __init__(self, registry, name: str, help: str, labels: tuple):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.samples = {}
+
+    def inc(self, *values, amount: float = 1):
+        with self.registry.lock:
+            self.samples[values] = self.samples.get(values, 0) + amount
+
+
+# Гистограмма: на каждый набор значений меток - количества по корзинам
+# (не накопленные, последняя - больше buckets[-1]), сумма и количество
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self, registry, name: str, help: str, labels: tuple, buckets=DEFAULT_BUCKETS
+    ):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        self.samples = {}
+
+    def observe(self, value: float, *values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.registry.lock:
+            sample = self.samples.get(values)
+            if sample is None:
+                sample = self.samples[values] = [0] * (len(self.buckets) + 1) + [0.0]
+            sample[index] += 1
+            sample[-1] += value
+
+
+# Реестр метрик процесса. Метрики обновляются в памяти под одной блокировкой;
+# для выдачи по всем процессам приложения (несколько воркеров gunicorn) каждый
+# процесс сохраняет снимок реестра в METRICS_DIR/<метка процесса>.json не чаще,
+# чем раз в METRICS_FLUSH_INTERVAL секунд, а эндпоинт складывает снимки всех
+# процессов. Метка - pid и случайная часть (utils.process_token), поэтому новый
+# процесс с тем же pid не перезаписывает чужой снимок; снимки завершившихся
+# процессов удаляются (prune).
+class Registry:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+        self.metrics = {}
+        self._flushed = 0.0
+
+    def counter(self, name: str, help: str, labels: tuple = ()) -> Counter:
+        self.metrics[name] = Counter(self, name, help, labels)
+        return self.metrics[name]
+
+    def histogram(self, name: str, help: str, labels: tuple = (), **kwargs):
+        self.metrics[name] = Histogram(self, name, help, labels, **kwargs)
+        return self.metrics[name]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                name: {
+                    "kind": metric.kind,
+                    "help": metric.help,
+                    "labels": list(metric.labels),
+                    "buckets": list(getattr(metric, "buckets", [])),
+                    "samples": [
+                        [
+                            list(values),
+                            list(sample) if metric.kind == "histogram" else sample,
+                        ]
+                        for values, sample in metric.samples.items()
+                    ],
+                }
+                for name, metric in self.metrics.items()
+            }
+
+    # Сохраняет снимок реестра процесса; файл заменяется атомарно
+    def flush(self):
+        self._flushed = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        data = json.dumps(self.snapshot())
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.directory, suffix=".tmp", delete=False
+        ) as file:
+            file.write(data)
+        os.replace(file.name, os.path.join(self.directory, f"{process_token()}.json"))
+
+    # Удаляет снимки завершившихся процессов: их счетчики выпадают из суммы,
+    # что Prometheus считает сбросом счетчика. Снимок без метки (старый формат
+    # <pid>.json) и снимок с pid текущего процесса, но чужой меткой, тоже
+    # принадлежат завершившимся процессам. Возвращает количество удаленных снимков.
+    def prune(self) -> int:
+        current = process_token()
+        removed = 0
+        try:
+            filenames = os.listdir(self.directory)
+        except FileNotFoundError:
+            return 0
+        for filename in filenames:
+            if not filename.endswith(".json") or filename == f"{current}.json":
+                continue
+            pid, _, token = filename[: -len(".json")].partition("-")
+            if (
+                token
+                and pid.isdigit()
+                and int(pid) != os.getpid()
+                and _process_alive(int(pid))
+            ):
+                continue
+            try:
+                os.remove(os.path.join(self.directory, filename))
+                removed += 1
+            except FileNotFoundError:
+                pass
+        return removed
+
+    def maybe_flush(self):
+        if time.monotonic() - self._flushed >= METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    # Сумма снимков всех процессов: {имя: описание метрики с samples
+    # {значения меток: значение}}. Снимок текущего процесса сначала обновляется.
+    def collect(self) -> dict:
+        self.flush()
+        self.prune()
+        merged = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if not filename.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            for name, metric in snapshot.items():
+                target = merged.setdefault(name, {**metric, "samples": {}})
+                for values, sample in metric["samples"]:
+                    key = tuple(values)
+                    if metric["kind"] == "counter":
+                        target["samples"][key] = target["samples"].get(key, 0) + sample
+                    elif key in target["samples"]:
+                        target["samples"][key] = [
+                            a + b for a, b in zip(target["samples"][key], sample)
+                        ]
+                    else:
+                        target["samples"][key] = list(sample)
+        return merged
+
+    # Текстовый формат Prometheus по сумме снимков всех процессов
+    def render(self) -> str:
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for values, sample in sorted(metric["samples"].items()):
+                pairs = list(zip(metric["labels"], values))
+                if metric["kind"] == "counter":
+                    lines.append(f"{name}{_labels(pairs)} {_number(sample)}")
+                    continue
+                cumulative = 0
+                bounds = [_number(bound) for bound in metric["buckets"]] + ["+Inf"]
+                for bound, count in zip(bounds, sample):
+                    cumulative += count
+                    lines.append(
+                        f"{name}_bucket{_labels(pairs + [('le', bound)])} {cumulative}"
+                    )
+                lines.append(f"{name}_sum{_labels(pairs)} {_number(sample[-1])}")
+                lines.append(f"{name}_count{_labels(pairs)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+# Проверка, что процесс с таким pid существует (сигнал 0 ничего не посылает).
+# На Windows os.kill завершает процесс, поэтому там процесс считается живым.
+def _process_alive(pid: int) -> bool:
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Процесс есть, но принадлежит другому пользователю
+    return True
+
+
+def _number(value) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _labels(pairs) -> str:
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+registry = Registry(METRICS_DIR)
+atexit.register(registry.flush)
+
+HTTP_REQUESTS = registry.counter(
+    "http_requests_total",
+    "Количество HTTP-запросов",
+    ("method", "endpoint", "status"),
+)
+HTTP_DURATION = registry.histogram(
+    "http_request_duration_seconds",
+    "Время обработки HTTP-запроса (без отправки потокового ответа)",
+    ("method", "endpoint"),
+)
+INGEST_STAGE_DURATION = registry.histogram(
+    "ingest_stage_duration_seconds",
+    "Время стадии обработки загруженного файла",
+    ("stage",),
+)
+MONGO_DURATION = registry.histogram(
+    "mongodb_command_duration_seconds",
+    "Время выполнения команды MongoDB",
+    ("command", "collection"),
+)
+MONGO_FAILURES = registry.counter(
+    "mongodb_command_failures_total",
+    "Количество команд MongoDB, завершившихся ошибкой",
+    ("command", "collection"),
+)
+
+
+# Время каждой команды MongoDB. Коллекция известна только в событии начала
+# команды, поэтому она запоминается по request_id до события завершения.
+class MongoCommandTimer(monitoring.CommandListener):
+    def __init__(self):
+        self._collections = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        self._collections[event.request_id] = (
+            collection if isinstance(collection, str) else ""
+        )
+
+    def succeeded(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_DURATION.observe(
+            event.duration_micros / 1e6, event.command_name, collection
+        )
+
+    def failed(self, event):
+        collection = self._collections.pop(event.request_id, "")
+        MONGO_DURATION.observe(
+            event.duration_micros / 1e6, event.command_name, collection
+        )
+        MONGO_FAILURES.inc(event.command_name, collection)
+
+
+def observe_stages(timings: dict):
+    for stage, seconds in timings.items():
+        INGEST_STAGE_DURATION.observe(seconds, stage)
+
+
+# Замер запросов приложения. Метка endpoint - шаблон маршрута (/api/documents/<id>),
+# а не путь, чтобы число наборов меток не росло с количеством документов.
+def instrument_app(app):
+    registry.prune()  # Снимки процессов прошлого запуска
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.pop("request_started", None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else "<unmatched>"
+            HTTP_DURATION.observe(
+                time.perf_counter() - started, request.method, endpoint
+            )
+            HTTP_REQUESTS.inc(request.method, endpoint, str(response.status_code))
+            registry.maybe_flush()
+        return response
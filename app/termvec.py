@@ -0,0 +1,80 @@
+import struct
+import zlib
+from array import array
+from itertools import accumulate
+
+# Упакованный вектор частот слов документа.
+# Формат: 1 байт версии + сжатое zlib тело.
+# Версия 1 (слова):
+#   uint32 n | n x uint32 количества | слова в UTF-8, отсортированные и разделенные "\0".
+#   Слова не могут содержать "\0" (это не буквенный символ), поэтому разделитель безопасен.
+# Версия 2 (ID слов из словаря коллекции, см. vocabulary.py):
+#   uint32 n | n x uint32 разности отсортированных ID | n x uint32 количества.
+#   Разности ID маленькие и хорошо сжимаются.
+FORMAT_WORDS = 1
+FORMAT_IDS = 2
+
+_HEADER = struct.Struct("<I")
+
+# Проекция полей, достаточных для получения частот слов документа (без content)
+TERMS_PROJECTION = {"terms": 1, "words": 1, "words_num": 1, "vocabulary_id": 1}
+
+
+def vector_format(blob: bytes) -> int:
+    return blob[0]
+
+
+# Упаковка словаря {слово: количество} в формат версии 1
+def pack_terms(count: dict) -> bytes:
+    words = sorted(count)
+    counts = array("I", (count[word] for word in words))
+    body = _HEADER.pack(len(words)) + counts.tobytes() + "\0".join(words).encode()
+    return bytes([FORMAT_WORDS]) + zlib.compress(body)
+
+
+# Распаковка вектора версии 1 в словарь {слово: количество}
+def unpack_terms(blob: bytes) -> dict:
+    if blob[0] != FORMAT_WORDS:
+        raise ValueError(f"Неизвестный формат вектора слов: {blob[0]}")
+    body = zlib.decompress(blob[1:])
+    (n,) = _HEADER.unpack_from(body)
+    if n == 0:
+        return {}
+    counts = array("I")
+    counts.frombytes(body[_HEADER.size : _HEADER.size + 4 * n])
+    words = body[_HEADER.size + 4 * n :].decode().split("\0")
+    return dict(zip(words, counts))
+
+
+# Упаковка словаря {ID слова: количество} в формат версии 2
+def pack_ids(count: dict) -> bytes:
+    ids = sorted(count)
+    deltas = array("I", (b - a for a, b in zip([0] + ids, ids)))
+    counts = array("I", (count[term_id] for term_id in ids))
+    body = _HEADER.pack(len(ids)) + deltas.tobytes() + counts.tobytes()
+    return bytes([FORMAT_IDS]) + zlib.compress(body)
+
+
+# Распаковка вектора версии 2 в словарь {ID слова: количество}
+def unpack_ids(blob: bytes) -> dict:
+    if blob[0] != FORMAT_IDS:
+        raise ValueError(f"Неизвестный формат вектора слов: {blob[0]}")
+    body = zlib.decompress(blob[1:])
+    (n,) = _HEADER.unpack_from(body)
+    deltas = array("I")
+    deltas.frombytes(body[_HEADER.size : _HEADER.size + 4 * n])
+    counts = array("I")
+    counts.frombytes(body[_HEADER.size + 4 * n : _HEADER.size + 8 * n])
+    return dict(zip(accumulate(deltas), counts))
+
+
+# Количества слов документа, хранящего слова строками: вектор версии 1 или,
+# для документов, загруженных до появления поля terms, топ-50 слов с tf
+# (количества восстанавливаются приближенно).
+def legacy_counts(doc: dict) -> dict:
+    if doc.get("terms") is not None:
+        return unpack_terms(doc["terms"])
+    words_num = doc.get("words_num", 0)
+    return {
+        word["word"]: round(word["tf"] * words_num) for word in doc.get("words", [])
+    }
@@ -0,0 +1,101 @@
+import os
+import re
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from app.config import PARALLEL_COUNT_WORKERS, PARALLEL_COUNT_BATCH
+
+WORD_SPLIT = re.compile(r"\W+")
+SPACE = re.compile(r"\s")
+NON_WORD = re.compile(r"\W")
+
+# Максимальная длина хвоста без пробельных символов, который переносится в следующий кусок
+MAX_CARRY = 1024 * 1024
+
+
+# Подсчет слов в тексте: приводим к нижнему регистру и делим по не-буквенным символам.
+def count_words(text: str) -> Counter:
+    return Counter(filter(None, WORD_SPLIT.split(text.lower())))
+
+
+# Позиция сразу после последнего совпадения pattern в тексте (0, если совпадений нет).
+# Поиск идет по развернутой строке, поэтому стоит столько, сколько длится хвост.
+def _cut_after_last(pattern, text: str) -> int:
+    match = pattern.search(text[::-1])
+    return len(text) - match.start() if match else 0
+
+
+# Перегруппировка потока кусков текста в сегменты, заканчивающиеся на границе слова.
+# Режем после пробельного символа: так и деление на слова, и lower() дают тот же
+# результат, что и для цельного текста (контекст греческой сигмы не пересекает пробел).
+# В памяти хранится только текущий кусок и недописанное слово с его конца.
+def iter_segments(chunks):
+    carry = ""
+    for chunk in chunks:
+        cut = _cut_after_last(SPACE, chunk)
+        if cut:
+            yield carry + chunk[:cut]
+            carry = chunk[cut:]
+            continue
+        carry += chunk
+        if len(carry) > MAX_CARRY:
+            # Очень длинный фрагмент без пробелов: режем по любому не-буквенному символу,
+            # а если его нет - как есть
+            cut = _cut_after_last(NON_WORD, carry) or len(carry)
+            yield carry[:cut]
+            carry = carry[cut:]
+    if carry:
+        yield carry
+
+
+# Потоковый подсчет слов: хранится только общий счетчик, память зависит от словаря,
+# а не от размера файла.
+def count_segments(segments) -> Counter:
+    count = Counter()
+    for segment in segments:
+        count.update(count_words(segment))
+    return count
+
+
+POOL_WORKERS = PARALLEL_COUNT_WORKERS or os.cpu_count() or 1
+_pool = None
+
+
+# Пул процессов создается при первой обработке большого файла и живет до конца работы.
+# Используется также кодированием Хаффмана (huffman.py).
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_WORKERS)
+    return _pool
+
+
+# Склейка соседних сегментов в части размером не меньше batch_size символов.
+# Сегменты заканчиваются на границе слова, поэтому и части тоже.
+def _iter_batches(segments, batch_size: int):
+    batch, size = [], 0
+    for segment in segments:
+        batch.append(segment)
+        size += len(segment)
+        if size >= batch_size:
+            yield "".join(batch)
+            batch, size = [], 0
+    if batch:
+        yield "".join(batch)
+
+
+# Многопроцессный подсчет слов. Части считаются в пуле процессов, частичные счетчики
+# объединяются строго в порядке частей, поэтому результат (включая порядок слов
+# с равной частотой) совпадает с count_segments. Число частей в работе ограничено,
+# чтобы не держать в памяти весь текст.
+def count_segments_parallel(segments) -> Counter:
+    pool = get_pool()
+    max_pending = POOL_WORKERS * 2
+    pending = deque()
+    count = Counter()
+    for batch in _iter_batches(segments, PARALLEL_COUNT_BATCH):
+        pending.append(pool.submit(count_words, batch))
+        if len(pending) >= max_pending:
+            count.update(pending.popleft().result())
+    while pending:
+        count.update(pending.popleft().result())
+    return count
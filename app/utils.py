@@ -1,5 +1,74 @@
+import os
+import uuid
+from bson import ObjectId
+from bson.errors import InvalidId
 from app.config import ALLOWED_EXTENSIONS
 
-# Функция проверки расширения файла на допустимость обработки
+# Расширения сжатых файлов, в каждом из которых один файл
+COMPRESSED_EXTENSIONS = ("gz", "bz2", "xz")
+# Расширения архивов, в которых может быть несколько файлов
+ARCHIVE_EXTENSIONS = ("zip",)
+
+
+# Функция проверки расширения файла на допустимость обработки.
+# Сжатый файл допустим, если допустим файл внутри (text.txt.gz) или у имени
+# нет другого расширения (text.gz); архив - всегда, его файлы проверяются
+# при распаковке (app/archives.py)
 def allowed_file(filename):
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
\ No newline at end of file
+    if "." not in filename:
+        return False
+    name, extension = filename.rsplit(".", 1)
+    extension = extension.lower()
+    if extension in ARCHIVE_EXTENSIONS:
+        return True
+    if extension in COMPRESSED_EXTENSIONS:
+        return "." not in name or allowed_text_file(name)
+    return extension in ALLOWED_EXTENSIONS
+
+
+# Проверка расширения несжатого файла, в том числе файла внутри архива
+def allowed_text_file(filename):
+    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+# Разбор параметров постраничного вывода по курсору: after - ID последней записи
+# предыдущей страницы, limit - размер страницы. prefix позволяет читать параметры
+# вложенного списка (например, documents_limit). При ошибке бросает ValueError
+# с текстом для ответа клиенту.
+def page_args(args, default_limit: int, max_limit: int, prefix: str = "") -> tuple:
+    try:
+        limit = int(args.get(prefix + "limit", default_limit))
+    except ValueError:
+        raise ValueError(f"{prefix}limit должен быть целым числом")
+    try:
+        after = args.get(prefix + "after")
+        after = ObjectId(after) if after else None
+    except InvalidId:
+        raise ValueError(f"Некорректный ID в параметре {prefix}after")
+    if not 0 < limit <= max_limit:
+        raise ValueError(f"{prefix}limit должен быть от 1 до {max_limit}")
+    return after, limit
+
+
+# Отделяет лишнюю запись, выбранную сверх limit: если она есть, следующая страница
+# существует и ее курсор - ID последней записи текущей. Возвращает (записи, курсор).
+def split_page(items: list, limit: int) -> tuple:
+    if len(items) > limit:
+        return items[:limit], str(items[limit - 1]["_id"])
+    return items, None
+
+
+_process_token = (None, None)
+
+
+# Метка текущего процесса: pid и случайная часть, поэтому новый процесс
+# с повторно использованным pid получает другую метку. После fork метка
+# создается заново.
+def process_token() -> str:
+    global _process_token
+    pid, token = _process_token
+    if pid != os.getpid():
+        pid = os.getpid()
+        token = f"{pid}-{uuid.uuid4().hex[:12]}"
+        _process_token = (pid, token)
+    return token
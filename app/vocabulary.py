@@ -0,0 +1,134 @@
+import threading
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+from app.cache import LRUCache
+
+# Сколько слов (или ID) передается в одном $in и записывается одним insert_many:
+# словарь документа может содержать сотни тысяч слов, а команда MongoDB
+# ограничена 16 МБ
+LOOKUP_BATCH_SIZE = 10000
+# Код ошибки MongoDB "дубликат ключа"
+DUPLICATE_KEY = 11000
+
+
+# Коллекция, которой нет в базе (например, удалена во время загрузки)
+class CollectionNotFound(LookupError):
+    pass
+
+
+# Словарь одной коллекции в памяти процесса: слово <-> целочисленный ID
+class _CollectionVocabulary:
+    def __init__(self):
+        self.ids = {}
+        self.words = {}
+        self.lock = threading.Lock()
+
+    def add(self, word: str, term_id: int):
+        self.ids[word] = term_id
+        self.words[term_id] = word
+
+
+# Словарь слов коллекций. Каждому слову коллекции назначается постоянный ID,
+# записи хранятся в MongoDB ({collection_id, word, term_id}) и кэшируются в процессе.
+# Записи словаря никогда не меняются, поэтому кэш не нужно сбрасывать: при промахе
+# недостающие слова дочитываются из базы.
+class Vocabulary:
+    def __init__(self, table, collections, cache_size: int):
+        self.table = table
+        self.collections = collections
+        self._cache = LRUCache(cache_size)
+        self._cache_lock = threading.Lock()
+
+    def _get(self, collection_id: ObjectId) -> _CollectionVocabulary:
+        with self._cache_lock:
+            vocabulary = self._cache.get(collection_id)
+            if vocabulary is None:
+                vocabulary = _CollectionVocabulary()
+                self._cache.set(collection_id, vocabulary)
+            return vocabulary
+
+    # Дочитывает записи словаря, у которых поле field (word или term_id) входит
+    # в values, запросами по LOOKUP_BATCH_SIZE значений
+    def _load(self, vocabulary: _CollectionVocabulary, collection_id, field, values):
+        for start in range(0, len(values), LOOKUP_BATCH_SIZE):
+            query = {
+                "collection_id": collection_id,
+                field: {"$in": values[start : start + LOOKUP_BATCH_SIZE]},
+            }
+            for row in self.table.find(query, {"_id": 0, "word": 1, "term_id": 1}):
+                vocabulary.add(row["word"], row["term_id"])
+
+    # Назначение ID новым словам. Диапазон ID резервируется одним $inc счетчика
+    # коллекции; если слово уже успел добавить другой процесс, берется его ID
+    # (уникальный индекс по слову коллекции объявлен в indexes.py).
+    # Если коллекции уже нет, бросает CollectionNotFound.
+    def _allocate(self, collection_id, vocabulary, words: list):
+        counter = self.collections.find_one_and_update(
+            {"_id": collection_id},
+            {"$inc": {"next_term_id": len(words)}},
+            projection={"next_term_id": 1},
+            return_document=ReturnDocument.AFTER,
+        )
+        if counter is None:
+            raise CollectionNotFound(f"Коллекция {collection_id} не найдена")
+        first_id = counter["next_term_id"] - len(words)
+        for start in range(0, len(words), LOOKUP_BATCH_SIZE):
+            batch = words[start : start + LOOKUP_BATCH_SIZE]
+            rows = [
+                {
+                    "collection_id": collection_id,
+                    "word": word,
+                    "term_id": first_id + start + i,
+                }
+                for i, word in enumerate(batch)
+            ]
+            try:
+                self.table.insert_many(rows, ordered=False)
+            except BulkWriteError as e:
+                errors = e.details.get("writeErrors", [])
+                if any(error["code"] != DUPLICATE_KEY for error in errors):
+                    raise
+                # Часть слов уже есть в базе: перечитываем слова части,
+                # их ID и будут верными
+                self._load(vocabulary, collection_id, "word", batch)
+                continue
+            for row in rows:
+                vocabulary.add(row["word"], row["term_id"])
+
+    # Возвращает {слово: ID} для переданных слов коллекции.
+    # При create=True слова, которых нет в словаре, получают новые ID (если
+    # коллекции нет - CollectionNotFound), иначе они просто отсутствуют в результате.
+    def ids_for(self, collection_id, words, create: bool = True) -> dict:
+        collection_id = ObjectId(collection_id)
+        vocabulary = self._get(collection_id)
+        with vocabulary.lock:
+            missing = [word for word in words if word not in vocabulary.ids]
+            if missing:
+                self._load(vocabulary, collection_id, "word", missing)
+                missing = [word for word in missing if word not in vocabulary.ids]
+                if missing and create:
+                    self._allocate(collection_id, vocabulary, missing)
+            ids = vocabulary.ids
+            return {word: ids[word] for word in words if word in ids}
+
+    # Возвращает {ID: слово} для переданных ID слов коллекции
+    def words_for(self, collection_id, term_ids) -> dict:
+        collection_id = ObjectId(collection_id)
+        vocabulary = self._get(collection_id)
+        with vocabulary.lock:
+            missing = [
+                term_id for term_id in term_ids if term_id not in vocabulary.words
+            ]
+            if missing:
+                self._load(vocabulary, collection_id, "term_id", missing)
+            words = vocabulary.words
+            return {term_id: words[term_id] for term_id in term_ids if term_id in words}
+
+    # Удаляет словари удаленных коллекций
+    def drop(self, collection_ids: list):
+        collection_ids = [ObjectId(cid) for cid in collection_ids]
+        self.table.delete_many({"collection_id": {"$in": collection_ids}})
+        with self._cache_lock:
+            for collection_id in collection_ids:
+                self._cache.pop(collection_id)